@@ -8,56 +8,62 @@ from dotenv import load_dotenv
 from backend.query_generator import QueryGenerator
 from backend.search_engine import SearchEngine
 from backend.content_processor import ContentProcessor
+from backend.history_store import HistoryStore
+from backend.pipeline import SearchPipeline
+from backend.rate_limiter import gemini_scheduler
+from backend.metrics import metrics, StageTimings
+from backend.ranker import LEXICAL_TOP_K
+from backend.jobs import JobManager
+from backend.prompts import preload_prompts
 
 load_dotenv()
 
 app = Flask(__name__)
 
 # --- CẤU HÌNH LƯU TRỮ ---
-HISTORY_FILE = 'chat_history.json'
+HISTORY_FILE = 'chat_history.json'  # Định dạng cũ, chỉ dùng để migrate một lần
+HISTORY_DB = os.getenv('HISTORY_DB', 'chat_history.db')
 
-def load_history():
-    """Đọc lịch sử từ file JSON"""
-    if not os.path.exists(HISTORY_FILE):
-        return []
-    try:
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except:
-        return []
+history_store = HistoryStore(HISTORY_DB, legacy_json_path=HISTORY_FILE)
 
-def save_history(data):
-    """Ghi lịch sử vào file JSON"""
-    try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"[STORAGE ERROR] Could not save history: {e}")
-
-def get_chat_by_id(chat_id, history):
-    for chat in history:
-        if chat['id'] == chat_id:
-            return chat
-    return None
+# Lượt tìm kiếm chạy nền, tách khỏi kết nối HTTP (reload trang / mất mạng vẫn đọc tiếp được)
+jobs = JobManager()
 
 # --- KHỞI TẠO AI MODULES ---
 q_gen = None
 searchor = None
 processor = None
+pipeline = None
 
 def init_system():
-    global q_gen, searchor, processor
+    global q_gen, searchor, processor, pipeline
     try:
         print("[SYSTEM] Loading modules...")
+        preload_prompts()
         q_gen = QueryGenerator(prompt_path=os.path.join('backend', 'PROMPT', 'SYSTEM_PROMPT.txt'))
-        searchor = SearchEngine()
         processor = ContentProcessor()
+        # Search dùng chung index cục bộ mà ContentProcessor cập nhật sau mỗi lần parse
+        searchor = SearchEngine(doc_index=processor.doc_index)
+        pipeline = SearchPipeline(searchor, processor)
         print("[SYSTEM] Modules ready.")
     except Exception as e:
         print(f"[SYSTEM ERROR] {e}")
 
 init_system()
 
+def format_result_item(res, idx=None):
+    """Markdown cho 1 tài liệu kết quả (dùng cho cả sự kiện match và kết quả cuối)"""
+    icon = "📄 PDF" if res['type'] == 'PDF' else "🌐 WEB"
+    prefix = f"{idx}. " if idx is not None else ""
+    text = f"#### {prefix}[{icon}] {res['url']}\n"
+    text += f"- **Score:** {res['score']}/10 ({res['reason']})\n"
+    text += f"- **Page:** {res['page']}\n"
+    if res['sample']:
+        # Đóng gói sample vào block math để frontend dễ xử lý
+        text += f"\n**Bài tập mẫu:**\n$${res['sample']}$$\n"
+    text += "\n___\n"
+    return text
+
 # --- ROUTES ---
 
 @app.route('/')
@@ -66,165 +72,307 @@ def index():
 
 @app.route('/api/history', methods=['GET'])
 def get_all_history():
-    """API lấy toàn bộ lịch sử"""
-    return jsonify(load_history())
+    """API lấy danh sách hội thoại (chỉ tóm tắt, có phân trang)"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    chats, total = history_store.list_chats(limit=limit, offset=offset)
+    return jsonify({"chats": chats, "total": total, "limit": limit, "offset": offset})
+
+@app.route('/api/history/<chat_id>', methods=['GET'])
+def get_chat(chat_id):
+    """API lấy toàn bộ tin nhắn của một cuộc trò chuyện"""
+    chat = history_store.get_chat(chat_id)
+    if not chat:
+        return jsonify({"error": "Chat not found"}), 404
+    # Lượt tìm kiếm còn đang chạy -> frontend nối lại stream của job
+    job = jobs.active_for_chat(chat_id)
+    chat["active_job"] = job.info() if job else None
+    return jsonify(chat)
 
 @app.route('/api/history/<chat_id>', methods=['DELETE'])
 def delete_chat(chat_id):
     """API xóa một cuộc trò chuyện"""
-    history = load_history()
-    new_history = [c for c in history if c['id'] != chat_id]
-    save_history(new_history)
+    history_store.delete_chat(chat_id)
     return jsonify({"success": True})
 
-@app.route('/api/chat-stream', methods=['POST'])
-def chat_stream():
-    data = request.json
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Counter / histogram theo định dạng Prometheus (thời gian từng stage, cache, 429, retry, byte, token)"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """API xem trạng thái cache, hàng đợi Gemini (queue depth, thời gian chờ, số lần 429) và job nền"""
+    return jsonify({
+        "gemini": gemini_scheduler.stats(),
+        "cache": processor.cache_stats() if processor else {},
+        "plans": q_gen.plan_cache.stats() if q_gen else {},
+        "http": processor.http.stats() if processor else {},
+        "jobs": jobs.stats(),
+    })
+
+def chat_settings(config):
+    """Cấu hình 1 lượt tìm kiếm nhận từ frontend (giá trị mặc định nếu thiếu)."""
+    return {
+        # Mặc định là 3 query, 3 kết quả mỗi query nếu không có config
+        "max_queries": int(config.get('max_queries', 3)),
+        "results_per_query": int(config.get('results_per_query', 3)),
+        # Mục tiêu dừng sớm (tùy chọn): đủ N tài liệu score >= min_score, hoặc quá deadline (giây)
+        "stop_after": int(config['stop_after']) if config.get('stop_after') else None,
+        "min_score": int(config.get('min_score', 8)),
+        "deadline": float(config['deadline_seconds']) if config.get('deadline_seconds') else None,
+        # Số tài liệu tối đa gửi Gemini thẩm định (sau bước lọc lexical cục bộ)
+        "max_verify": int(config.get('max_verify', LEXICAL_TOP_K)),
+        # Gửi thêm sự kiện "timings" (thời gian từng stage) ở cuối stream
+        "include_timings": str(config.get('include_timings', False)).lower() in ('1', 'true', 'yes'),
+    }
+
+def read_chat_request(data):
+    """Đọc request chat của frontend. Trả về (user_input, chat_id, settings), None nếu thiếu dữ liệu."""
     user_input = data.get('message', '')
     chat_id = data.get('chat_id', '') # Frontend gửi ID lên
-    
-    # --- NHẬN CẤU HÌNH TỪ FRONTEND ---
-    config = data.get('config', {})
-    # Mặc định là 3 query, 3 kết quả mỗi query nếu không có config
-    setting_max_queries = int(config.get('max_queries', 3))
-    setting_res_per_query = int(config.get('results_per_query', 3))
-    
+    settings = chat_settings(data.get('config', {}))
+    if not user_input or not chat_id:
+        return None
+    return user_input, chat_id, settings
+
+def chat_job_key(user_input, chat_id, settings):
+    """Khóa gộp job: cùng chat, cùng yêu cầu (đã chuẩn hóa khoảng trắng) và cùng cấu hình."""
+    return json.dumps([chat_id, " ".join(user_input.split()), settings], sort_keys=True)
+
+def record_user_message(user_input, chat_id):
     # Tạo tiêu đề nếu là chat mới (lấy 30 ký tự đầu)
     chat_title = user_input[:30] + "..." if len(user_input) > 30 else user_input
 
-    if not user_input or not chat_id:
-        return Response("Missing data", status=400)
+    # Lưu tin nhắn User ngay lập tức (tạo chat mới nếu chưa có)
+    history_store.ensure_chat(chat_id, chat_title)
+    history_store.append_message(chat_id, {"role": "user", "content": user_input})
 
-    # 1. Lưu tin nhắn User vào file ngay lập tức
-    history = load_history()
-    current_chat = get_chat_by_id(chat_id, history)
+def plan_events(search_plan, settings, collected_logs):
+    """Sự kiện log sau bước phân tích ý định (chủ đề, số từ khóa, cấu hình search)."""
+    analysis = search_plan.get("analysis", {})
+    topic_en = analysis.get("topic_en", "General")
+    difficulty = analysis.get("difficulty", "Standard")
     
-    if not current_chat:
-        # Nếu chưa có chat này, tạo mới
-        current_chat = {"id": chat_id, "title": chat_title, "messages": []}
-        history.append(current_chat)
+    log_2 = f"Chủ đề: {topic_en} | Độ khó: {difficulty}"
+    collected_logs.append(log_2)
+
+    # --- BƯỚC 2: TẠO TỪ KHÓA ---
+    # Chỉ mang tính chất log, việc cắt giảm số lượng query thật sự nằm ở bước 3
+    all_queries = search_plan.get('tier_1_topic_focused', []) + search_plan.get('tier_2_context_specific', []) + search_plan.get('tier_3_descriptive_chaining', [])
+    log_3 = f"Đã sinh {len(all_queries)} từ khóa tiềm năng."
+
+    # --- BƯỚC 3: SEARCH (CÓ CẤU HÌNH) ---
+    log_4 = f"Đang tìm kiếm Google (Queries: {settings['max_queries']}, Links/Query: {settings['results_per_query']})..."
+    collected_logs.append(log_4)
+    return [{"type": "log", "content": log} for log in (log_2, log_3, log_4)]
+
+def pipeline_kwargs(settings, chat_id, search_stats, timings, cancel_event=None):
+    return {
+        "max_queries": settings["max_queries"],
+        "results_per_query": settings["results_per_query"],
+        "search_stats": search_stats,
+        "client_id": chat_id,
+        "stop_after": settings["stop_after"],
+        "min_score": settings["min_score"],
+        "deadline": settings["deadline"],
+        "max_verify": settings["max_verify"],
+        "timings": timings,
+        "cancel_event": cancel_event,
+    }
+
+def pipeline_events(update, settings, search_stats, collected_logs):
+    """
+    Sự kiện NDJSON tương ứng với 1 update của pipeline (trừ final_result).
+    Sự kiện "error" kết thúc stream.
+    """
+    if update["type"] == "search_done":
+        events = []
+        if search_stats.get("local_hits"):
+            events.append({"type": "log", "content": f"Lấy {search_stats['local_hits']} liên kết từ kho tài liệu đã tải trước đây."})
+        if search_stats.get("api_calls_saved"):
+            events.append({"type": "log", "content": f"Tiết kiệm {search_stats['api_calls_saved']} lượt gọi Google API nhờ cache / kho cục bộ."})
+
+        if not update["total"]:
+            collected_logs.extend(e["content"] for e in events)
+            return events + [{"type": "error", "content": "Không tìm thấy tài liệu."}]
+
+        events.append({"type": "log", "content": f"Tìm thấy {update['total']} liên kết duy nhất. Đang đọc và thẩm định..."})
+        collected_logs.extend(e["content"] for e in events)
+        return events
+    if update["type"] == "match":
+        # Gửi ngay từng tài liệu đạt, không chờ link chậm nhất
+        return [{
+            "type": "match",
+            "data": update["data"],
+            "content": format_result_item(update["data"])
+        }]
+    if update["type"] == "early_stop":
+        if update["reason"] == "target":
+            log_stop = f"Đã đủ {settings['stop_after']} tài liệu đạt từ {settings['min_score']} điểm, dừng sớm."
+        else:
+            log_stop = f"Hết thời gian {settings['deadline']:g}s, dừng sớm với các kết quả hiện có."
+        collected_logs.append(log_stop)
+        return [{"type": "log", "content": log_stop}]
+    if update["type"] == "gate_summary":
+        if update["skipped"]:
+            log_gate = f"Đã gửi {update['sent']} tài liệu cho AI thẩm định, bỏ qua {update['skipped']} tài liệu ít liên quan."
+            collected_logs.append(log_gate)
+            return [{"type": "log", "content": log_gate}]
+        return []
+    if update["type"] == "progress_update":
+        # Send progress event to frontend
+        return [{
+            "type": "progress", 
+            "current": update["current"],
+            "total": update["total"],
+            "found": update["found"]
+        }]
+    return []
+
+def result_markdown(search_plan, valid_results):
+    """Nội dung trả lời cuối cùng của Bot."""
+    analysis = search_plan.get("analysis", {})
+    topic_en = analysis.get("topic_en", "General")
+    difficulty = analysis.get("difficulty", "Standard")
+    if not valid_results:
+        return f"### Phân tích: {topic_en}\n> Không tìm thấy bài tập phù hợp độ khó {difficulty} trong số các liên kết đã quét."
+
+    final_response = f"### Kết quả phân tích\n"
+    final_response += f"* **Chủ đề:** {topic_en}\n"
+    final_response += f"* **Độ khó:** {difficulty}\n\n"
+    final_response += f"### Tìm thấy {len(valid_results)} tài liệu:\n___\n"
     
-    # Thêm msg của user
-    current_chat['messages'].append({"role": "user", "content": user_input})
-    save_history(history)
-
-    def generate():
-        # Biến tạm để gom nội dung Bot trả về
-        full_bot_response = ""
-        collected_logs = []
-
-        try:
-            # --- BƯỚC 1: SUY NGHĨ ---
-            log_1 = "Đang phân tích ý định người dùng..."
-            collected_logs.append(log_1)
-            yield json.dumps({"type": "log", "content": log_1}) + "\n"
-            
+    for idx, res in enumerate(valid_results, 1):
+        final_response += format_result_item(res, idx)
+    return final_response
+
+def save_bot_response(chat_id, full_bot_response, collected_logs):
+    # Append 1 dòng, không ghi đè thay đổi song song của các stream khác
+    bot_msg = {
+        "role": "bot",
+        "content": full_bot_response if full_bot_response else "Lỗi xử lý hoặc không có phản hồi.",
+        "logs": collected_logs
+    }
+    if history_store.append_message(chat_id, bot_msg):
+        print(f"[SYSTEM] Saved bot response to chat {chat_id}")
+
+def chat_events(user_input, chat_id, settings, cancel_event=None):
+    """
+    Các dòng NDJSON của 1 lượt chat (chạy trong job nền, xem JobManager).
+    cancel_event (Job.cancel_event): job bị hủy -> pipeline dừng fetch / parse / gọi Gemini.
+    """
+    # Biến tạm để gom nội dung Bot trả về
+    full_bot_response = ""
+    collected_logs = []
+
+    try:
+        # --- BƯỚC 1: SUY NGHĨ ---
+        log_1 = "Đang phân tích ý định người dùng..."
+        collected_logs.append(log_1)
+        yield json.dumps({"type": "log", "content": log_1}) + "\n"
+        
+        timings = StageTimings()
+        with gemini_scheduler.client(chat_id, cancel_event=cancel_event), metrics.collect(timings):
             search_plan = q_gen.generate(user_input)
-            
-            if not search_plan:
-                err_msg = "Không thể phân tích yêu cầu."
-                yield json.dumps({"type": "error", "content": err_msg}) + "\n"
-                return
-
-            analysis = search_plan.get("analysis", {})
-            topic_en = analysis.get("topic_en", "General")
-            difficulty = analysis.get("difficulty", "Standard")
-            
-            log_2 = f"Chủ đề: {topic_en} | Độ khó: {difficulty}"
-            collected_logs.append(log_2)
-            yield json.dumps({"type": "log", "content": log_2}) + "\n"
-
-            # --- BƯỚC 2: TẠO TỪ KHÓA ---
-            # Chỉ mang tính chất log, việc cắt giảm số lượng query thật sự nằm ở bước 3
-            all_queries = search_plan.get('tier_1_topic_focused', []) + search_plan.get('tier_2_context_specific', []) + search_plan.get('tier_3_descriptive_chaining', [])
-            log_3 = f"Đã sinh {len(all_queries)} từ khóa tiềm năng."
-            yield json.dumps({"type": "log", "content": log_3}) + "\n"
-
-            # --- BƯỚC 3: SEARCH (CÓ CẤU HÌNH) ---
-            log_4 = f"Đang tìm kiếm Google (Queries: {setting_max_queries}, Links/Query: {setting_res_per_query})..."
-            collected_logs.append(log_4)
-            yield json.dumps({"type": "log", "content": log_4}) + "\n"
-            
-            links = searchor.execute_search_plan(
-                search_plan, 
-                max_queries=setting_max_queries, 
-                results_per_query=setting_res_per_query,
-                max_workers=5
-            )
-            
-            if not links:
-                yield json.dumps({"type": "error", "content": "Không tìm thấy tài liệu."}) + "\n"
-                return
-
-            log_5 = f"Tìm thấy {len(links)} liên kết duy nhất. Đang đọc và thẩm định..."
-            collected_logs.append(log_5)
-            yield json.dumps({"type": "log", "content": log_5}) + "\n"
-
-            # --- BƯỚC 4: PROCESS (STREAMING PROGRESS) ---
-            valid_results = []
-            
-            # Call the new generator function
-            stream_processor = processor.process_links_stream(links, topic_en, difficulty)
-            
-            for update in stream_processor:
-                if update["type"] == "progress_update":
-                    # Send progress event to frontend
-                    yield json.dumps({
-                        "type": "progress", 
-                        "current": update["current"],
-                        "total": update["total"],
-                        "found": update["found"]
-                    }) + "\n"
-                elif update["type"] == "final_result":
-                    valid_results = update["data"]
-            
-            log_6 = f"Hoàn tất. Lọc được {len(valid_results)} tài liệu phù hợp."
-            collected_logs.append(log_6)
-            yield json.dumps({"type": "log", "content": log_6}) + "\n"
-
-            # --- BƯỚC 5: RESULT ---
-            if not valid_results:
-                final_response = f"### Phân tích: {topic_en}\n> Không tìm thấy bài tập phù hợp độ khó {difficulty} trong số các liên kết đã quét."
-            else:
-                final_response = f"### Kết quả phân tích\n"
-                final_response += f"* **Chủ đề:** {topic_en}\n"
-                final_response += f"* **Độ khó:** {difficulty}\n\n"
-                final_response += f"### Tìm thấy {len(valid_results)} tài liệu:\n___\n"
-                
-                for idx, res in enumerate(valid_results, 1):
-                    icon = "📄 PDF" if res['type'] == 'PDF' else "🌐 WEB"
-                    final_response += f"#### {idx}. [{icon}] {res['url']}\n"
-                    final_response += f"- **Score:** {res['score']}/10 ({res['reason']})\n"
-                    final_response += f"- **Page:** {res['page']}\n"
-                    if res['sample']:
-                        # Đóng gói sample vào block math để frontend dễ xử lý
-                        final_response += f"\n**Bài tập mẫu:**\n$${res['sample']}$$\n"
-                    final_response += "\n___\n"
-            
-            full_bot_response = final_response
-            yield json.dumps({"type": "result", "content": final_response}) + "\n"
-
-        except Exception as e:
-            print(f"Error: {e}")
-            yield json.dumps({"type": "error", "content": "Lỗi hệ thống trong quá trình xử lý."}) + "\n"
         
-        finally:
-            # --- BƯỚC CUỐI: LƯU TIN NHẮN BOT VÀO FILE ---
-            # Phải load lại history mới nhất vì có thể có thay đổi song song (dù hiếm)
-            fresh_history = load_history()
-            chat_to_update = get_chat_by_id(chat_id, fresh_history)
-            
-            if chat_to_update:
-                bot_msg = {
-                    "role": "bot",
-                    "content": full_bot_response if full_bot_response else "Lỗi xử lý hoặc không có phản hồi.",
-                    "logs": collected_logs
-                }
-                chat_to_update['messages'].append(bot_msg)
-                save_history(fresh_history)
-                print(f"[SYSTEM] Saved bot response to chat {chat_id}")
-
-    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        if not search_plan:
+            err_msg = "Không thể phân tích yêu cầu."
+            yield json.dumps({"type": "error", "content": err_msg}) + "\n"
+            return
+
+        for event in plan_events(search_plan, settings, collected_logs):
+            yield json.dumps(event) + "\n"
+
+        # --- BƯỚC 4: SEARCH -> FETCH -> VERIFY CHẠY CHỒNG LẤP (STREAMING PROGRESS) ---
+        # Link được tải ngay khi query của nó trả về, không chờ toàn bộ các query
+        analysis = search_plan.get("analysis", {})
+        search_stats = {}
+        valid_results = []
+        
+        stream_processor = pipeline.run(
+            search_plan, analysis.get("topic_en", "General"), analysis.get("difficulty", "Standard"),
+            **pipeline_kwargs(settings, chat_id, search_stats, timings, cancel_event)
+        )
+        
+        for update in stream_processor:
+            if update["type"] == "final_result":
+                valid_results = update["data"]
+                continue
+            for event in pipeline_events(update, settings, search_stats, collected_logs):
+                yield json.dumps(event) + "\n"
+                if event["type"] == "error":
+                    return
+        
+        log_6 = f"Hoàn tất. Lọc được {len(valid_results)} tài liệu phù hợp."
+        collected_logs.append(log_6)
+        yield json.dumps({"type": "log", "content": log_6}) + "\n"
+
+        # --- BƯỚC 5: RESULT ---
+        full_bot_response = result_markdown(search_plan, valid_results)
+        yield json.dumps({"type": "result", "content": full_bot_response}) + "\n"
+
+        if settings["include_timings"]:
+            yield json.dumps({"type": "timings", "data": timings.snapshot()}) + "\n"
+
+    except Exception as e:
+        print(f"Error: {e}")
+        yield json.dumps({"type": "error", "content": "Lỗi hệ thống trong quá trình xử lý."}) + "\n"
+    
+    finally:
+        # --- BƯỚC CUỐI: LƯU TIN NHẮN BOT ---
+        save_bot_response(chat_id, full_bot_response, collected_logs)
+
+
+@app.route('/api/chat-stream', methods=['POST'])
+def chat_stream():
+    """
+    Tạo job tìm kiếm nền (hoặc gộp vào job giống hệt đang chạy của cùng chat) và stream event log
+    của job từ đầu. Mất kết nối thì job vẫn chạy; đọc tiếp qua /api/jobs/<job_id>/events?offset=N.
+    """
+    parsed = read_chat_request(request.json)
+    if parsed is None:
+        return Response("Missing data", status=400)
+    user_input, chat_id, settings = parsed
+
+    job, created = jobs.submit(
+        chat_id, chat_job_key(*parsed),
+        lambda job: chat_events(user_input, chat_id, settings, job.cancel_event),
+        on_create=lambda: record_user_message(user_input, chat_id),
+    )
+    if not created:
+        print(f"[JOB] Reattached duplicate request to job {job.id} (chat {chat_id})")
+    return job_stream_response(job, 0)
+
+def job_stream_response(job, offset):
+    response = Response(stream_with_context(job.follow(offset)), mimetype='application/x-ndjson')
+    response.headers['X-Job-Id'] = job.id
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Trạng thái job (queued / running / done / cancelled) và số sự kiện đã có"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.info())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Đọc lại event log của job từ offset (số dòng NDJSON đã nhận), theo dõi tới khi job xong"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return job_stream_response(job, max(0, request.args.get('offset', 0, type=int)))
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Hủy job đang chạy hoặc đang xếp hàng"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    job.cancel()
+    return jsonify({"success": True})
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+ASGI entry point chạy song song với app Flask (app.py).
+
+/api/chat-stream chạy trên asyncio: mỗi lượt tìm kiếm là 1 job nền dạng coroutine (AsyncSearchPipeline),
+các bước blocking dùng chung thread pool của process nên 1 process giữ được hàng trăm stream cùng lúc.
+/api/jobs/<job_id>/events (đọc lại event log của job) cũng chạy native để không giữ thread khi chờ.
+Các route còn lại (giao diện, lịch sử, /metrics, /api/stats) được chuyển nguyên cho app Flask.
+
+Chạy: uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+from backend.async_pipeline import AsyncSearchPipeline, run_blocking
+from backend.metrics import metrics, StageTimings
+from backend.rate_limiter import gemini_scheduler
+
+async_pipeline = AsyncSearchPipeline(flask_app.searchor, flask_app.processor) if flask_app.pipeline else None
+wsgi_application = WsgiToAsgi(flask_app.app)
+
+
+def _generate_plan(user_input, chat_id, timings, cancel_event=None):
+    with gemini_scheduler.client(chat_id, cancel_event=cancel_event), metrics.collect(timings):
+        return flask_app.q_gen.generate(user_input)
+
+
+async def chat_events(user_input, chat_id, settings, cancel_event=None):
+    """Phiên bản async của app.chat_events: yield từng dòng NDJSON (chạy trong job nền)."""
+    full_bot_response = ""
+    collected_logs = []
+
+    try:
+        # --- BƯỚC 1: SUY NGHĨ ---
+        log_1 = "Đang phân tích ý định người dùng..."
+        collected_logs.append(log_1)
+        yield json.dumps({"type": "log", "content": log_1}) + "\n"
+
+        timings = StageTimings()
+        search_plan = await run_blocking(_generate_plan, user_input, chat_id, timings, cancel_event)
+
+        if not search_plan:
+            yield json.dumps({"type": "error", "content": "Không thể phân tích yêu cầu."}) + "\n"
+            return
+
+        for event in flask_app.plan_events(search_plan, settings, collected_logs):
+            yield json.dumps(event) + "\n"
+
+        # --- BƯỚC 4: SEARCH -> FETCH -> VERIFY CHẠY CHỒNG LẤP ---
+        analysis = search_plan.get("analysis", {})
+        search_stats = {}
+        valid_results = []
+
+        updates = async_pipeline.run(
+            search_plan, analysis.get("topic_en", "General"), analysis.get("difficulty", "Standard"),
+            **flask_app.pipeline_kwargs(settings, chat_id, search_stats, timings, cancel_event)
+        )
+        try:
+            async for update in updates:
+                if update["type"] == "final_result":
+                    valid_results = update["data"]
+                    continue
+                for event in flask_app.pipeline_events(update, settings, search_stats, collected_logs):
+                    yield json.dumps(event) + "\n"
+                    if event["type"] == "error":
+                        return
+        finally:
+            await updates.aclose()
+
+        log_6 = f"Hoàn tất. Lọc được {len(valid_results)} tài liệu phù hợp."
+        collected_logs.append(log_6)
+        yield json.dumps({"type": "log", "content": log_6}) + "\n"
+
+        # --- BƯỚC 5: RESULT ---
+        full_bot_response = flask_app.result_markdown(search_plan, valid_results)
+        yield json.dumps({"type": "result", "content": full_bot_response}) + "\n"
+
+        if settings["include_timings"]:
+            yield json.dumps({"type": "timings", "data": timings.snapshot()}) + "\n"
+
+    except Exception as e:
+        print(f"Error: {e}")
+        yield json.dumps({"type": "error", "content": "Lỗi hệ thống trong quá trình xử lý."}) + "\n"
+
+    finally:
+        # --- BƯỚC CUỐI: LƯU TIN NHẮN BOT ---
+        await run_blocking(flask_app.save_bot_response, chat_id, full_bot_response, collected_logs)
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_text(send, status, text, content_type=b"text/plain; charset=utf-8"):
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def stream_job(job, offset, receive, send):
+    """Stream event log của job từ offset. Client ngắt kết nối chỉ dừng việc đọc, job vẫn chạy tiếp."""
+    await send({
+        "type": "http.response.start", "status": 200,
+        "headers": [
+            (b"content-type", b"application/x-ndjson"), (b"cache-control", b"no-cache"),
+            (b"x-job-id", job.id.encode("ascii")),
+        ],
+    })
+
+    async def pump():
+        async for line in job.afollow(offset):
+            await send({"type": "http.response.body", "body": line.encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    pump_task = asyncio.create_task(pump())
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await asyncio.wait({pump_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (pump_task, watcher):
+            task.cancel()
+        await asyncio.gather(pump_task, watcher, return_exceptions=True)
+
+
+async def chat_stream(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return await _send_text(send, 400, "Invalid JSON")
+
+    parsed = flask_app.read_chat_request(data)
+    if parsed is None:
+        return await _send_text(send, 400, "Missing data")
+    if async_pipeline is None:
+        return await _send_text(send, 503, "System not initialized")
+
+    user_input, chat_id, settings = parsed
+
+    async def events(job):
+        # Lưu tin nhắn User trước mọi sự kiện của job (chỉ khi job mới được tạo)
+        await run_blocking(flask_app.record_user_message, user_input, chat_id)
+        lines = chat_events(user_input, chat_id, settings, job.cancel_event)
+        try:
+            async for line in lines:
+                yield line
+        finally:
+            await lines.aclose()
+
+    job, created = flask_app.jobs.submit_async(chat_id, flask_app.chat_job_key(*parsed), events)
+    if not created:
+        print(f"[JOB] Reattached duplicate request to job {job.id} (chat {chat_id})")
+    await stream_job(job, 0, receive, send)
+
+
+async def job_events(scope, receive, send, job_id):
+    job = flask_app.jobs.get(job_id)
+    if job is None:
+        return await _send_text(send, 404, json.dumps({"error": "Job not found"}), b"application/json")
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        offset = max(0, int(query.get("offset", ["0"])[0]))
+    except ValueError:
+        offset = 0
+    await stream_job(job, offset, receive, send)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/api/chat-stream" and scope["method"] == "POST":
+        return await chat_stream(scope, receive, send)
+    if scope["type"] == "http" and scope["method"] == "GET":
+        parts = scope["path"].strip("/").split("/")
+        if len(parts) == 4 and parts[:2] == ["api", "jobs"] and parts[3] == "events":
+            return await job_events(scope, receive, send, parts[2])
+    return await wsgi_application(scope, receive, send)
@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.metrics import metrics
+from backend.rate_limiter import gemini_scheduler
+from backend.ranker import LexicalGate, LEXICAL_TOP_K
+from backend.search_engine import SEARCH_CONCURRENCY
+from backend.pipeline import SearchPipeline, _Resolved, _StopSignal, FETCH_WORKERS, VERIFY_WORKERS, VERIFY_BATCH_SIZE, VERIFY_LINGER
+
+# Thread pool dùng chung cho mọi stream (không tạo thread riêng cho từng request)
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", 64))
+ASYNC_VERIFY_THREADS = int(os.getenv("ASYNC_VERIFY_THREADS", 16))
+
+_DONE = object()
+
+_io_pool = ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="async-io")
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix="async-search")
+_verify_pool = ThreadPoolExecutor(max_workers=ASYNC_VERIFY_THREADS, thread_name_prefix="async-verify")
+
+
+async def run_blocking(func, *args, pool=None):
+    """Chạy hàm blocking trên thread pool dùng chung (mặc định: pool I/O) mà không chặn event loop."""
+    return await asyncio.get_running_loop().run_in_executor(pool or _io_pool, func, *args)
+
+
+class AsyncSearchPipeline(SearchPipeline):
+    """
+    Phiên bản asyncio của SearchPipeline cho ASGI (asgi.py): mỗi stream là 1 coroutine.
+    Các bước vẫn là hàm blocking của SearchEngine / ContentProcessor (SDK Google, requests,
+    parser pool) nhưng chạy trên các thread pool dùng chung toàn process, thay vì mỗi request
+    giữ ~16 thread riêng. Số việc đang chạy của 1 stream bị giới hạn bởi fetch_workers /
+    verify_workers; tổng số thread của process bởi ASYNC_IO_THREADS / ASYNC_VERIFY_THREADS.
+    Lời gọi Gemini đang chờ quota chỉ giữ thread của pool verify và bị hủy khi stream dừng.
+    """
+
+    def __init__(self, searchor, processor, fetch_workers=FETCH_WORKERS, verify_workers=VERIFY_WORKERS,
+                 verify_batch_size=VERIFY_BATCH_SIZE, linger=VERIFY_LINGER):
+        super().__init__(searchor, processor, fetch_workers=fetch_workers, verify_workers=verify_workers,
+                         verify_batch_size=verify_batch_size)
+        self.linger = linger
+
+    async def run(self, search_plan, topic, difficulty, max_queries=3, results_per_query=3, search_stats=None,
+                  client_id=None, stop_after=None, min_score=8, deadline=None, max_verify=LEXICAL_TOP_K, timings=None,
+                  cancel_event=None):
+        """Async generator, cùng tham số và cùng các sự kiện với SearchPipeline.run."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        verify_q = asyncio.Queue()
+        stop = _StopSignal(cancel_event)
+        deadline_at = time.monotonic() + deadline if deadline else None
+        gate = self._make_gate(search_plan, max_verify)
+        fetch_slots = asyncio.Semaphore(self.fetch_workers)
+        verify_slots = asyncio.Semaphore(self.verify_workers)
+        doc_tasks = []
+        background = set()
+
+        def bound(func):
+            # Thread của pool làm việc cho request này: gắn timings, client (chia lượt Gemini) và cờ hủy
+            def job(*args):
+                with gemini_scheduler.client(client_id, cancel_event=stop), metrics.collect(timings):
+                    return func(*args) if not stop.is_set() else None
+            return job
+
+        def spawn(coro):
+            task = asyncio.create_task(coro)
+            background.add(task)
+            task.add_done_callback(background.discard)
+            return task
+
+        def post(kind, payload=None):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+        def search_loop():
+            count = 0
+            try:
+                for url in self.searchor.iter_search_plan(
+                    search_plan, max_queries=max_queries, results_per_query=results_per_query,
+                    stats=search_stats, executor=_search_pool
+                ):
+                    if stop.is_set():
+                        break
+                    count += 1
+                    post("found", url)
+            except Exception as e:
+                print(f"[PIPELINE ERROR] search stage: {e}")
+            finally:
+                post("search_done", count)
+
+        async def process(url):
+            try:
+                async with fetch_slots:
+                    item = await run_blocking(bound(self._fetch), url)
+                if item is not None:
+                    item = await run_blocking(bound(self._parse), item, topic, difficulty)
+                if item is None or isinstance(item, _Resolved):
+                    events.put_nowait(("done", item.result if item else None))
+                    return
+                decision = await run_blocking(bound(gate.offer), item, item[1])
+                if decision == LexicalGate.ADMIT:
+                    verify_q.put_nowait(item)
+                elif decision != LexicalGate.HOLD:
+                    events.put_nowait(("done", None))
+            except Exception as e:
+                print(f"[PIPELINE ERROR] {url}: {e}")
+                events.put_nowait(("done", None))
+
+        async def verify_batch(items):
+            try:
+                outs = await run_blocking(bound(self._verify), items, topic, difficulty, pool=_verify_pool)
+            except Exception as e:
+                print(f"[PIPELINE ERROR] verify stage: {e}")
+                outs = None
+            finally:
+                verify_slots.release()
+            for out in outs or [None] * len(items):
+                events.put_nowait(("done", out))
+
+        async def verify_loop():
+            # Gom tối đa verify_batch_size tài liệu, chờ thêm tối đa `linger` giây
+            batches = []
+            finished = False
+            while not finished:
+                item = await verify_q.get()
+                if item is _DONE:
+                    break
+                items = [item]
+                batch_deadline = loop.time() + self.linger
+                while len(items) < self.verify_batch_size:
+                    try:
+                        nxt = await asyncio.wait_for(verify_q.get(), max(0.0, batch_deadline - loop.time()))
+                    except asyncio.TimeoutError:
+                        break
+                    if nxt is _DONE:
+                        finished = True
+                        break
+                    items.append(nxt)
+                await verify_slots.acquire()
+                batches.append(spawn(verify_batch(items)))
+            await asyncio.gather(*batches)
+            events.put_nowait(("finished", None))
+
+        async def close_stages():
+            # Mọi link đã qua gate -> thả các tài liệu đang giữ, rồi báo stage verify kết thúc
+            await asyncio.gather(*doc_tasks)
+            released, dropped = gate.drain()
+            for item in released:
+                verify_q.put_nowait(item)
+            for _ in range(dropped):
+                events.put_nowait(("done", None))
+            verify_q.put_nowait(_DONE)
+
+        spawn(verify_loop())
+        search_future = loop.run_in_executor(_io_pool, bound(search_loop))
+        print(f"[INFO] Async pipeline started (fetch={self.fetch_workers}, verify={self.verify_workers})")
+
+        results = []
+        total_links = 0
+        completed_count = 0
+        strong_matches = 0
+        try:
+            while True:
+                if deadline_at is None:
+                    kind, payload = await events.get()
+                else:
+                    try:
+                        kind, payload = await asyncio.wait_for(events.get(), max(0.0, deadline_at - time.monotonic()))
+                    except asyncio.TimeoutError:
+                        print(f"[INFO] Pipeline deadline ({deadline}s) reached, cancelling pending work.")
+                        yield {"type": "early_stop", "reason": "deadline"}
+                        break
+
+                if kind == "found":
+                    total_links += 1
+                    doc_tasks.append(spawn(process(payload)))
+                elif kind == "search_done":
+                    spawn(close_stages())
+                    yield {"type": "search_done", "total": payload}
+                elif kind == "done":
+                    completed_count += 1
+                    if payload:
+                        print(f"[MATCH] Score: {payload['score']} | {payload['type']} | {payload['url']}")
+                        results.append(payload)
+                        yield {"type": "match", "data": payload}
+                        if payload['score'] >= min_score:
+                            strong_matches += 1
+                    yield {
+                        "type": "progress_update",
+                        "current": completed_count,
+                        "total": total_links,
+                        "found": len(results)
+                    }
+                    if stop_after and strong_matches >= stop_after:
+                        print(f"[INFO] Found {strong_matches} documents with score >= {min_score}, cancelling pending work.")
+                        yield {"type": "early_stop", "reason": "target"}
+                        break
+                elif kind == "finished":
+                    break
+        finally:
+            # Dừng sớm hoặc client ngắt kết nối -> bỏ các bước còn chờ; việc đang chạy trong pool tự kết thúc
+            stop.set()
+            for task in list(background):
+                task.cancel()
+            search_future.cancel()
+
+        print(f"[INFO] Lexical gate: {gate.admitted} sent to Gemini, {gate.rejected} skipped")
+        yield {"type": "gate_summary", "sent": gate.admitted, "skipped": gate.rejected}
+
+        results.sort(key=lambda x: x['score'], reverse=True)
+        yield {
+            "type": "final_result",
+            "data": results
+        }
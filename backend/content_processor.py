@@ -1,33 +1,65 @@
-import io
 import json
+import hashlib
 import re
-import time
-import random
-import requests
-import urllib3
-import google.generativeai as genai
-from bs4 import BeautifulSoup
-from pypdf import PdfReader
+import bisect
+import threading
 from dotenv import load_dotenv
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from backend.disk_cache import DiskCache
+from backend.doc_index import DocumentIndex
+from backend.http_client import FetchClient, ContentRejected, SpooledBody, RangeSource
+from backend.latex_normalizer import normalize_latex, latex_problems
+from backend.metrics import metrics
+from backend.near_dup import NearDuplicateStore, simhash, hamming
+from backend.parsers import ParserPool, parse_document, PARSER_PROCESSES
+from backend.prompts import load_prompt, prompt_version
+from backend.term_matcher import get_matcher
+from backend.rate_limiter import gemini_scheduler, estimate_tokens, QuotaExhaustedError, CallCancelledError
+from backend.url_utils import canonicalize_url
 
 load_dotenv()
 
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
 # Model Configuration
 MODEL_ID = os.getenv("GEMINI_CONTENT_PROCESSOR_MODEL_ID", "gemini-2.0-flash")
 print(f"[INFO] Content Processor Model: {MODEL_ID}")
 
-try:
-    verifier_model = genai.GenerativeModel(MODEL_ID)
-except Exception as e:
-    print(f"[ERROR] Failed to initialize model {MODEL_ID}: {e}")
-    verifier_model = genai.GenerativeModel("gemini-2.0-flash")
+# SDK Gemini (~1s import) chỉ được nạp và cấu hình ở lần gọi model đầu tiên, không phải lúc khởi động
+verifier_model = None
+_model_lock = threading.Lock()
+
+
+def get_verifier_model():
+    global verifier_model
+    if verifier_model is None:
+        with _model_lock:
+            if verifier_model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                try:
+                    verifier_model = genai.GenerativeModel(MODEL_ID)
+                except Exception as e:
+                    print(f"[ERROR] Failed to initialize model {MODEL_ID}: {e}")
+                    verifier_model = genai.GenerativeModel("gemini-2.0-flash")
+    return verifier_model
+
+# Fetch cache Configuration
+FETCH_CACHE_TTL = int(os.getenv("FETCH_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+FETCH_CACHE_MAX_BYTES = int(os.getenv("FETCH_CACHE_MAX_MB", 512)) * 1024 * 1024
+VERDICT_CACHE_TTL = int(os.getenv("VERDICT_CACHE_TTL_SECONDS", 3 * 24 * 3600))
+VERDICT_CACHE_MAX_ENTRIES = int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", 20000))
+# Sample đã được Gemini sửa LaTeX (chỉ những sample không sửa được cục bộ)
+LATEX_CACHE_TTL = int(os.getenv("LATEX_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+LATEX_CACHE_MAX_ENTRIES = int(os.getenv("LATEX_CACHE_MAX_ENTRIES", 20000))
+
+# Context gửi Gemini cho mỗi tài liệu: ngân sách token (ước lượng cục bộ) và trọng số của 1 tín hiệu bài tập
+# so với 1 từ khóa chủ đề khi chấm đoạn (từ khóa chủ đề gồm cả từ nối như "and", xuất hiện dày đặc)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 4000))
+CONTEXT_SIGNAL_WEIGHT = float(os.getenv("CONTEXT_SIGNAL_WEIGHT", 8.0))
+
+# Batch verification: số tài liệu tối đa / prompt và ngân sách token (ước lượng) cho mỗi prompt
+VERIFY_BATCH_SIZE = int(os.getenv("VERIFY_BATCH_SIZE", 4))
+VERIFY_BATCH_TOKEN_BUDGET = int(os.getenv("VERIFY_BATCH_TOKEN_BUDGET", 24000))
 
 class ContentProcessor:
     def __init__(self):
@@ -36,6 +68,20 @@ class ContentProcessor:
             "exercise", "problem", "solution", "example", "quiz", "exam", "assignment", 
             "homework", "midterm", "final", "test", "practice"
         ]
+        # Cache nội dung đã bóc tách (pages_data), khóa theo URL chuẩn hóa
+        self.fetch_cache = DiskCache("fetch", ttl=FETCH_CACHE_TTL, max_bytes=FETCH_CACHE_MAX_BYTES)
+        # HTTP client dùng chung (connection pool + giới hạn theo host)
+        self.http = FetchClient()
+        # Bóc text PDF/HTML trong process pool (PARSER_PROCESSES=0 -> chạy ngay trong thread)
+        self.parser_pool = ParserPool() if PARSER_PROCESSES > 0 else None
+        # Cache verdict của Gemini (đã gồm sample đã refine LaTeX)
+        self.verdict_cache = DiskCache("verdicts", ttl=VERDICT_CACHE_TTL, max_entries=VERDICT_CACHE_MAX_ENTRIES)
+        # Cache kết quả sửa LaTeX bằng Gemini, khóa theo hash sample + version prompt + model
+        self.latex_cache = DiskCache("latex", ttl=LATEX_CACHE_TTL, max_entries=LATEX_CACHE_MAX_ENTRIES)
+        # Inverted index cục bộ của mọi tài liệu đã parse (SearchEngine tìm trong đây trước khi gọi Google)
+        self.doc_index = DocumentIndex()
+        # Verdict theo SimHash: tài liệu gần trùng (mirror, bản HTML/PDF) dùng lại verdict, không gọi lại Gemini
+        self.near_dups = NearDuplicateStore()
 
     def _clean_json_text(self, text):
         """Làm sạch chuỗi JSON và xử lý lỗi escape LaTeX"""
@@ -53,57 +99,54 @@ class ContentProcessor:
 
     def _call_gemini_with_retry(self, prompt, max_retries=5):
         """
-        Hàm wrapper gọi API với cơ chế Retry khi gặp lỗi 429.
-        Sử dụng Exponential Backoff + Jitter để tránh nghẽn mạng.
+        Hàm wrapper gọi API qua bộ điều phối chung (gemini_scheduler, ngân sách 'verifier').
+        Khi gặp 429, scheduler cho cả model cooldown và giảm RPM thay vì mỗi thread tự sleep.
         """
-        attempt = 0
-        base_wait_time = 8 # Bắt đầu chờ 8 giây
-
-        while attempt <= max_retries:
-            try:
-                # Gọi API
-                return verifier_model.generate_content(prompt)
-            except Exception as e:
-                error_msg = str(e)
-                # Chỉ retry nếu là lỗi 429 (Resource Exhausted)
-                if "429" in error_msg:
-                    attempt += 1
-                    if attempt > max_retries:
-                        print(f"[ERROR] Quota exhausted after {max_retries} retries. Skipping.")
-                        return None
-                    
-                    # Tính thời gian chờ: (8 * 2^attempt) + random(1-3s)
-                    # VD: Lần 1: ~9s, Lần 2: ~18s, Lần 3: ~34s...
-                    wait_time = (base_wait_time * (2 ** (attempt - 1))) + random.uniform(1, 3)
-                    print(f"[WARN] Quota hit (429). Retrying in {wait_time:.1f}s (Attempt {attempt}/{max_retries})...")
-                    time.sleep(wait_time)
-                else:
-                    # Nếu lỗi khác (400, 500...) thì bỏ qua luôn, không retry
-                    print(f"[AI ERROR] Unrecoverable error: {error_msg}")
-                    return None
-        return None
+        try:
+            return gemini_scheduler.call(
+                "verifier",
+                lambda: get_verifier_model().generate_content(prompt),
+                estimated_tokens=estimate_tokens(prompt),
+                max_retries=max_retries,
+            )
+        except QuotaExhaustedError:
+            print(f"[ERROR] Quota exhausted after {max_retries} retries. Skipping.")
+            return None
+        except CallCancelledError:
+            return None
+        except Exception as e:
+            # Nếu lỗi khác (400, 500...) thì bỏ qua luôn, không retry
+            print(f"[AI ERROR] Unrecoverable error: {e}")
+            return None
 
+    @metrics.timed("latex_refine")
     def _refine_latex_with_ai(self, raw_sample):
-        """Refine LaTeX logic (Có Retry)"""
+        """
+        Chuẩn hóa LaTeX của sample: sửa cục bộ trước (normalize_latex), chỉ gọi Gemini khi bản đã sửa
+        vẫn không qua được kiểm tra (latex_problems). Kết quả của Gemini được cache theo hash đầu vào.
+        """
         if not raw_sample or len(raw_sample) < 5:
             return raw_sample
 
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        prompt_path = os.path.join(base_dir, 'PROMPT', 'FIX_LATEX_PROMPT.txt')
-
-        if not os.path.exists(prompt_path):
-            return raw_sample
+        normalized = normalize_latex(raw_sample)
+        if not latex_problems(normalized):
+            metrics.inc("latex_refine_total", source="local")
+            return normalized
 
         try:
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                prompt_template = f.read()
-
-            prompt = prompt_template.replace("{raw_sample_question}", raw_sample)
+            version = prompt_version('FIX_LATEX_PROMPT.txt')
+            cache_key = hashlib.sha256(f"{version}\x1f{MODEL_ID}\x1f{normalized}".encode("utf-8")).hexdigest()
+            cached = self.latex_cache.get(cache_key)
+            if cached is not None:
+                metrics.inc("latex_refine_total", source="cache")
+                return cached
+
+            prompt = load_prompt('FIX_LATEX_PROMPT.txt').replace("{raw_sample_question}", normalized)
             
             # Thay thế lệnh gọi trực tiếp bằng hàm có retry
             response = self._call_gemini_with_retry(prompt, max_retries=3)
             
-            if not response: return raw_sample
+            if not response: return normalized
 
             refined_text = response.text.strip()
             
@@ -114,111 +157,257 @@ class ContentProcessor:
                 if refined_text.endswith("```"):
                     refined_text = refined_text.rsplit("```", 1)[0]
             
-            return refined_text.strip()
+            refined_text = refined_text.strip()
+            if not refined_text:
+                return normalized
+            metrics.inc("latex_refine_total", source="llm")
+            self.latex_cache.set(cache_key, refined_text)
+            return refined_text
         except Exception:
-            return raw_sample
+            return normalized
 
-    def _extract_relevant_context_with_pages(self, pages_data, topic_keywords, window_size=800):
-        # ... (Giữ nguyên code cũ)
+    @metrics.timed("extract")
+    def _extract_relevant_context_with_pages(self, pages_data, topic_keywords, window_size=800, token_budget=None):
+        """
+        Trích các đoạn quanh từ khóa (gắn tag `=== PAGE X ===`) để gửi Gemini, trong ngân sách token.
+        Mỗi đoạn được chấm theo số tín hiệu bài tập (nhân CONTEXT_SIGNAL_WEIGHT) và từ khóa chủ đề trên
+        mỗi token; đoạn có điểm cao nhất được chọn trước, rồi xếp lại theo thứ tự trong tài liệu.
+        """
         if not pages_data: return ""
-        
-        search_terms = self.signal_keywords + topic_keywords.lower().split()
-        final_context = ""
-        total_len = 0
-        MAX_LEN = 25000 
+        budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+
+        # Matcher biên dịch 1 lần cho mỗi topic, quét mỗi trang 1 lượt cho mỗi nhóm từ khóa
+        signal_matcher = get_matcher(tuple(self.signal_keywords))
+        topic_matcher = get_matcher(tuple(topic_keywords.lower().split()))
+        candidates = []  # (điểm / token, số token, thứ tự, trang, cửa sổ, start, end, text)
 
         for page_item in pages_data:
             page_num = page_item['page']
             text = str(page_item['text'])
             if not text: continue
 
-            lowered_text = text.lower()
-            indices = []
-            
-            for term in search_terms:
-                if len(term) < 3: continue
-                if term in lowered_text:
-                    indices.extend([m.start() for m in re.finditer(re.escape(term), lowered_text)])
-            
+            lowered = text.lower()
+            signal_hits = signal_matcher.find_starts(lowered)
+            topic_hits = topic_matcher.find_starts(lowered)
+            indices = sorted(set(signal_hits).union(topic_hits))
             if not indices: continue
             
-            indices.sort()
-            ranges = []
+            # Gộp các cửa sổ [idx - 200, idx + window_size) chồng lấn nhau
             text_len = len(text)
-            for idx in indices:
-                start = max(0, idx - 200)
-                end = min(text_len, idx + window_size)
-                ranges.append((start, end))
-
             merged_ranges = []
-            if ranges:
-                curr_start, curr_end = ranges[0]
-                for next_start, next_end in ranges[1:]:
-                    if next_start < curr_end:
-                        curr_end = max(curr_end, next_end)
-                    else:
-                        merged_ranges.append((curr_start, curr_end))
-                        curr_start, curr_end = next_start, next_end
-                merged_ranges.append((curr_start, curr_end))
-
-            for start, end in merged_ranges:
-                if total_len > MAX_LEN: break
-                chunk = text[start:end].replace('\n', ' ')
-                final_context += f"\n=== PAGE {page_num} ===\n...{chunk}...\n"
-                total_len += len(chunk)
-
-        if not final_context and pages_data:
+            curr_start, curr_end = max(0, indices[0] - 200), min(text_len, indices[0] + window_size)
+            for idx in indices[1:]:
+                next_start, next_end = max(0, idx - 200), min(text_len, idx + window_size)
+                if next_start < curr_end:
+                    curr_end = max(curr_end, next_end)
+                else:
+                    merged_ranges.append((curr_start, curr_end))
+                    curr_start, curr_end = next_start, next_end
+            merged_ranges.append((curr_start, curr_end))
+
+            # Cửa sổ gộp dài (trang dày từ khóa) được chấm theo từng đoạn window_size ký tự
+            for window, (start, end) in enumerate(merged_ranges):
+                for piece_start in range(start, end, window_size):
+                    piece_end = min(end, piece_start + window_size)
+                    signals = bisect.bisect_left(signal_hits, piece_end) - bisect.bisect_left(signal_hits, piece_start)
+                    topics = bisect.bisect_left(topic_hits, piece_end) - bisect.bisect_left(topic_hits, piece_start)
+                    tokens = estimate_tokens(text[piece_start:piece_end]) + 8  # + tag trang
+                    candidates.append((
+                        (CONTEXT_SIGNAL_WEIGHT * signals + topics) / tokens, tokens, len(candidates),
+                        page_num, window, piece_start, piece_end, text,
+                    ))
+
+        # Chọn tham lam theo điểm / token trong ngân sách (luôn giữ ít nhất đoạn tốt nhất)
+        chosen, remaining = [], budget
+        for candidate in sorted(candidates, key=lambda c: (-c[0], c[2])):
+            if candidate[1] <= remaining or not chosen:
+                chosen.append(candidate)
+                remaining -= candidate[1]
+        chosen.sort(key=lambda c: c[2])
+
+        # Các đoạn liền nhau của cùng 1 cửa sổ được nối lại dưới 1 tag trang
+        blocks = []
+        for _, _, _, page_num, window, start, end, text in chosen:
+            if blocks and blocks[-1][:2] == [page_num, window] and blocks[-1][3] == start:
+                blocks[-1][3] = end
+            else:
+                blocks.append([page_num, window, start, end, text])
+
+        parts = []
+        for page_num, _, start, end, text in blocks:
+            chunk = text[start:end].replace('\n', ' ')
+            parts.append(f"\n=== PAGE {page_num} ===\n...{chunk}...\n")
+
+        if not parts and pages_data:
              p1 = pages_data[0]
-             final_context += f"\n=== PAGE {p1['page']} (Intro) ===\n{str(p1['text'])[:3000]}"
+             parts.append(f"\n=== PAGE {p1['page']} (Intro) ===\n{str(p1['text'])[:3000]}")
              if len(pages_data) > 1:
                  p_last = pages_data[-1]
-                 final_context += f"\n=== PAGE {p_last['page']} (End) ===\n{str(p_last['text'])[:2000]}"
+                 parts.append(f"\n=== PAGE {p_last['page']} (End) ===\n{str(p_last['text'])[:2000]}")
 
-        return final_context
+        return "".join(parts)
 
     def fetch_content(self, url):
         # ... (Giữ nguyên code cũ tối ưu timeout 8s)
-        if any(x in url for x in ["youtube.com", "reddit.com", "tiktok.com", "giphy.com", "tenor.com", "knowyourmeme.com"]):
+        raw = self.download(url)
+        if raw is None:
             return [], None
+        return self.parse_download(raw)
+
+    @metrics.timed("fetch")
+    def download(self, url):
+        """
+        Bước network của fetch_content (có kiểm tra cache). Trả về dict:
+        - {"pages_data", "doc_type"} nếu đã có sẵn trong cache (không cần parse),
+        - {"body", "content_type", "final_url", ...} nếu cần parse_download (body: SpooledBody,
+          hoặc RangeSource với PDF lớn trên server hỗ trợ Range),
+        - None nếu lỗi mạng hoặc response bị bỏ (không phải HTML/PDF, vượt FETCH_MAX_MB).
+        URL nên được chuẩn hóa / lọc domain trước (SearchEngine.iter_search_plan đã làm việc này).
+        """
+        # --- CACHE: trả về ngay nếu còn hạn, không tốn request/parse ---
+        cache_key = canonicalize_url(url)
+        cached = self.fetch_cache.peek(cache_key)
+        if self.fetch_cache.is_fresh(cached):
+            self.fetch_cache.record("hits")
+            return {"url": url, "pages_data": cached[0]["pages_data"], "doc_type": cached[0]["doc_type"]}
 
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
         }
+        # Hết hạn nhưng có validator -> gửi conditional request
+        if cached:
+            if cached[0].get("etag"):
+                headers['If-None-Match'] = cached[0]["etag"]
+            if cached[0].get("last_modified"):
+                headers['If-Modified-Since'] = cached[0]["last_modified"]
         
         try:
-            response = requests.get(url, headers=headers, timeout=8, verify=False) 
+            # Session dùng chung: keep-alive, giới hạn theo host, bỏ qua host timeout liên tục.
+            # Body được đọc dạng stream: bỏ sớm nội dung không phải HTML/PDF, body lớn nằm ở file tạm
+            response, body, kind = self.http.download(url, headers=headers)
+
+            if response.status_code == 304 and cached:
+                self.fetch_cache.touch(cache_key)
+                self.fetch_cache.record("revalidated")
+                return {"url": url, "pages_data": cached[0]["pages_data"], "doc_type": cached[0]["doc_type"]}
+
+            self.fetch_cache.record("misses")
+            if body is None:
+                return None
+            if isinstance(body, SpooledBody):
+                metrics.inc("fetch_bytes_total", body.size)
             content_type = response.headers.get('Content-Type', '').lower()
-            final_url = response.url.lower()
-            pages_data = []
+            return {
+                "url": url,
+                "cache_key": cache_key,
+                "body": body,
+                "content_type": "application/pdf" if kind == "pdf" else content_type,
+                "final_url": response.url,
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+            }
+        except ContentRejected as e:
+            metrics.inc("fetch_rejected_total", reason=e.reason)
+            return None
+        except Exception:
+            return None
 
-            is_pdf = 'application/pdf' in content_type or final_url.endswith('.pdf')
-            if is_pdf:
+    def parse_download(self, raw):
+        """Bước CPU của fetch_content: bóc text từ kết quả download(), lưu cache và đánh chỉ mục."""
+        if "pages_data" in raw:
+            # Tài liệu có trong cache từ trước khi có index -> bổ sung vào index
+            self._index_document(raw["url"], raw["pages_data"], raw["doc_type"], replace=False)
+            return raw["pages_data"], raw["doc_type"]
+        body = raw["body"]
+        try:
+            pages_data, doc_type = self._parse_document(body.source() if isinstance(body, SpooledBody) else body,
+                                                        raw["content_type"], raw["final_url"])
+        except Exception:
+            return [], None
+        finally:
+            if isinstance(body, SpooledBody):
+                body.close()  # Xóa file tạm (nếu có) ngay sau khi parse
+
+        if pages_data:
+            self.fetch_cache.set(raw["cache_key"], {
+                "url": raw["url"],
+                "doc_type": doc_type,
+                "pages_data": pages_data,
+                "etag": raw.get("etag"),
+                "last_modified": raw.get("last_modified"),
+            })
+            self._index_document(raw["url"], pages_data, doc_type)
+        return pages_data, doc_type
+
+    def _index_document(self, url, pages_data, doc_type, replace=True):
+        try:
+            self.doc_index.add(url, pages_data, doc_type, replace=replace)
+        except Exception as e:
+            print(f"[INDEX ERROR] {url}: {e}")
+
+    @metrics.timed("parse")
+    def _parse_document(self, content, content_type, final_url):
+        """Bóc text từ nội dung thô (PDF hoặc HTML) trong process pool. Trả về (pages_data, doc_type)."""
+        # RangeSource đọc block qua self.http (giới hạn theo host) nên được parse ngay trong thread này
+        if self.parser_pool is None or isinstance(content, RangeSource):
+            return parse_document(content, content_type, final_url)
+        return self.parser_pool.parse(content, content_type, final_url)
+
+    def cache_stats(self):
+        """Thống kê hit/miss của các cache trong ContentProcessor."""
+        return {
+            "fetch": self.fetch_cache.stats(),
+            "verdicts": self.verdict_cache.stats(),
+            "latex": self.latex_cache.stats(),
+            "doc_index": self.doc_index.stats(),
+            "near_dups": self.near_dups.stats(),
+        }
+
+    def _verdict_scope(self, user_topic, difficulty):
+        """Topic/độ khó đã chuẩn hóa + version của prompt: verdict chỉ dùng lại trong cùng scope."""
+        norm = lambda x: " ".join(str(x).lower().split())
+        raw = "\x1f".join([
+            norm(user_topic), norm(difficulty),
+            prompt_version('PROMPT.txt'), prompt_version('BATCH_PROMPT.txt'),
+            prompt_version('FIX_LATEX_PROMPT.txt'),
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _verdict_cache_key(self, tagged_context, doc_type, user_topic, difficulty):
+        """Khóa verdict: hash nội dung trích + doc_type + scope (topic, độ khó, version prompt)."""
+        raw = "\x1f".join([
+            hashlib.sha256(tagged_context.encode("utf-8")).hexdigest(),
+            str(doc_type), self._verdict_scope(user_topic, difficulty),
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _parse_model_json(self, raw_text, pattern=r'\{.*\}'):
+        """Parse JSON do model trả về (có xử lý escape LaTeX), None nếu không parse được."""
+        try:
+            clean_text = self._clean_json_text(raw_text)
+            return json.loads(clean_text)
+        except json.JSONDecodeError:
+            match = re.search(pattern, raw_text, re.DOTALL)
+            if match:
                 try:
-                    f = io.BytesIO(response.content)
-                    reader = PdfReader(f)
-                    if len(reader.pages) > 0:
-                        for i in range(min(10, len(reader.pages))): 
-                            txt = reader.pages[i].extract_text()
-                            if txt:
-                                pages_data.append({"page": i + 1, "text": txt})
-                        return pages_data, "PDF"
+                    return json.loads(match.group(0))
                 except:
-                    pass 
+                    pass
+        return None
 
-            soup = BeautifulSoup(response.content, 'html.parser')
-            for tag in soup(["script", "style", "nav", "footer", "header", "iframe", "noscript"]):
-                tag.decompose()
-            text = soup.get_text(separator=' ', strip=True)
-            
-            if len(text) > 200: 
-                pages_data.append({"page": "Web", "text": text[:30000]})
-                return pages_data, "WEB"
-            
-            return [], None
+    def _finalize_verdict(self, parsed_result, cache_key):
+        """Refine LaTeX cho sample (nếu tài liệu đạt) rồi lưu cache."""
+        if parsed_result and parsed_result.get('is_relevant') and parsed_result.get('contains_exercises'):
+            sample = parsed_result.get('sample_question')
+            if sample:
+                refined_sample = self._refine_latex_with_ai(sample)
+                parsed_result['sample_question'] = refined_sample
 
-        except Exception:
-            return [], None
+        # Chỉ lưu verdict parse thành công (lỗi mạng/quota thì lần sau gọi lại)
+        if isinstance(parsed_result, dict):
+            self.verdict_cache.set(cache_key, parsed_result)
+        return parsed_result
 
     def verify_relevance(self, pages_data, doc_type, user_topic, difficulty):
         if not pages_data: return None
@@ -226,127 +415,222 @@ class ContentProcessor:
         tagged_context = self._extract_relevant_context_with_pages(pages_data, user_topic)
         if not tagged_context: return None 
 
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        prompt_path = os.path.join(base_dir, 'PROMPT', 'PROMPT.txt')
-        if not os.path.exists(prompt_path):
-             return None
-
         try:
-            with open(prompt_path, "r", encoding="utf-8") as f:
-                prompt_template = f.read()
+            cache_key = self._verdict_cache_key(tagged_context, doc_type, user_topic, difficulty)
+            cached = self.verdict_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-            prompt = prompt_template.replace("{user_topic}", str(user_topic)) \
-                                    .replace("{difficulty}", str(difficulty)) \
-                                    .replace("{doc_type}", str(doc_type)) \
-                                    .replace("{tagged_context}", str(tagged_context))
-            
-            prompt = prompt.replace("{{", "{").replace("}}", "}")
-            
-            # --- Thay thế lệnh gọi trực tiếp bằng hàm _call_gemini_with_retry ---
-            # Max retries = 5, nếu mạng lag hoặc hết quota sẽ kiên trì thử lại
-            res = self._call_gemini_with_retry(prompt, max_retries=5)
-            
-            if not res: return None # Nếu sau 5 lần vẫn lỗi thì đành chịu
-
-            raw_text = res.text
-            
-            parsed_result = None
-            try:
-                clean_text = self._clean_json_text(raw_text)
-                parsed_result = json.loads(clean_text)
-            except json.JSONDecodeError:
-                match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-                if match:
-                    try:
-                        parsed_result = json.loads(match.group(0))
-                    except:
-                        pass
-            
-            if parsed_result and parsed_result.get('is_relevant') and parsed_result.get('contains_exercises'):
-                sample = parsed_result.get('sample_question')
-                if sample:
-                    refined_sample = self._refine_latex_with_ai(sample)
-                    parsed_result['sample_question'] = refined_sample
-            
-            return parsed_result
+            return self._verify_context(tagged_context, doc_type, user_topic, difficulty, cache_key)
             
         except Exception as e:
             print(f"[ERROR] Logic error in verify: {e}")
             return None
 
-    def _process_single_url(self, link, topic, difficulty):
-        try:
-            pages_data, doc_type = self.fetch_content(link)
-            if not pages_data: return None
-            
-            evaluation = self.verify_relevance(pages_data, doc_type, topic, difficulty)
-            
-            if evaluation:
-                score = evaluation.get('score', 0)
-                has_exercises = evaluation.get('contains_exercises', False)
-                reason = evaluation.get('reason', 'N/A')
-                
-                if score >= 5 and has_exercises:
-                    page_loc = evaluation.get('page_location', 'Unknown')
-                    return {
-                        "url": link, "type": doc_type, "score": score,
-                        "page": page_loc, "reason": reason,
-                        "sample": evaluation.get('sample_question', '')
-                    }
-            return None
-            
-        except Exception as e:
-            print(f"[THREAD ERROR] Error processing {link}: {e}")
-            return None
+    def _verify_context(self, tagged_context, doc_type, user_topic, difficulty, cache_key):
+        """Gọi Gemini thẩm định 1 tài liệu (không qua cache)."""
+        prompt_template = load_prompt('PROMPT.txt')
 
-    def process_links_stream(self, links, topic, difficulty):
-        """
-        Generator version: Yields progress updates to the app in real-time.
-        """
-        results = []
-        max_workers = 5
-        total_links = len(links)
-        completed_count = 0
+        prompt = prompt_template.replace("{user_topic}", str(user_topic)) \
+                                .replace("{difficulty}", str(difficulty)) \
+                                .replace("{doc_type}", str(doc_type)) \
+                                .replace("{tagged_context}", str(tagged_context))
         
-        print(f"[INFO] Verifying {total_links} links using {max_workers} parallel workers...")
+        prompt = prompt.replace("{{", "{").replace("}}", "}")
+        metrics.observe("verify_context_tokens", estimate_tokens(tagged_context), mode="single")
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_url = {
-                executor.submit(self._process_single_url, url, topic, difficulty): url 
-                for url in links
-            }
+        # Max retries = 5, nếu mạng lag hoặc hết quota sẽ kiên trì thử lại
+        with metrics.span("verify"):
+            res = self._call_gemini_with_retry(prompt, max_retries=5)
+        
+        if not res: return None # Nếu sau 5 lần vẫn lỗi thì đành chịu
+
+        parsed_result = self._parse_model_json(res.text)
+        return self._finalize_verdict(parsed_result, cache_key)
+
+    def verify_relevance_batch(self, documents, user_topic, difficulty):
+        """
+        Thẩm định nhiều tài liệu với ít lượt gọi Gemini hơn.
+        documents: list (pages_data, doc_type). Trả về list verdict cùng thứ tự (None nếu lỗi).
+        Các tài liệu chưa có trong cache được gói chung vào 1 prompt (BATCH_PROMPT.txt) trong
+        giới hạn VERIFY_BATCH_TOKEN_BUDGET; batch nào không parse được thì gọi lại từng tài liệu.
+        """
+        verdicts = [None] * len(documents)
+        pending = []  # (index, tagged_context, doc_type, cache_key)
+
+        for i, (pages_data, doc_type) in enumerate(documents):
+            if not pages_data: continue
+            try:
+                tagged_context = self._extract_relevant_context_with_pages(pages_data, user_topic)
+                if not tagged_context: continue
+                cache_key = self._verdict_cache_key(tagged_context, doc_type, user_topic, difficulty)
+                cached = self.verdict_cache.get(cache_key)
+                if cached is not None:
+                    verdicts[i] = cached
+                else:
+                    pending.append((i, tagged_context, doc_type, cache_key))
+            except Exception as e:
+                print(f"[ERROR] Logic error in verify: {e}")
+
+        for batch in self._pack_batches(pending):
+            try:
+                if len(batch) == 1:
+                    i, ctx, doc_type, key = batch[0]
+                    verdicts[i] = self._verify_context(ctx, doc_type, user_topic, difficulty, key)
+                    continue
+
+                batch_results = self._verify_batch(batch, user_topic, difficulty)
+                for i, ctx, doc_type, key in batch:
+                    parsed = batch_results.get(i)
+                    if parsed is None:
+                        # Fallback: batch lỗi / thiếu phần tử -> gọi riêng tài liệu này
+                        verdicts[i] = self._verify_context(ctx, doc_type, user_topic, difficulty, key)
+                    else:
+                        verdicts[i] = self._finalize_verdict(parsed, key)
+            except Exception as e:
+                print(f"[ERROR] Logic error in batch verify: {e}")
+
+        return verdicts
+
+    def _pack_batches(self, pending):
+        """Chia các tài liệu thành batch theo ngân sách token và số tài liệu tối đa."""
+        overhead = estimate_tokens(load_prompt('BATCH_PROMPT.txt'))
+        batches, current, current_tokens = [], [], overhead
+        for item in pending:
+            tokens = estimate_tokens(item[1])
+            if current and (len(current) >= VERIFY_BATCH_SIZE or current_tokens + tokens > VERIFY_BATCH_TOKEN_BUDGET):
+                batches.append(current)
+                current, current_tokens = [], overhead
+            current.append(item)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _verify_batch(self, batch, user_topic, difficulty):
+        """Gọi Gemini 1 lần cho cả batch. Trả về dict {index gốc: verdict} cho các phần tử hợp lệ."""
+        documents = "\n".join(
+            f"<<<DOC {pos} | {doc_type}>>>\n{ctx}\n<<<END DOC {pos}>>>"
+            for pos, (_, ctx, doc_type, _) in enumerate(batch)
+        )
+        prompt = load_prompt('BATCH_PROMPT.txt').replace("{user_topic}", str(user_topic)) \
+                                               .replace("{difficulty}", str(difficulty)) \
+                                               .replace("{doc_count}", str(len(batch))) \
+                                               .replace("{documents}", documents)
+        for _, ctx, _, _ in batch:
+            metrics.observe("verify_context_tokens", estimate_tokens(ctx), mode="batch")
+
+        with metrics.span("verify"):
+            res = self._call_gemini_with_retry(prompt, max_retries=5)
+        if not res: return {}
+
+        parsed = self._parse_model_json(res.text, pattern=r'\[.*\]')
+        if not isinstance(parsed, list):
+            print(f"[WARN] Batch verdict could not be parsed, falling back to single calls ({len(batch)} docs).")
+            return {}
+
+        results = {}
+        for item in parsed:
+            if not isinstance(item, dict): continue
+            pos = item.pop('doc_index', None)
+            if isinstance(pos, int) and 0 <= pos < len(batch):
+                results[batch[pos][0]] = item
+        return results
+
+    def _to_result(self, link, doc_type, evaluation):
+        """Chuyển verdict thành kết quả hiển thị nếu đạt (score >= 5 và có bài tập)."""
+        if evaluation:
+            score = evaluation.get('score', 0)
+            has_exercises = evaluation.get('contains_exercises', False)
+            reason = evaluation.get('reason', 'N/A')
             
-            for future in as_completed(future_to_url):
-                url = future_to_url[future]
-                completed_count += 1
-                
-                try:
-                    data = future.result()
-                    if data:
-                        print(f"[MATCH] Score: {data['score']} | {data['type']} | {url}")
-                        results.append(data)
-                except Exception as exc:
-                    print(f"[ERROR] {url} generated an exception: {exc}")
-                
-                # YIELD PROGRESS: Return current state
-                yield {
-                    "type": "progress_update",
-                    "current": completed_count,
-                    "total": total_links,
-                    "found": len(results)
+            if score >= 5 and has_exercises:
+                page_loc = evaluation.get('page_location', 'Unknown')
+                return {
+                    "url": link, "type": doc_type, "score": score,
+                    "page": page_loc, "reason": reason,
+                    "sample": evaluation.get('sample_question', '')
                 }
-        
-        # After processing all links, sort and return final results
-        results.sort(key=lambda x: x['score'], reverse=True)
-        yield {
-            "type": "final_result",
-            "data": results
-        }
-    
-    def process_links(self, links, topic, difficulty):
-        """Legacy method kept for backward compatibility - delegates to streaming version"""
-        results = []
-        for update in self.process_links_stream(links, topic, difficulty):
-            if update["type"] == "final_result":
-                results = update["data"]
-        return results
\ No newline at end of file
+        return None
+
+    def evaluate_document(self, link, pages_data, doc_type, topic, difficulty):
+        """Thẩm định 1 tài liệu đã bóc text. Trả về dict kết quả nếu đạt, ngược lại None."""
+        evaluation = self.verify_relevance(pages_data, doc_type, topic, difficulty)
+        return self._to_result(link, doc_type, evaluation)
+
+    def _locate_page(self, pages_data, topic):
+        """
+        Đoán trang chứa bài tập của 1 tài liệu (cùng định dạng page_location: "Trang N" / "Web"),
+        chấm như _extract_relevant_context_with_pages: tín hiệu bài tập * CONTEXT_SIGNAL_WEIGHT + từ khóa chủ đề.
+        """
+        signal_matcher = get_matcher(tuple(self.signal_keywords))
+        topic_matcher = get_matcher(tuple(topic.lower().split()))
+        best_page, best_score = None, 0.0
+        for page_item in pages_data or []:
+            lowered = str(page_item['text']).lower()
+            if not lowered: continue
+            score = (len(signal_matcher.find_starts(lowered)) * CONTEXT_SIGNAL_WEIGHT
+                     + len(topic_matcher.find_starts(lowered)))
+            if score > best_score:
+                best_page, best_score = page_item['page'], score
+        if best_page is None:
+            return 'Unknown'
+        return best_page if best_page == "Web" else f"Trang {best_page}"
+
+    def _reuse_verdict(self, verdict, pages_data, topic):
+        """Verdict của tài liệu gần trùng, với page_location tính lại trên chính pages_data của tài liệu này."""
+        if not verdict:
+            return verdict
+        return dict(verdict, page_location=self._locate_page(pages_data, topic))
+
+    def evaluate_documents(self, items, topic, difficulty, fingerprints=None):
+        """
+        Phiên bản batch của evaluate_document. items: list (link, pages_data, doc_type).
+        fingerprints (tùy chọn, cùng thứ tự items): SimHash đã tính sẵn. Tài liệu gần trùng với
+        tài liệu đã thẩm định (trong lượt này, lượt trước, hoặc cùng batch) dùng lại verdict đó,
+        riêng page_location được tính lại trên các trang của chính nó.
+        """
+        if fingerprints is None:
+            fingerprints = [self.fingerprint(pages) for _, pages, _ in items]
+        scope = self._verdict_scope(topic, difficulty)
+
+        verdicts = [None] * len(items)
+        pending = []      # index các tài liệu cần gọi Gemini
+        followers = {}    # index tài liệu gần trùng trong batch -> index tài liệu đại diện
+        for i, ((link, pages_data, _), fp) in enumerate(zip(items, fingerprints)):
+            duplicate = self.near_dups.lookup(scope, fp)
+            if duplicate:
+                print(f"[DUP] {link} ~ {duplicate[0]} (reuse verdict)")
+                verdicts[i] = self._reuse_verdict(duplicate[1], pages_data, topic)
+                continue
+            leader = next((j for j in pending if fp is not None and fingerprints[j] is not None
+                           and hamming(fp, fingerprints[j]) <= self.near_dups.max_distance), None)
+            if leader is None:
+                pending.append(i)
+            else:
+                followers[i] = leader
+
+        if pending:
+            fresh = self.verify_relevance_batch([(items[i][1], items[i][2]) for i in pending], topic, difficulty)
+            for i, verdict in zip(pending, fresh):
+                verdicts[i] = verdict
+                self.near_dups.add(scope, fingerprints[i], items[i][0], verdict)
+        for i, leader in followers.items():
+            verdicts[i] = self._reuse_verdict(verdicts[leader], items[i][1], topic)
+
+        return [self._to_result(link, doc_type, v) for (link, _, doc_type), v in zip(items, verdicts)]
+
+    def fingerprint(self, pages_data):
+        """SimHash của tài liệu (None nếu quá ngắn), dùng để phát hiện tài liệu gần trùng."""
+        return simhash(pages_data)
+
+    def find_duplicate_result(self, link, pages_data, doc_type, fingerprint, topic, difficulty):
+        """
+        Tra verdict của tài liệu gần trùng đã thẩm định trước đó (page_location tính lại trên pages_data).
+        Trả về (True, kết quả theo _to_result) nếu có, (False, None) nếu phải thẩm định.
+        """
+        duplicate = self.near_dups.lookup(self._verdict_scope(topic, difficulty), fingerprint)
+        if not duplicate:
+            return False, None
+        print(f"[DUP] {link} ~ {duplicate[0]} (reuse verdict)")
+        return True, self._to_result(link, doc_type, self._reuse_verdict(duplicate[1], pages_data, topic))
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import Counter
+
+from backend.metrics import metrics
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(BASE_DIR, ".cache"))
+# Thời điểm truy cập (cho LRU) chỉ được cập nhật khi đã cũ hơn CACHE_ATIME_RESOLUTION giây, và được ghi
+# theo lô (cùng lần set() kế tiếp hoặc khi đủ CACHE_ATIME_BATCH mục) thay vì 1 transaction cho mỗi lần đọc
+CACHE_ATIME_RESOLUTION = float(os.getenv("CACHE_ATIME_RESOLUTION_SECONDS", 60))
+CACHE_ATIME_BATCH = int(os.getenv("CACHE_ATIME_BATCH", 64))
+
+
+class DiskCache:
+    """
+    Cache key-value lưu trên SQLite (một file cho mỗi cache).
+    - TTL: mục quá hạn coi như miss với get(), nhưng vẫn đọc được qua peek() để revalidate.
+    - LRU: xóa mục ít được truy cập nhất khi vượt max_entries hoặc max_bytes (thời điểm truy cập
+      có độ phân giải CACHE_ATIME_RESOLUTION giây, đọc không mở transaction ghi mỗi lần).
+    Value phải serialize được bằng JSON.
+    """
+
+    def __init__(self, name, ttl=None, max_entries=None, max_bytes=None, cache_dir=None):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._pending_atime = {}  # key -> thời điểm truy cập chưa ghi xuống SQLite
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self._count, self._total_bytes = row
+
+    def _is_fresh(self, stored_at):
+        return self.ttl is None or (time.time() - stored_at) < self.ttl
+
+    def peek(self, key):
+        """Trả về (value, stored_at) kể cả khi đã hết TTL, None nếu không có. Không tính hit/miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at, accessed_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            if now - row[2] >= CACHE_ATIME_RESOLUTION:
+                self._pending_atime[key] = now
+                if len(self._pending_atime) >= CACHE_ATIME_BATCH:
+                    self._flush_atime()
+                    self._conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def _flush_atime(self):
+        # Gọi khi đang giữ lock; commit do người gọi thực hiện
+        if self._pending_atime:
+            self._conn.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?",
+                [(at, key) for key, at in self._pending_atime.items()],
+            )
+            self._pending_atime.clear()
+
+    def get(self, key):
+        """Trả về value nếu còn hạn, ngược lại None. Có cập nhật bộ đếm hit/miss."""
+        entry = self.peek(key)
+        if entry and self._is_fresh(entry[1]):
+            self.record("hits")
+            return entry[0]
+        self.record("misses")
+        return None
+
+    def is_fresh(self, entry):
+        return entry is not None and self._is_fresh(entry[1])
+
+    def set(self, key, value):
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._pending_atime.pop(key, None)
+            self._flush_atime()  # LRU của _evict() cần thời điểm truy cập mới nhất
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, now, now),
+            )
+            if old:
+                self._total_bytes -= old[0]
+            else:
+                self._count += 1
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def touch(self, key):
+        """Đánh dấu mục vừa được revalidate: reset thời điểm lưu (TTL tính lại từ đầu)."""
+        now = time.time()
+        with self._lock:
+            self._pending_atime.pop(key, None)
+            self._conn.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?", (now, now, key)
+            )
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._pending_atime.pop(key, None)
+            row = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count -= 1
+                self._total_bytes -= row[0]
+                self._conn.commit()
+
+    def keys(self, prefix=""):
+        """Các khóa bắt đầu bằng prefix (kể cả mục đã hết TTL). Không tính hit/miss."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _evict(self):
+        # Gọi khi đang giữ lock
+        while (self.max_entries is not None and self._count > self.max_entries) or \
+              (self.max_bytes is not None and self._total_bytes > self.max_bytes and self._count > 1):
+            row = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at ASC LIMIT 1"
+            ).fetchone()
+            if not row:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            self._count -= 1
+            self._total_bytes -= row[1]
+            self._counters["evictions"] += 1
+            metrics.inc("cache_events_total", cache=self.name, event="evictions")
+
+    def record(self, event, n=1):
+        with self._lock:
+            self._counters[event] += n
+        metrics.inc("cache_events_total", n, cache=self.name, event=event)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data.update({"entries": self._count, "bytes": self._total_bytes})
+        data.setdefault("hits", 0)
+        data.setdefault("misses", 0)
+        return data
@@ -0,0 +1,228 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+
+from backend.disk_cache import CACHE_DIR
+from backend.url_utils import canonicalize_url
+
+# Một query phải khớp ít nhất tỉ lệ này trong số từ của nó thì tài liệu mới được tính là hit
+LOCAL_INDEX_MIN_COVERAGE = float(os.getenv("LOCAL_INDEX_MIN_COVERAGE", 0.6))
+# Số tài liệu tối đa trong index; vượt quá thì xóa tài liệu được đánh chỉ mục lâu nhất
+LOCAL_INDEX_MAX_DOCS = int(os.getenv("LOCAL_INDEX_MAX_DOCS", 10000))
+
+_TOKEN_RE = re.compile(r"\w+")
+# Toán tử Custom Search (dùng chung với search_engine.normalize_query) không có ý nghĩa với index cục bộ;
+# "-từ" / "-\"cụm\"" là loại trừ, còn "-1", "x:" ... là nội dung bình thường của query
+QUERY_OPERATORS = ("site", "filetype", "intitle", "inurl")
+_OPERATOR_RE = re.compile(
+    r'-?(?:' + "|".join(QUERY_OPERATORS) + r'):(?:"[^"]*"|\S+)|(?<!\S)-(?:"[^"]*"|[^\W\d_]+(?!\S))'
+)
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "its",
+    "of", "on", "or", "that", "the", "this", "to", "was", "were", "with", "pdf", "doc", "docx",
+    "và", "của", "các", "là", "có", "cho", "với", "trong", "một", "những", "được",
+}
+
+
+def _stem(token):
+    # Bỏ "s" số nhiều tiếng Anh (problems -> problem), đủ để query và tài liệu khớp nhau
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss") and token.isascii():
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Tách từ (chữ thường, giữ dấu tiếng Việt), bỏ stopword, số thuần và token quá ngắn/dài."""
+    return [
+        _stem(t) for t in _TOKEN_RE.findall(str(text).lower())
+        if 2 <= len(t) <= 40 and not t.isdigit() and t not in _STOPWORDS
+    ]
+
+
+class DocumentIndex:
+    """
+    Inverted index trên SQLite cho mọi tài liệu đã được fetch + parse.
+    Posting lưu theo (term, tài liệu, trang) để giữ được số trang của từng hit.
+    Cập nhật tăng dần: add() thay postings của đúng 1 tài liệu (khóa theo URL chuẩn hóa).
+    Giữ tối đa max_docs tài liệu: vượt quá thì xóa tài liệu có indexed_at cũ nhất (kèm postings).
+    search() chấm điểm BM25 ở mức tài liệu, trả về kèm các trang khớp nhiều nhất.
+    """
+
+    def __init__(self, name="doc_index", cache_dir=None, k1=1.2, b=0.75, max_docs=LOCAL_INDEX_MAX_DOCS):
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self.k1 = k1
+        self.b = b
+        self.max_docs = max_docs
+
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " doc_id INTEGER PRIMARY KEY,"
+            " key TEXT UNIQUE NOT NULL,"
+            " url TEXT NOT NULL,"
+            " doc_type TEXT,"
+            " length INTEGER NOT NULL,"
+            " indexed_at REAL NOT NULL)"
+        )
+        # page không khai báo kiểu: số trang (PDF) hoặc "Web"
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL,"
+            " doc_id INTEGER NOT NULL,"
+            " page,"
+            " tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, doc_id, page)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_indexed_at ON docs(indexed_at)")
+        self._conn.commit()
+
+        row = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+        self._count, self._total_length = row
+        with self._lock:
+            self._evict()  # max_docs có thể đã giảm so với lần chạy trước
+            self._conn.commit()
+
+    def add(self, url, pages_data, doc_type, replace=True):
+        """
+        Đánh chỉ mục 1 tài liệu. replace=False: bỏ qua nếu URL đã có trong index
+        (dùng khi tài liệu lấy từ fetch cache, nội dung không đổi).
+        """
+        key = canonicalize_url(url)
+        if not replace:
+            with self._lock:
+                if self._conn.execute("SELECT 1 FROM docs WHERE key = ?", (key,)).fetchone():
+                    return
+
+        rows = []
+        length = 0
+        for page in pages_data:
+            counts = Counter(tokenize(page.get("text", "")))
+            length += sum(counts.values())
+            rows += [(term, page.get("page"), tf) for term, tf in counts.items()]
+        if not rows:
+            return
+
+        with self._lock:
+            old = self._conn.execute("SELECT doc_id, length FROM docs WHERE key = ?", (key,)).fetchone()
+            if old:
+                self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (old[0],))
+                self._conn.execute("DELETE FROM docs WHERE doc_id = ?", (old[0],))
+                self._count -= 1
+                self._total_length -= old[1]
+            cur = self._conn.execute(
+                "INSERT INTO docs (key, url, doc_type, length, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, url, doc_type, length, time.time()),
+            )
+            doc_id = cur.lastrowid
+            self._conn.executemany(
+                "INSERT INTO postings (term, doc_id, page, tf) VALUES (?, ?, ?, ?)",
+                [(term, doc_id, page, tf) for term, page, tf in rows],
+            )
+            self._count += 1
+            self._total_length += length
+            self._counters["indexed"] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Gọi khi đang giữ lock
+        excess = self._count - self.max_docs if self.max_docs is not None else 0
+        if excess <= 0:
+            return
+        rows = self._conn.execute(
+            "SELECT doc_id, length FROM docs ORDER BY indexed_at ASC LIMIT ?", (excess,)
+        ).fetchall()
+        for doc_id, length in rows:
+            self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self._count -= 1
+            self._total_length -= length
+        self._counters["evictions"] += len(rows)
+
+    def search(self, query, limit=10):
+        """
+        Tìm trong index cục bộ. Trả về list dict {"url", "doc_type", "score", "pages"}
+        sắp xếp theo score giảm dần; pages là các trang khớp nhiều từ của query nhất.
+        """
+        terms = list(dict.fromkeys(tokenize(_OPERATOR_RE.sub(" ", str(query).lower()).replace('"', " "))))
+        if not terms or not self._count:
+            return []
+
+        with self._lock:
+            n_docs = self._count
+            avg_len = self._total_length / n_docs
+            postings = {
+                term: self._conn.execute(
+                    "SELECT doc_id, page, tf FROM postings WHERE term = ?", (term,)
+                ).fetchall()
+                for term in terms
+            }
+
+        doc_tf = defaultdict(Counter)      # doc_id -> term -> tf (cộng mọi trang)
+        page_hits = defaultdict(Counter)   # doc_id -> page -> số từ query xuất hiện
+        for term, rows in postings.items():
+            for doc_id, page, tf in rows:
+                doc_tf[doc_id][term] += tf
+                page_hits[doc_id][page] += 1
+
+        min_terms = max(1, math.ceil(LOCAL_INDEX_MIN_COVERAGE * len(terms)))
+        candidates = [doc_id for doc_id, tfs in doc_tf.items() if len(tfs) >= min_terms]
+        if not candidates:
+            self.record("misses")
+            return []
+
+        meta = {}
+        with self._lock:
+            # Chia nhỏ để không vượt giới hạn số tham số của SQLite
+            for i in range(0, len(candidates), 500):
+                chunk = candidates[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row in self._conn.execute(
+                    f"SELECT doc_id, url, doc_type, length FROM docs WHERE doc_id IN ({placeholders})", chunk
+                ):
+                    meta[row[0]] = row[1:]
+
+        idf = {}
+        for term, rows in postings.items():
+            df = len({doc_id for doc_id, _, _ in rows})
+            idf[term] = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+
+        hits = []
+        for doc_id in candidates:
+            if doc_id not in meta:
+                continue
+            url, doc_type, length = meta[doc_id]
+            norm = self.k1 * (1 - self.b + self.b * length / avg_len)
+            score = sum(
+                idf[term] * tf * (self.k1 + 1) / (tf + norm)
+                for term, tf in doc_tf[doc_id].items()
+            )
+            pages = [page for page, _ in page_hits[doc_id].most_common(3)]
+            hits.append({"url": url, "doc_type": doc_type, "score": score, "pages": pages})
+
+        hits.sort(key=lambda h: h["score"], reverse=True)
+        self.record("hits" if hits else "misses")
+        return hits[:limit]
+
+    def record(self, event, n=1):
+        with self._lock:
+            self._counters[event] += n
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._counters)
+            data.update({"documents": self._count})
+        data.setdefault("hits", 0)
+        data.setdefault("misses", 0)
+        return data
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+
+class HistoryStore:
+    """
+    Lưu lịch sử chat trên SQLite:
+    - Mỗi tin nhắn là 1 dòng (append O(1), không ghi lại toàn bộ file).
+    - Tra cứu theo chat_id qua khóa chính / index.
+    - Tự động migrate một lần từ chat_history.json cũ.
+    """
+
+    def __init__(self, db_path, legacy_json_path=None):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chats (
+                id TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                logs TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, id);
+            CREATE INDEX IF NOT EXISTS idx_chats_updated ON chats(updated_at);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            """
+        )
+        self._conn.commit()
+
+        if legacy_json_path:
+            self._migrate_from_json(legacy_json_path)
+
+    def _migrate_from_json(self, path):
+        """Import chat_history.json (định dạng cũ) đúng một lần."""
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key = 'migrated_json'").fetchone()
+            if done or not os.path.exists(path):
+                return
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    history = json.load(f)
+            except Exception as e:
+                print(f"[STORAGE ERROR] Could not read legacy history {path}: {e}")
+                history = []
+
+            # Giữ nguyên thứ tự cũ: chat sau trong file có thời gian lớn hơn
+            base = time.time() - len(history)
+            for idx, chat in enumerate(history):
+                ts = base + idx
+                messages = chat.get('messages', [])
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO chats (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?)",
+                    (str(chat['id']), chat.get('title', ''), ts, ts, len(messages)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO messages (chat_id, role, content, logs, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (str(chat['id']), m.get('role', ''), m.get('content', ''),
+                         json.dumps(m['logs'], ensure_ascii=False) if 'logs' in m else None, ts)
+                        for m in messages
+                    ],
+                )
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_json', ?)", (str(time.time()),))
+            self._conn.commit()
+            print(f"[STORAGE] Migrated {len(history)} chats from {path}")
+
+    def list_chats(self, limit=50, offset=0):
+        """Danh sách tóm tắt (không kèm tin nhắn), mới nhất trước. Trả về (items, total)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, title, updated_at, message_count FROM chats ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+            total = self._conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+        items = [
+            {"id": r[0], "title": r[1], "updated_at": r[2], "message_count": r[3]}
+            for r in rows
+        ]
+        return items, total
+
+    def get_chat(self, chat_id):
+        with self._lock:
+            chat = self._conn.execute(
+                "SELECT id, title, updated_at FROM chats WHERE id = ?", (chat_id,)
+            ).fetchone()
+            if not chat:
+                return None
+            rows = self._conn.execute(
+                "SELECT role, content, logs FROM messages WHERE chat_id = ? ORDER BY id", (chat_id,)
+            ).fetchall()
+        messages = []
+        for role, content, logs in rows:
+            msg = {"role": role, "content": content}
+            if logs is not None:
+                msg["logs"] = json.loads(logs)
+            messages.append(msg)
+        return {"id": chat[0], "title": chat[1], "updated_at": chat[2], "messages": messages}
+
+    def ensure_chat(self, chat_id, title):
+        """Tạo chat nếu chưa tồn tại."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO chats (id, title, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (chat_id, title, now, now),
+            )
+            self._conn.commit()
+
+    def append_message(self, chat_id, message):
+        """Thêm 1 tin nhắn vào cuối chat. Trả về False nếu chat không tồn tại (VD: đã bị xóa)."""
+        now = time.time()
+        logs = message.get("logs")
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE chats SET updated_at = ?, message_count = message_count + 1 WHERE id = ?",
+                (now, chat_id),
+            )
+            if cur.rowcount == 0:
+                self._conn.rollback()
+                return False
+            self._conn.execute(
+                "INSERT INTO messages (chat_id, role, content, logs, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, message.get("role", ""), message.get("content", ""),
+                 json.dumps(logs, ensure_ascii=False) if logs is not None else None, now),
+            )
+            self._conn.commit()
+        return True
+
+    def delete_chat(self, chat_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+            self._conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+            self._conn.commit()
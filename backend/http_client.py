@@ -0,0 +1,376 @@
+import io
+import os
+import time
+import tempfile
+import threading
+import weakref
+from collections import Counter
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# Disable SSL warnings
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Fetch client Configuration
+FETCH_CONNECT_TIMEOUT = float(os.getenv("FETCH_CONNECT_TIMEOUT", 3))
+FETCH_READ_TIMEOUT = float(os.getenv("FETCH_READ_TIMEOUT", 8))
+FETCH_POOL_HOSTS = int(os.getenv("FETCH_POOL_HOSTS", 64))
+FETCH_PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 2))
+FETCH_HOST_MIN_INTERVAL = float(os.getenv("FETCH_HOST_MIN_INTERVAL", 0.25))
+FETCH_HOST_FAIL_THRESHOLD = int(os.getenv("FETCH_HOST_FAIL_THRESHOLD", 2))
+FETCH_HOST_BLOCK_SECONDS = float(os.getenv("FETCH_HOST_BLOCK_SECONDS", 600))
+
+# Tải body dạng stream: giới hạn dung lượng (HTML vượt giới hạn bị cắt, PDF bị bỏ),
+# body lớn hơn FETCH_SPOOL_KB được ghi ra file tạm thay vì giữ trong RAM
+FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_MB", 32)) * 1024 * 1024
+FETCH_HTML_MAX_BYTES = int(os.getenv("FETCH_HTML_MAX_MB", 4)) * 1024 * 1024
+FETCH_SPOOL_BYTES = int(os.getenv("FETCH_SPOOL_KB", 1024)) * 1024
+FETCH_CHUNK_BYTES = 64 * 1024
+# PDF từ FETCH_RANGE_MIN_MB trở lên trên server hỗ trợ Range: parser chỉ đọc các block nó cần
+# (xref, các trang đầu) thay vì tải cả file, tối đa FETCH_RANGE_MAX_MB mỗi tài liệu
+FETCH_RANGE_MIN_BYTES = int(os.getenv("FETCH_RANGE_MIN_MB", 8)) * 1024 * 1024
+FETCH_RANGE_MAX_BYTES = int(os.getenv("FETCH_RANGE_MAX_MB", 16)) * 1024 * 1024
+FETCH_RANGE_BLOCK_BYTES = 256 * 1024
+
+# Content-Type được parse (HTML/PDF) và các loại chung chung cần đoán theo nội dung
+_HTML_TYPES = ("text/html", "application/xhtml+xml", "text/plain", "text/xml", "application/xml")
+_UNKNOWN_TYPES = ("", "application/octet-stream", "binary/octet-stream", "application/download",
+                  "application/force-download", "application/x-download", "application/unknown")
+
+
+class HostBlockedError(Exception):
+    """Host đang nằm trong negative cache (timeout liên tục gần đây)."""
+
+
+class ContentRejected(Exception):
+    """Response bị bỏ trước khi tải hết: không phải HTML/PDF hoặc vượt giới hạn dung lượng."""
+
+    def __init__(self, reason, url=""):
+        super().__init__(f"{reason}: {url}")
+        self.reason = reason
+
+
+def _media_type(content_type):
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def is_rejected_type(content_type):
+    """Content-Type khai báo rõ là loại không parse được (ảnh, video, zip, doc, ...)."""
+    media = _media_type(content_type)
+    return not ("pdf" in media or media in _HTML_TYPES or media in _UNKNOWN_TYPES)
+
+
+def sniff_kind(content_type, head):
+    """Loại tài liệu theo Content-Type và các byte đầu: "pdf", "html" hoặc None (nhị phân, bỏ qua)."""
+    media = _media_type(content_type)
+    if "pdf" in media or b"%PDF-" in head[:1024]:
+        return "pdf"
+    if media in _HTML_TYPES:
+        return "html"
+    if media in _UNKNOWN_TYPES and b"\x00" not in head[:1024]:
+        return "html"
+    return None
+
+
+def _remove_file(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class SpooledBody:
+    """
+    Body đã tải: giữ trong RAM tới spool_bytes, lớn hơn thì ghi ra file tạm (parser đọc thẳng từ file).
+    File tạm bị xóa khi close() hoặc khi object bị thu gom.
+    """
+
+    def __init__(self, spool_bytes=FETCH_SPOOL_BYTES):
+        self.spool_bytes = spool_bytes
+        self.size = 0
+        self.path = None
+        self._buffer = bytearray()
+        self._file = None
+        self._finalizer = None
+
+    def write(self, chunk):
+        if self._file is None and len(self._buffer) + len(chunk) > self.spool_bytes:
+            self._file = tempfile.NamedTemporaryFile(prefix="fetch-", suffix=".part", delete=False)
+            self.path = self._file.name
+            self._finalizer = weakref.finalize(self, _remove_file, self.path)
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer += chunk
+        self.size += len(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    def source(self):
+        """Thứ parse_document nhận: bytes (body nhỏ) hoặc đường dẫn file tạm."""
+        return self.path if self.path is not None else bytes(self._buffer)
+
+    def close(self):
+        self.finish()
+        self._buffer = bytearray()
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+class RangeSource:
+    """
+    Tài liệu trên server hỗ trợ Range, chưa tải về. Các block được đọc qua FetchClient dùng chung
+    (giới hạn theo host, negative cache), nên RangeSource được parse ngay trong process chính.
+    """
+
+    def __init__(self, client, url, size, headers=None, max_bytes=FETCH_RANGE_MAX_BYTES,
+                 block_bytes=FETCH_RANGE_BLOCK_BYTES):
+        self.client = client
+        self.url = url
+        self.size = size
+        self.headers = {k: v for k, v in (headers or {}).items() if not k.lower().startswith("if-")}
+        self.max_bytes = max_bytes
+        self.block_bytes = block_bytes
+
+    def open(self):
+        return RangeFile(self)
+
+
+class RangeFile(io.RawIOBase):
+    """File chỉ đọc trên RangeSource: mỗi block được tải 1 lần bằng HTTP Range, tổng không quá max_bytes."""
+
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+        self.fetched = 0
+        self._pos = 0
+        self._blocks = {}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.source.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _block(self, index):
+        data = self._blocks.get(index)
+        if data is None:
+            start = index * self.source.block_bytes
+            end = min(start + self.source.block_bytes, self.source.size) - 1
+            if self.fetched + end - start + 1 > self.source.max_bytes:
+                raise OSError(f"range budget ({self.source.max_bytes} bytes) exceeded: {self.source.url}")
+            data = self.source.client.get_range(self.source.url, start, end, headers=self.source.headers)
+            self.fetched += len(data)
+            self._blocks[index] = data
+        return data
+
+    def read(self, size=-1):
+        end = self.source.size if size is None or size < 0 else min(self._pos + size, self.source.size)
+        out = bytearray()
+        while self._pos < end:
+            index, offset = divmod(self._pos, self.source.block_bytes)
+            piece = self._block(index)[offset:offset + end - self._pos]
+            if not piece:
+                break
+            out += piece
+            self._pos += len(piece)
+        return bytes(out)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _HostState:
+    def __init__(self, limit):
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.next_allowed = 0.0
+        self.failures = 0
+        self.blocked_until = 0.0
+
+
+class FetchClient:
+    """
+    HTTP client dùng chung cho việc tải tài liệu:
+    - Session keep-alive với connection pool (không bắt tay TCP/TLS lại cho cùng host).
+    - Giới hạn số request đồng thời và khoảng cách tối thiểu giữa 2 request cho mỗi host.
+    - Timeout connect/read riêng biệt.
+    - Negative cache: host timeout liên tục sẽ bị bỏ qua một thời gian thay vì tốn timeout lần nữa.
+    """
+
+    def __init__(self, connect_timeout=FETCH_CONNECT_TIMEOUT, read_timeout=FETCH_READ_TIMEOUT,
+                 pool_hosts=FETCH_POOL_HOSTS, per_host_limit=FETCH_PER_HOST_LIMIT,
+                 min_interval=FETCH_HOST_MIN_INTERVAL, fail_threshold=FETCH_HOST_FAIL_THRESHOLD,
+                 block_seconds=FETCH_HOST_BLOCK_SECONDS):
+        self.timeout = (connect_timeout, read_timeout)
+        self.per_host_limit = per_host_limit
+        self.min_interval = min_interval
+        self.fail_threshold = fail_threshold
+        self.block_seconds = block_seconds
+
+        self.session = requests.Session()
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=per_host_limit)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._hosts = {}
+        self._counters = Counter()
+
+    def _host_state(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _HostState(self.per_host_limit)
+            return state
+
+    def _record(self, event, n=1):
+        # Counter được cập nhật từ nhiều thread fetch: cần lock
+        with self._lock:
+            self._counters[event] += n
+
+    def is_blocked(self, url):
+        host = (urlsplit(url).hostname or "").lower()
+        state = self._hosts.get(host)
+        return state is not None and time.monotonic() < state.blocked_until
+
+    def get(self, url, headers=None, consume=None, **kwargs):
+        """
+        requests.get qua pool dùng chung. Raise HostBlockedError nếu host đang bị chặn tạm thời.
+        consume(response) (tùy chọn, dùng với stream=True) đọc body khi vẫn giữ slot của host;
+        kết quả của nó được trả về thay cho response.
+        """
+        host = (urlsplit(url).hostname or "").lower()
+        state = self._host_state(host)
+
+        if time.monotonic() < state.blocked_until:
+            self._record("blocked")
+            raise HostBlockedError(host)
+
+        with state.semaphore:
+            # Politeness: giãn cách các request tới cùng host
+            with state.lock:
+                now = time.monotonic()
+                wait = state.next_allowed - now
+                state.next_allowed = max(now, state.next_allowed) + self.min_interval
+            if wait > 0:
+                time.sleep(wait)
+
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout, **kwargs)
+                if consume is not None:
+                    with response:
+                        response = consume(response)
+            except (requests.Timeout, requests.ConnectionError):
+                self._record("failures")
+                with state.lock:
+                    state.failures += 1
+                    if state.failures >= self.fail_threshold:
+                        state.blocked_until = time.monotonic() + self.block_seconds
+                        print(f"[FETCH] Host {host} timed out {state.failures} times, skipping for {self.block_seconds:.0f}s")
+                raise
+
+        with state.lock:
+            state.failures = 0
+        self._record("requests")
+        return response
+
+    def get_range(self, url, start, end, headers=None):
+        """
+        Đọc byte [start, end] bằng HTTP Range qua pool dùng chung. Đọc dạng stream và dừng sau end - start + 1 byte,
+        kể cả khi server trả về nhiều hơn; response không phải 206 (server bỏ qua Range) là lỗi (OSError).
+        """
+        wanted = end - start + 1
+
+        def consume(response):
+            if response.status_code != 206:
+                raise OSError(f"range request not honoured ({response.status_code}): {url}")
+            data = bytearray()
+            for chunk in response.iter_content(min(FETCH_CHUNK_BYTES, wanted)):
+                data += chunk[:wanted - len(data)]
+                if len(data) >= wanted:
+                    break
+            return bytes(data)
+
+        headers = dict(headers or {}, Range=f"bytes={start}-{end}")
+        data = self.get(url, headers=headers, consume=consume, stream=True)
+        self._record("range_requests")
+        return data
+
+    def download(self, url, headers=None, max_bytes=FETCH_MAX_BYTES, html_max_bytes=FETCH_HTML_MAX_BYTES,
+                 spool_bytes=FETCH_SPOOL_BYTES, range_min_bytes=FETCH_RANGE_MIN_BYTES):
+        """
+        Tải tài liệu HTML/PDF dạng stream. Trả về (response, body, kind):
+        - body: SpooledBody, RangeSource (PDF lớn, đọc dần bằng Range) hoặc None (304);
+        - kind: "pdf" / "html" theo Content-Type + các byte đầu.
+        Raise ContentRejected khi bỏ giữa chừng (loại nội dung khác, PDF quá lớn).
+        """
+        def consume(response):
+            if response.status_code == 304:
+                return response, None, None
+            content_type = response.headers.get("Content-Type", "")
+            if is_rejected_type(content_type):
+                raise ContentRejected("content_type", url)
+            length = int(response.headers.get("Content-Length") or 0)
+            if "pdf" in _media_type(content_type) and length >= range_min_bytes \
+                    and "bytes" in response.headers.get("Accept-Ranges", "").lower():
+                self._record("range_sources")
+                return response, RangeSource(self, response.url, length, headers), "pdf"
+
+            chunks = response.iter_content(FETCH_CHUNK_BYTES)
+            head = next(chunks, b"")
+            kind = sniff_kind(content_type, head)
+            if kind is None:
+                raise ContentRejected("content_type", url)
+            limit = max_bytes if kind == "pdf" else html_max_bytes
+            if kind == "pdf" and length > limit:
+                raise ContentRejected("too_large", url)
+
+            body = SpooledBody(spool_bytes)
+            try:
+                body.write(head[:limit])
+                for chunk in chunks:
+                    if body.size + len(chunk) > limit:
+                        if kind == "pdf":
+                            raise ContentRejected("too_large", url)
+                        body.write(chunk[:limit - body.size])  # HTML: giữ phần đầu, bỏ phần còn lại
+                        self._record("truncated")
+                        break
+                    body.write(chunk)
+            except BaseException:
+                body.close()
+                raise
+            body.finish()
+            return response, body, kind
+
+        try:
+            return self.get(url, headers=headers, consume=consume, stream=True)
+        except ContentRejected as e:
+            self._record(f"rejected_{e.reason}")
+            raise
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            blocked = sum(1 for s in self._hosts.values() if now < s.blocked_until)
+            data = dict(self._counters)
+            data.update({"hosts": len(self._hosts), "blocked_hosts": blocked})
+        return data
@@ -0,0 +1,252 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Số lượt tìm kiếm chạy đồng thời (các job còn lại xếp hàng) và thời gian giữ event log sau khi xong
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION_SECONDS", 15 * 60))
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", 500))
+# Người đọc chờ sự kiện mới tối đa bao lâu mỗi lượt (để kiểm tra lại trạng thái job)
+JOB_POLL_SECONDS = 15.0
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Job:
+    """
+    1 lượt tìm kiếm chạy nền. Sự kiện (các dòng NDJSON) được lưu lại theo thứ tự nên client
+    có thể đọc lại từ offset bất kỳ sau khi reload trang hoặc mất kết nối.
+    """
+
+    QUEUED, RUNNING, DONE, CANCELLED = "queued", "running", "done", "cancelled"
+
+    def __init__(self, chat_id, key):
+        self.id = uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.key = key
+        self.status = self.QUEUED
+        self.events = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._cond = threading.Condition()
+        self._async_waiters = []  # (loop, future) của người đọc async
+        self._task = None         # (loop, task) nếu job chạy trên event loop
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.CANCELLED)
+
+    def _notify(self):
+        # Gọi khi đang giữ lock
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        self._async_waiters = []
+
+    def append(self, line):
+        with self._cond:
+            self.events.append(line)
+            self._notify()
+
+    def finish(self, status=DONE):
+        with self._cond:
+            if self.cancel_event.is_set():
+                status = self.CANCELLED
+            self.status = status
+            self.finished_at = time.time()
+            self._notify()
+
+    def cancel(self):
+        """Yêu cầu dừng job: pipeline bị đóng ở sự kiện kế tiếp (job async bị hủy ngay)."""
+        self.cancel_event.set()
+        if self._task is not None:
+            loop, task = self._task
+            loop.call_soon_threadsafe(task.cancel)
+
+    def read(self, offset, timeout=JOB_POLL_SECONDS):
+        """Chờ tới khi có sự kiện sau `offset` (hoặc job xong / hết timeout). Trả về (các dòng mới, đã xong)."""
+        with self._cond:
+            if offset >= len(self.events) and not self.finished:
+                self._cond.wait(timeout)
+            return self.events[offset:], self.finished
+
+    async def aread(self, offset, timeout=JOB_POLL_SECONDS):
+        """Phiên bản async của read(): không giữ thread trong lúc chờ."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if offset < len(self.events) or self.finished:
+                return self.events[offset:], self.finished
+            future = loop.create_future()
+            self._async_waiters.append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._cond:
+            return self.events[offset:], self.finished
+
+    def follow(self, offset=0):
+        """Generator: các dòng từ `offset` cho tới khi job kết thúc."""
+        while True:
+            lines, finished = self.read(offset)
+            offset += len(lines)
+            yield from lines
+            if finished and not lines:
+                return
+
+    async def afollow(self, offset=0):
+        while True:
+            lines, finished = await self.aread(offset)
+            offset += len(lines)
+            for line in lines:
+                yield line
+            if finished and not lines:
+                return
+
+    def info(self):
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "chat_id": self.chat_id,
+                "status": self.status,
+                "events": len(self.events),
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """
+    Chạy các lượt tìm kiếm thành job nền với số worker giới hạn, tách khỏi kết nối HTTP:
+    client ngắt kết nối thì job vẫn chạy tiếp, client mới đọc lại event log từ offset bất kỳ.
+    Request giống hệt (cùng khóa) của cùng 1 chat khi job trước chưa xong được gộp vào job đó.
+    Job đã xong được giữ `retention` giây (tối đa `max_finished` job) rồi xóa khỏi bộ nhớ.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, retention=JOB_RETENTION, max_finished=JOB_MAX_FINISHED):
+        self.workers = workers
+        self.retention = retention
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._async_slots = {}            # event loop -> asyncio.Semaphore(workers)
+        self._jobs = OrderedDict()        # job_id -> Job (theo thứ tự tạo)
+        self._active = {}                 # khóa request -> Job chưa xong
+        self._lock = threading.Lock()
+
+    def _register(self, chat_id, key):
+        """Trả về (job, True) nếu tạo mới, (job đang chạy cùng khóa, False) nếu trùng."""
+        with self._lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None and not job.finished:
+                return job, False
+            job = Job(chat_id, key)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            return job, True
+
+    def _release(self, job):
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+
+    def submit(self, chat_id, key, events, on_create=None):
+        """
+        events(job) trả về generator các dòng NDJSON, chạy trong thread pool của job.
+        on_create (tùy chọn) được gọi 1 lần khi job mới được tạo, trước khi job bắt đầu chạy.
+        Trả về (job, created).
+        """
+        job, created = self._register(chat_id, key)
+        if created:
+            if on_create is not None:
+                on_create()
+            self._executor.submit(self._run, job, events)
+        return job, created
+
+    def _run(self, job, events):
+        stream = None
+        try:
+            if job.cancel_event.is_set():
+                return  # Bị hủy khi còn xếp hàng
+            job.status = Job.RUNNING
+            stream = events(job)
+            for line in stream:
+                job.append(line)
+                if job.cancel_event.is_set():
+                    break
+        except Exception as e:
+            print(f"[JOB ERROR] {job.id}: {e}")
+        finally:
+            if stream is not None:
+                stream.close()
+            self._release(job)
+            job.finish()
+
+    def submit_async(self, chat_id, key, events, on_create=None):
+        """Như submit() nhưng events(job) là async generator, chạy như task trên event loop hiện tại."""
+        job, created = self._register(chat_id, key)
+        if created:
+            if on_create is not None:
+                on_create()
+            loop = asyncio.get_running_loop()
+            job._task = (loop, loop.create_task(self._arun(job, events)))
+        return job, created
+
+    async def _arun(self, job, events):
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.setdefault(loop, asyncio.Semaphore(self.workers))
+        stream = None
+        try:
+            async with slots:
+                if job.cancel_event.is_set():
+                    return
+                job.status = Job.RUNNING
+                stream = events(job)
+                async for line in stream:
+                    job.append(line)
+                    if job.cancel_event.is_set():
+                        break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"[JOB ERROR] {job.id}: {e}")
+        finally:
+            if stream is not None:
+                await stream.aclose()
+            self._release(job)
+            job.finish()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_for_chat(self, chat_id):
+        """Job chưa xong mới nhất của chat (None nếu không có)."""
+        with self._lock:
+            for job in reversed(self._jobs.values()):
+                if job.chat_id == chat_id and not job.finished:
+                    return job
+        return None
+
+    def _prune(self):
+        # Gọi khi đang giữ lock: bỏ job đã xong quá hạn, hoặc cũ nhất khi vượt max_finished
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished]
+        excess = len(finished) - self.max_finished
+        for job in finished:
+            if excess > 0 or now - job.finished_at > self.retention:
+                del self._jobs[job.id]
+                excess -= 1
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (Job.QUEUED, Job.RUNNING, Job.DONE, Job.CANCELLED)}
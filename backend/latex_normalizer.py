@@ -0,0 +1,327 @@
+import re
+import unicodedata
+
+# Ký tự rác khi bóc text PDF: ligature, khoảng trắng đặc biệt, soft hyphen, zero-width, dấu trừ Unicode
+_ARTIFACTS = str.maketrans({
+    "\ufb00": "ff", "\ufb01": "fi", "\ufb02": "fl", "\ufb03": "ffi", "\ufb04": "ffl",
+    "\u00a0": " ", "\u2002": " ", "\u2003": " ", "\u2007": " ", "\u2009": " ", "\u202f": " ",
+    "\u00ad": "", "\u200b": "", "\u200c": "", "\u200d": "", "\ufeff": "",
+    "\u2212": "-", "\u2215": "/", "\u2032": "'", "\u2033": "''",
+})
+
+# Ký hiệu toán Unicode -> lệnh LaTeX (dùng trong math mode)
+_SYMBOLS = {
+    "×": r"\times", "·": r"\cdot", "⋅": r"\cdot", "÷": r"\div", "±": r"\pm", "∓": r"\mp",
+    "≤": r"\leq", "≥": r"\geq", "≠": r"\neq", "≈": r"\approx", "≡": r"\equiv", "∼": r"\sim", "∝": r"\propto",
+    "∞": r"\infty", "∫": r"\int", "∬": r"\iint", "∮": r"\oint", "∑": r"\sum", "∏": r"\prod",
+    "√": r"\sqrt", "∂": r"\partial", "∇": r"\nabla", "∆": r"\Delta",
+    "∈": r"\in", "∉": r"\notin", "∋": r"\ni", "⊂": r"\subset", "⊃": r"\supset", "⊆": r"\subseteq",
+    "⊇": r"\supseteq", "∪": r"\cup", "∩": r"\cap", "∅": r"\emptyset", "∖": r"\setminus",
+    "∀": r"\forall", "∃": r"\exists", "¬": r"\neg", "∧": r"\wedge", "∨": r"\vee",
+    "→": r"\to", "←": r"\leftarrow", "↔": r"\leftrightarrow", "⇒": r"\Rightarrow", "⇐": r"\Leftarrow",
+    "⇔": r"\Leftrightarrow", "↦": r"\mapsto", "∘": r"\circ", "°": r"^{\circ}", "⊥": r"\perp",
+    "∥": r"\parallel", "∠": r"\angle", "…": r"\ldots", "⋯": r"\cdots", "⊗": r"\otimes", "⊕": r"\oplus",
+    "ℝ": r"\mathbb{R}", "ℕ": r"\mathbb{N}", "ℤ": r"\mathbb{Z}", "ℚ": r"\mathbb{Q}", "ℂ": r"\mathbb{C}",
+    "α": r"\alpha", "β": r"\beta", "γ": r"\gamma", "δ": r"\delta", "ε": r"\varepsilon", "ϵ": r"\epsilon",
+    "ζ": r"\zeta", "η": r"\eta", "θ": r"\theta", "ϑ": r"\vartheta", "ι": r"\iota", "κ": r"\kappa",
+    "λ": r"\lambda", "μ": r"\mu", "ν": r"\nu", "ξ": r"\xi", "π": r"\pi", "ρ": r"\rho", "σ": r"\sigma",
+    "τ": r"\tau", "υ": r"\upsilon", "φ": r"\varphi", "ϕ": r"\phi", "χ": r"\chi", "ψ": r"\psi", "ω": r"\omega",
+    "Γ": r"\Gamma", "Δ": r"\Delta", "Θ": r"\Theta", "Λ": r"\Lambda", "Ξ": r"\Xi", "Π": r"\Pi",
+    "Σ": r"\Sigma", "Φ": r"\Phi", "Ψ": r"\Psi", "Ω": r"\Omega",
+}
+_SUPERSCRIPTS = dict(zip("⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻⁼⁽⁾ⁿⁱ", "0123456789+-=()ni"))
+_SUBSCRIPTS = dict(zip("₀₁₂₃₄₅₆₇₈₉₊₋₌₍₎ₐₑₒₓᵢⱼₖₙ", "0123456789+-=()aeoxijkn"))
+_UNICODE_MATH = set(_SYMBOLS) | set(_SUPERSCRIPTS) | set(_SUBSCRIPTS)
+
+# Tên hàm / chữ Hy Lạp viết thiếu dấu "\" trong math mode (sin x -> \sin x, pi -> \pi)
+_FUNCTIONS = (
+    "arcsin", "arccos", "arctan", "sinh", "cosh", "tanh", "sin", "cos", "tan", "cot", "sec", "csc",
+    "log", "ln", "exp", "lim", "max", "min", "det", "dim", "ker", "gcd", "sup", "inf", "arg", "deg",
+)
+_GREEK_NAMES = (
+    "alpha", "beta", "gamma", "delta", "epsilon", "theta", "lambda", "sigma", "omega", "varphi", "phi", "pi", "mu",
+)
+_BARE_COMMAND_RE = re.compile(r"(?<![\\A-Za-z])(" + "|".join(_FUNCTIONS + _GREEK_NAMES) + r")(?![A-Za-z])")
+# Lệnh cấu trúc viết thiếu "\" mà chỉ Gemini sửa được (frac12, sqrt(x), int ...)
+_BARE_STRUCTURE_RE = re.compile(r"(?<![\\A-Za-z])(frac|sqrt|int|sum|prod)(?![A-Za-z])")
+
+# Token ASCII có thể là 1 phần biểu thức toán (chuỗi chữ cái dài chỉ được phép nếu là tên hàm / vi phân)
+_ASCII_MATH_TOKEN_RE = re.compile(r"[A-Za-z0-9().,+\-*/=<>^_|'\[\]!]+")
+_LETTER_RUN_RE = re.compile(r"[A-Za-z]{2,}")
+_MATH_TRIGGERS = set("=<>^_+*/") | _UNICODE_MATH
+_TRAILING_PUNCT = ".,;:!?"
+
+_COMMAND_RE = re.compile(r"\\[A-Za-z]+")
+# Kiểm tra biên của $...$: biểu thức bắt đầu / kết thúc bằng quan hệ, phép toán trơ trọi ("AB $= 3$")
+_RELATION_COMMANDS = r"\\(?:leq?|geq?|neq?|in|to|rightarrow|Rightarrow|leftrightarrow|approx|equiv|sim|cdot|times|pm)"
+_EDGE_OPERATOR_RE = re.compile(r"^\s*(?:[=<>+*/]|" + _RELATION_COMMANDS + r"(?![A-Za-z]))|(?:[=<>+\-*/]|"
+                               + _RELATION_COMMANDS + r")\s*$")
+_ASCII_ARROW_RE = re.compile(r"->|=>|<-|<=>")
+# Văn bản thường lọt vào $...$ ("$5 and $10"): bỏ nội dung \text{...} và các lệnh rồi tìm từ có chữ thường
+_TEXT_ARG_RE = re.compile(r"\\(?:text|mathrm|textbf|textit|operatorname|mbox)\s*\{[^{}]*\}")
+_PROSE_WORD_RE = re.compile(r"(?<![\\A-Za-z])(?=[A-Za-z]*[a-z])[A-Za-z]{3,}(?![A-Za-z])")
+_PROSE_SHORT_WORDS = {"is", "if", "or", "of", "to", "be", "an", "as", "at", "by", "on", "so", "we", "it"}
+# Tên biến viết hoa nằm ngay cạnh $...$ nhưng ở ngoài ("AB $= 3$", "$x =$ A")
+_IDENT_BEFORE_MATH_RE = re.compile(r"(?<![A-Za-z])[A-Z]{1,3}\s*$")
+_IDENT_AFTER_MATH_RE = re.compile(r"^\s*[A-Z]{1,3}(?![A-Za-z])")
+_ENV_RE = re.compile(r"\\(begin|end)\{([^}]*)\}")
+_DANGLING_SCRIPT_RE = re.compile(r"[\^_](?:\s*$|\s*[})\]]|[\^_])")
+
+
+def _split_math(text):
+    """
+    Tách văn bản thành các đoạn [is_math, delimiter, content]. Đoạn math cuối cùng chưa đóng
+    (thiếu "$") có thêm phần tử thứ 4 = False.
+    """
+    segments = []
+    buf = []
+    i, n = 0, len(text)
+    while i < n:
+        ch = text[i]
+        if ch == "\\" and i + 1 < n:
+            buf.append(text[i:i + 2])
+            i += 2
+            continue
+        if ch != "$":
+            buf.append(ch)
+            i += 1
+            continue
+        delim = "$$" if text.startswith("$$", i) else "$"
+        if buf:
+            segments.append([False, "", "".join(buf)])
+            buf = []
+        j = i + len(delim)
+        while j < n:
+            if text[j] == "\\":
+                j += 2
+                continue
+            if text.startswith(delim, j) and (delim == "$$" or not text.startswith("$$", j)):
+                break
+            j += 1
+        if j >= n:
+            segments.append([True, delim, text[i + len(delim):], False])
+            return segments
+        segments.append([True, delim, text[i + len(delim):j]])
+        i = j + len(delim)
+    if buf:
+        segments.append([False, "", "".join(buf)])
+    return segments
+
+
+def _join(segments):
+    return "".join(seg[1] + seg[2] + seg[1] if seg[0] else seg[2] for seg in segments)
+
+
+def _to_latex(math):
+    """Ký hiệu Unicode, chỉ số trên/dưới Unicode -> LaTeX (trong math mode)."""
+    out = []
+    i, n = 0, len(math)
+    while i < n:
+        ch = math[i]
+        if ch in _SUPERSCRIPTS or ch in _SUBSCRIPTS:
+            table, marker = (_SUPERSCRIPTS, "^") if ch in _SUPERSCRIPTS else (_SUBSCRIPTS, "_")
+            j = i
+            while j < n and math[j] in table:
+                j += 1
+            script = "".join(table[c] for c in math[i:j])
+            out.append(f"{marker}{{{script}}}" if len(script) > 1 else marker + script)
+            i = j
+            continue
+        command = _SYMBOLS.get(ch)
+        if command is None:
+            out.append(ch)
+        else:
+            out.append(command)
+            # \alpha x, không phải \alphax
+            if command[-1].isalpha() and i + 1 < n and math[i + 1] not in _UNICODE_MATH \
+                    and (math[i + 1].isalnum() or math[i + 1] == "\\"):
+                out.append(" ")
+        i += 1
+    return "".join(out)
+
+
+def _repair_math(math):
+    math = _to_latex(math)
+    math = _BARE_COMMAND_RE.sub(r"\\\1", math)
+    # Chỉ số bị tách bởi khoảng trắng (x^ 2), nhiều chữ số không có ngoặc (x^10), ngoặc rỗng (x^{})
+    math = re.sub(r"([\^_])\s+(?=[^\s$])", r"\1", math)
+    math = re.sub(r"([\^_])(\d{2,})", r"\1{\2}", math)
+    math = re.sub(r"([\^_])\(([^()]*)\)", r"\1{\2}", math)  # e^(2x) -> e^{2x}
+    math = re.sub(r"[\^_]\{\s*\}", "", math)
+    return _balance_braces(math)
+
+
+def _balance_braces(math):
+    """Bỏ "}" thừa, đóng các "{" còn mở ở cuối (bỏ qua \\{ và \\})."""
+    out = []
+    depth = 0
+    i = 0
+    while i < len(math):
+        ch = math[i]
+        if ch == "\\" and i + 1 < len(math):
+            out.append(math[i:i + 2])
+            i += 2
+            continue
+        if ch == "{":
+            depth += 1
+        elif ch == "}":
+            if depth == 0:
+                i += 1
+                continue
+            depth -= 1
+        out.append(ch)
+        i += 1
+    return "".join(out) + "}" * depth
+
+
+def _is_math_token(core):
+    if any(c in _UNICODE_MATH for c in core):
+        return True
+    if not _ASCII_MATH_TOKEN_RE.fullmatch(core):
+        return False
+    return all(
+        run in _FUNCTIONS or run in _GREEK_NAMES or (len(run) == 2 and run[0] == "d")
+        for run in _LETTER_RUN_RE.findall(core)
+    )
+
+
+def _open_brackets(text):
+    return text.count("(") + text.count("[") - text.count(")") - text.count("]")
+
+
+def _wrap_math_runs(text):
+    """Trong đoạn văn bản thường: bọc các chuỗi token liên tiếp trông như biểu thức toán vào $...$."""
+    out = []
+    run = []  # token toán (và khoảng trắng giữa chúng) của chuỗi đang xét
+
+    def flush():
+        trailing = []
+        while run and run[-1].isspace():
+            trailing.insert(0, run.pop())
+        body = "".join(run)
+        if any(c.isalnum() for c in body) and any(c in _MATH_TRIGGERS for c in body):
+            out.append("$" + _repair_math(body) + "$")
+        else:
+            out.append(body)
+        out.extend(trailing)
+        run.clear()
+
+    for token in re.split(r"(\s+)", text):
+        if not token:
+            continue
+        if token.isspace():
+            (run if run else out).append(token)
+            continue
+        core = token.rstrip(_TRAILING_PUNCT)
+        if (run or core) and (not core or _is_math_token(core)) and _open_brackets("".join(run) + core) > 0:
+            # Dấu phẩy / chấm phẩy bên trong (1, 2, 3) hoặc [1 2; 3 4] thuộc về biểu thức
+            run.append(token)
+            continue
+        if core and _is_math_token(core):
+            run.append(core)
+            if core != token:
+                # Dấu câu kết thúc biểu thức, nằm ngoài $...$
+                flush()
+                out.append(token[len(core):])
+            continue
+        flush()
+        out.append(token)
+    flush()
+    return "".join(out)
+
+
+def normalize_latex(text):
+    """
+    Chuẩn hóa tất định 1 đoạn văn bản toán bóc từ PDF/HTML:
+    NFC + bỏ ký tự rác, ký hiệu Unicode -> lệnh LaTeX, sửa chỉ số trên/dưới bị vỡ, thêm "\\" cho
+    tên hàm (sin, log, ...), cân lại ngoặc nhọn và dấu "$" thiếu, bọc biểu thức ở ngoài math mode vào $...$.
+    """
+    if not text:
+        return text
+    text = unicodedata.normalize("NFC", str(text)).translate(_ARTIFACTS)
+    text = re.sub(r"[ \t]+", " ", text).strip()
+
+    segments = _split_math(text)
+    if segments and segments[-1][0] and len(segments[-1]) == 4:
+        # "$" mở nhưng không đóng: đóng ở cuối (trước dấu câu) nếu phần sau là biểu thức,
+        # ngược lại coi là ký tự "$" thường
+        delim, content = segments[-1][1], segments[-1][2].rstrip()
+        core = content.rstrip(_TRAILING_PUNCT)
+        tokens = core.split()
+        if tokens and (_COMMAND_RE.search(core) or any(c in _MATH_TRIGGERS for c in core)
+                       or all(_is_math_token(t) for t in tokens)):
+            segments[-1] = [True, delim, core]
+            if content[len(core):]:
+                segments.append([False, "", content[len(core):]])
+        else:
+            segments[-1] = [False, "", "\\$" * len(delim) + content]
+
+    for seg in segments:
+        if seg[0]:
+            seg[2] = _repair_math(seg[2])
+        else:
+            seg[2] = _wrap_math_runs(seg[2])
+    return _join(segments)
+
+
+def latex_problems(text):
+    """Danh sách lỗi còn lại sau khi chuẩn hóa (rỗng = hợp lệ, không cần gọi Gemini)."""
+    problems = []
+    segments = _split_math(text or "")
+    if segments and segments[-1][0] and len(segments[-1]) == 4:
+        problems.append("unbalanced $")
+
+    for index, seg in enumerate(segments):
+        content = seg[2]
+        if not seg[0]:
+            before = segments[index - 1] if index > 0 else None
+            after = segments[index + 1] if index + 1 < len(segments) else None
+            if (after is not None and after[0] and _IDENT_BEFORE_MATH_RE.search(content)) or \
+                    (before is not None and before[0] and _IDENT_AFTER_MATH_RE.search(content)):
+                problems.append("identifier outside $")
+            if any(c in _UNICODE_MATH for c in content):
+                problems.append("unicode math outside $")
+            if re.search(r"[\^_{}]", content) or _COMMAND_RE.search(content):
+                problems.append("latex outside $")
+            if re.search(r"(?<![\\A-Za-z])(frac|sqrt)(?![A-Za-z])", content):
+                problems.append("bare structure command")
+            continue
+
+        if not content.strip():
+            problems.append("empty math")
+            continue
+        if any(c in _UNICODE_MATH for c in content):
+            problems.append("unicode math")
+        if _EDGE_OPERATOR_RE.search(content):
+            problems.append("operator at math boundary")
+        if _ASCII_ARROW_RE.search(content):
+            problems.append("ascii arrow")
+        plain = _COMMAND_RE.sub(" ", _TEXT_ARG_RE.sub(" ", content))
+        words = _PROSE_WORD_RE.findall(plain)
+        words += [w for w in re.findall(r"(?<![A-Za-z])[a-z]{2}(?![A-Za-z])", plain) if w in _PROSE_SHORT_WORDS]
+        if any(w.lower() not in _FUNCTIONS and w.lower() not in _GREEK_NAMES for w in words):
+            problems.append("prose inside $")
+        if _balance_braces(content) != content:
+            problems.append("unbalanced braces")
+        if _DANGLING_SCRIPT_RE.search(content):
+            problems.append("dangling script")
+        if _BARE_STRUCTURE_RE.search(content):
+            problems.append("bare structure command")
+        if re.search(r"\[[^\]]*;[^\]]*\]", content):
+            problems.append("matrix notation")
+        if content.count(r"\left") != content.count(r"\right"):
+            problems.append("unbalanced \\left/\\right")
+        stack = []
+        for kind, env in _ENV_RE.findall(content):
+            if kind == "begin":
+                stack.append(env)
+            elif not stack or stack.pop() != env:
+                problems.append("mismatched environment")
+                break
+        else:
+            if stack:
+                problems.append("unclosed environment")
+        if "$" in content:
+            problems.append("nested $")
+
+    return problems
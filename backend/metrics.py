@@ -0,0 +1,166 @@
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# Bucket (giây) cho histogram thời gian của từng stage
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Histogram không tính bằng giây dùng bucket riêng
+_BUCKETS_BY_NAME = {
+    "verify_context_tokens": (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000),
+}
+
+_HELP = {
+    "stage_duration_seconds": ("histogram", "Thời gian chạy của từng stage (plan, search_query, fetch, parse, extract, verify, latex_refine)"),
+    "cache_events_total": ("counter", "Sự kiện của các cache trên đĩa (hits, misses, evictions, ...)"),
+    "gemini_calls_total": ("counter", "Số lời gọi Gemini theo ngân sách"),
+    "gemini_rate_limited_total": ("counter", "Số lần Gemini trả về 429"),
+    "gemini_retries_total": ("counter", "Số lần gọi lại Gemini sau 429"),
+    "llm_tokens_total": ("counter", "Token LLM (prompt / output) theo usage_metadata, hoặc ước lượng nếu không có"),
+    "search_api_calls_total": ("counter", "Số lời gọi Google Custom Search API"),
+    "search_retries_total": ("counter", "Số lần gọi lại Custom Search sau lỗi tạm thời"),
+    "fetch_bytes_total": ("counter", "Tổng số byte tải về khi fetch tài liệu"),
+    "fetch_rejected_total": ("counter", "Số response bị bỏ giữa chừng (content_type: không phải HTML/PDF, too_large)"),
+    "latex_refine_total": ("counter", "Số sample đã chuẩn hóa LaTeX theo nguồn (local, cache, llm)"),
+    "verify_context_tokens": ("histogram", "Token (ước lượng) của context gửi Gemini cho mỗi tài liệu"),
+}
+
+
+class StageTimings:
+    """Thời gian theo stage của 1 request (cộng dồn từ mọi thread làm việc cho request đó)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"count": 0, "total": 0.0, "max": 0.0})
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+
+    def snapshot(self):
+        """{stage: {"count", "total_ms", "max_ms"}}. Stage lồng nhau (VD: verify gồm latex_refine) được tính riêng."""
+        with self._lock:
+            return {
+                stage: {
+                    "count": e["count"],
+                    "total_ms": round(e["total"] * 1000, 1),
+                    "max_ms": round(e["max"] * 1000, 1),
+                }
+                for stage, e in self._stages.items()
+            }
+
+
+class _Histogram:
+    def __init__(self, bounds=_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.buckets[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in items) + "}"
+
+
+class MetricsRegistry:
+    """
+    Counter + histogram trong bộ nhớ, xuất theo định dạng text của Prometheus (/metrics).
+    span() đo thời gian 1 stage: ghi vào histogram chung và vào StageTimings của request
+    đang chạy trên thread hiện tại (gắn bằng collect()).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._local = threading.local()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram(_BUCKETS_BY_NAME.get(name, _BUCKETS))
+            hist.observe(value)
+
+    @contextmanager
+    def collect(self, timings):
+        """Gắn StageTimings của request cho các span chạy trong thread hiện tại."""
+        previous = getattr(self._local, "timings", None)
+        self._local.timings = timings
+        try:
+            yield timings
+        finally:
+            self._local.timings = previous
+
+    def current_timings(self):
+        return getattr(self._local, "timings", None)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe("stage_duration_seconds", elapsed, stage=stage)
+            timings = self.current_timings()
+            if timings is not None:
+                timings.add(stage, elapsed)
+
+    def timed(self, stage):
+        """Decorator: bọc cả hàm trong span(stage)."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self):
+        """Toàn bộ metric theo Prometheus text exposition format 0.0.4."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: (h.bounds, list(h.buckets), h.sum, h.count) for k, h in self._histograms.items()}
+
+        lines = []
+        names = sorted({name for name, _ in counters} | {name for name, _ in histograms})
+        for name in names:
+            kind, help_text = _HELP.get(name, ("counter" if name in {n for n, _ in counters} else "histogram", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            for (n, labels), (bounds, buckets, total, count) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, bucket_count in zip(bounds, buckets):
+                    lines.append(f"{name}_bucket{_labels(labels, ('le', bound))} {bucket_count}")
+                lines.append(f"{name}_bucket{_labels(labels, ('le', '+Inf'))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import hashlib
+import threading
+
+from backend.disk_cache import DiskCache
+
+# SimHash 64 bit, chia 4 band 16 bit: 2 tài liệu lệch <= 3 bit chắc chắn trùng ít nhất 1 band
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", 3))
+NEAR_DUP_TTL = int(os.getenv("NEAR_DUP_TTL_SECONDS", 3 * 24 * 3600))
+NEAR_DUP_MAX_ENTRIES = int(os.getenv("NEAR_DUP_MAX_ENTRIES", 80000))
+# Số tài liệu tối đa giữ trong mỗi khóa band (giữ các tài liệu mới nhất)
+NEAR_DUP_BAND_MAX_MEMBERS = int(os.getenv("NEAR_DUP_BAND_MAX_MEMBERS", 32))
+
+_BITS = 64
+_BANDS = 4
+_BAND_BITS = _BITS // _BANDS
+_SHINGLE = 3
+_MIN_TOKENS = 30
+_MAX_TOKENS = 20000
+_WORD_RE = re.compile(r"\w+")
+
+
+def simhash(pages_data):
+    """
+    SimHash 64 bit trên tập shingle 3 từ của toàn bộ text (chữ thường, bỏ dấu câu / khoảng trắng
+    để bản HTML và bản PDF của cùng 1 đề cho fingerprint gần nhau).
+    Trả về None nếu tài liệu quá ngắn để so sánh tin cậy.
+    """
+    tokens = []
+    for page in pages_data:
+        tokens += _WORD_RE.findall(str(page.get("text", "")).lower())
+        if len(tokens) >= _MAX_TOKENS:
+            break
+    tokens = tokens[:_MAX_TOKENS]
+    if len(tokens) < _MIN_TOKENS:
+        return None
+
+    shingles = {" ".join(tokens[i:i + _SHINGLE]) for i in range(len(tokens) - _SHINGLE + 1)}
+
+    # Cộng dồn từng bit của mọi hash bằng bộ đếm bit-slice: planes[j] giữ bit thứ j
+    # của số lần bit đó bằng 1 (cộng kiểu ripple-carry, ~log2(n) phép toán / shingle)
+    planes = []
+    for shingle in shingles:
+        carry = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for j in range(len(planes)):
+            if not carry:
+                break
+            planes[j], carry = planes[j] ^ carry, planes[j] & carry
+        if carry:
+            planes.append(carry)
+
+    half = len(shingles) / 2
+    fingerprint = 0
+    for bit in range(_BITS):
+        count = sum(((plane >> bit) & 1) << j for j, plane in enumerate(planes))
+        if count > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(fingerprint):
+    mask = (1 << _BAND_BITS) - 1
+    return [(fingerprint >> (i * _BAND_BITS)) & mask for i in range(_BANDS)]
+
+
+class NearDuplicateStore:
+    """
+    Lưu verdict theo fingerprint (SimHash) để tài liệu gần trùng (bản mirror, bản HTML/PDF
+    của cùng 1 đề) dùng lại verdict thay vì gọi Gemini lần nữa.
+    Tra cứu theo band: mỗi band là 1 khóa trong DiskCache, value là list [fingerprint, url, verdict, added_at]
+    (tối đa max_members tài liệu mới nhất; tài liệu quá NEAR_DUP_TTL bị bỏ dù khóa band vẫn được ghi lại).
+    scope: chuỗi gồm topic / độ khó / version prompt (verdict chỉ dùng lại trong cùng scope).
+    """
+
+    def __init__(self, max_distance=NEAR_DUP_MAX_DISTANCE, max_members=NEAR_DUP_BAND_MAX_MEMBERS):
+        self.max_distance = max_distance
+        self.max_members = max_members
+        self.cache = DiskCache("near_dups", ttl=NEAR_DUP_TTL, max_entries=NEAR_DUP_MAX_ENTRIES)
+        self._lock = threading.Lock()
+
+    def _key(self, scope, band_index, band_value):
+        return f"{scope}|{band_index}|{band_value}"
+
+    @staticmethod
+    def _is_stale(member, now):
+        # Mục cũ (chưa có added_at) coi như đã hết hạn
+        return len(member) < 4 or now - member[3] > NEAR_DUP_TTL
+
+    def lookup(self, scope, fingerprint):
+        """Trả về (url, verdict) của tài liệu gần trùng gần nhất, None nếu không có."""
+        if fingerprint is None:
+            return None
+        best = None
+        now = time.time()
+        for i, band in enumerate(_bands(fingerprint)):
+            entry = self.cache.peek(self._key(scope, i, band))
+            if not self.cache.is_fresh(entry):
+                continue
+            for member in entry[0]:
+                if self._is_stale(member, now):
+                    continue
+                fp, url, verdict = member[:3]
+                distance = hamming(fp, fingerprint)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, url, verdict)
+        if best is None:
+            self.cache.record("misses")
+            return None
+        self.cache.record("hits")
+        return best[1], best[2]
+
+    def add(self, scope, fingerprint, url, verdict):
+        if fingerprint is None or verdict is None:
+            return
+        now = time.time()
+        with self._lock:
+            for i, band in enumerate(_bands(fingerprint)):
+                key = self._key(scope, i, band)
+                entry = self.cache.peek(key)
+                members = entry[0] if self.cache.is_fresh(entry) else []
+                members = [m for m in members if m[0] != fingerprint and not self._is_stale(m, now)]
+                members = members[-(self.max_members - 1):] if self.max_members > 1 else []
+                members.append([fingerprint, url, verdict, now])
+                self.cache.set(key, members)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,279 @@
+import io
+import os
+import atexit
+import threading
+import multiprocessing
+
+try:
+    import resource
+    import signal
+except ImportError:  # Windows: không giới hạn CPU time trong worker
+    resource = None
+
+# Cấu hình process pool bóc text PDF/HTML
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", os.cpu_count() or 2))
+PARSE_CPU_SECONDS = int(os.getenv("PARSE_CPU_SECONDS", 20))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT_SECONDS", 30))
+PARSER_MAX_TASKS_PER_CHILD = int(os.getenv("PARSER_MAX_TASKS_PER_CHILD", 50))
+
+
+# Thuộc tính trang được kế thừa từ node /Pages cha
+_INHERITABLE_PAGE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class ParseTimeout(BaseException):
+    """Vượt CPU time của 1 tài liệu. Kế thừa BaseException để các `except Exception` bên trong pypdf/bs4 không nuốt mất."""
+
+
+def _open_source(content):
+    """File đọc được của nội dung thô: bytes, đường dẫn file tạm (body lớn) hoặc RangeSource."""
+    if isinstance(content, bytes):
+        return io.BytesIO(content)
+    if isinstance(content, str):
+        return open(content, "rb")
+    return content.open()
+
+
+def _first_pdf_pages(reader, limit):
+    """
+    `limit` trang đầu của PDF: duyệt cây /Pages theo thứ tự và dừng sớm. reader.pages đọc mọi page object
+    (rải khắp file) để dựng danh sách trang, tức là đọc gần hết file khi file được tải dần bằng Range.
+    """
+    from pypdf import PageObject
+    from pypdf.generic import IndirectObject, NameObject
+
+    pages, seen = [], set()
+    stack = [(reader.trailer["/Root"].get_object().raw_get("/Pages"), {})]
+    while stack and len(pages) < limit:
+        ref, inherited = stack.pop()
+        if isinstance(ref, IndirectObject):
+            if ref.idnum in seen:
+                continue
+            seen.add(ref.idnum)
+        node = ref.get_object()
+        if "/Kids" in node:
+            inherited = dict(inherited, **{k: node[k] for k in _INHERITABLE_PAGE_KEYS if k in node})
+            stack.extend((kid, inherited) for kid in reversed(node.raw_get("/Kids").get_object()))
+            continue
+        page = PageObject(reader, ref if isinstance(ref, IndirectObject) else None)
+        page.update(node)
+        for key, value in inherited.items():
+            if key not in page:
+                page[NameObject(key)] = value
+        pages.append(page)
+    return pages
+
+
+def parse_document(content, content_type, final_url):
+    """
+    Bóc text từ nội dung thô (PDF hoặc HTML). Trả về (pages_data, doc_type).
+    content: bytes, đường dẫn file (PDF được đọc dần từ file, không nạp cả vào RAM) hoặc RangeSource.
+    """
+    # bs4 / pypdf chỉ nạp khi parse (process chính không cần chúng lúc khởi động)
+    from bs4 import BeautifulSoup
+    from pypdf import PdfReader
+
+    final_url = final_url.lower()
+    pages_data = []
+
+    is_pdf = 'application/pdf' in content_type or final_url.endswith('.pdf')
+    if is_pdf:
+        remote = not isinstance(content, (bytes, str))
+        # Chế độ thường (strict=False) kiểm tra header của mọi object khi mở file, tức là đọc cả file:
+        # file đọc bằng Range được mở strict trước, lỗi thì mới đọc lại ở chế độ thường (trong ngân sách Range)
+        for strict in ((True, False) if remote else (False,)):
+            try:
+                with _open_source(content) as f:
+                    reader = PdfReader(f, strict=strict)
+                    pages = _first_pdf_pages(reader, 10)
+                    if len(pages) > 0:
+                        for i, page in enumerate(pages): 
+                            txt = page.extract_text()
+                            if txt:
+                                pages_data.append({"page": i + 1, "text": txt})
+                        return pages_data, "PDF"
+            except ParseTimeout:
+                raise
+            except:
+                pages_data = []
+
+    if not isinstance(content, (bytes, str)):
+        return [], None  # RangeSource chỉ dùng cho PDF
+    if isinstance(content, str):
+        with open(content, "rb") as f:
+            content = f.read()
+    soup = BeautifulSoup(content, 'html.parser')
+    for tag in soup(["script", "style", "nav", "footer", "header", "iframe", "noscript"]):
+        tag.decompose()
+    text = soup.get_text(separator=' ', strip=True)
+    
+    if len(text) > 200: 
+        pages_data.append({"page": "Web", "text": text[:30000]})
+        return pages_data, "WEB"
+    
+    return [], None
+
+
+def _on_cpu_limit(signum, frame):
+    raise ParseTimeout()
+
+
+def _worker_init():
+    import bs4, pypdf  # noqa: F401 - nạp sẵn khi worker khởi động, không tính vào CPU time của tài liệu đầu tiên
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+
+def _parse_in_worker(content, content_type, final_url, cpu_seconds):
+    """Chạy trong worker process: giới hạn CPU time cho riêng tài liệu này (RLIMIT_CPU, soft limit)."""
+    if resource is None:
+        return parse_document(content, content_type, final_url)
+
+    # Khôi phục đúng soft limit cũ (process không có quyền không thể đặt soft > hard, VD: RLIM_INFINITY)
+    old_soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime) + 1
+    soft = used + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        return parse_document(content, content_type, final_url)
+    except ParseTimeout:
+        print(f"[PARSE] CPU limit ({cpu_seconds}s) exceeded: {final_url}")
+        return [], None
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (old_soft, hard))
+
+
+def _worker_main(conn):
+    """Vòng lặp của 1 worker process: nhận (content, content_type, final_url, cpu_seconds), trả về kết quả parse."""
+    _worker_init()
+    while True:
+        try:
+            args = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = _parse_in_worker(*args)
+        except Exception as e:
+            print(f"[PARSE] Worker error: {e}")
+            result = ([], None)
+        conn.send(result)
+
+
+class _Worker:
+    """1 process parse riêng, nói chuyện qua Pipe; chỉ 1 thread dùng worker tại 1 thời điểm."""
+
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child,), daemon=True, name="parser")
+        self.process.start()
+        child.close()
+        self.tasks = 0
+
+    def run(self, args, timeout):
+        """Raise TimeoutError nếu worker chưa trả kết quả sau `timeout` giây (tính từ lúc worker nhận tài liệu)."""
+        self.tasks += 1
+        self.conn.send(args)
+        if not self.conn.poll(timeout):
+            raise TimeoutError()
+        return self.conn.recv()
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except Exception:
+            pass
+        self.conn.close()
+        self.process.join(timeout=1)
+
+    def retire(self):
+        # Đóng pipe -> worker thoát khỏi vòng lặp; join trong thread riêng để không chặn người gọi
+        self.conn.close()
+        threading.Thread(target=self.process.join, daemon=True).start()
+
+
+class ParserPool:
+    """
+    Các process bóc text PDF/HTML ngoài GIL của Flask worker.
+    - Mỗi tài liệu bị giới hạn CPU time (trong worker) và thời gian chạy (phía gọi). Thời gian chạy chỉ
+      tính từ lúc 1 worker nhận tài liệu, không tính thời gian xếp hàng chờ worker rảnh.
+    - Tài liệu quá giờ / worker chết: chỉ worker đó bị kill và thay mới, tài liệu của request khác không bị ảnh hưởng.
+    - Worker được thay mới sau max_tasks_per_child tài liệu.
+    """
+
+    def __init__(self, processes=PARSER_PROCESSES, cpu_seconds=PARSE_CPU_SECONDS, timeout=PARSE_TIMEOUT,
+                 max_tasks_per_child=PARSER_MAX_TASKS_PER_CHILD):
+        self.processes = processes
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.max_tasks_per_child = max_tasks_per_child
+        self._ctx = multiprocessing.get_context()
+        self._cond = threading.Condition()
+        self._idle = []       # worker rảnh
+        self._workers = 0     # tổng số worker đang sống (rảnh + bận)
+        self._closed = False
+        atexit.register(self.shutdown)
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._workers >= self.processes and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("parser pool is shut down")
+            if self._idle:
+                return self._idle.pop()
+            self._workers += 1
+        try:
+            return _Worker(self._ctx)
+        except BaseException:
+            self._discard(None)
+            raise
+
+    def _release(self, worker):
+        if self.max_tasks_per_child and worker.tasks >= self.max_tasks_per_child:
+            worker.retire()
+            self._discard(None)
+            return
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                self._idle.append(worker)
+                self._cond.notify()
+        if closed:
+            self._discard(worker)
+
+    def _discard(self, worker):
+        if worker is not None:
+            worker.kill()
+        with self._cond:
+            self._workers -= 1
+            self._cond.notify()
+
+    def parse(self, content, content_type, final_url):
+        worker = self._acquire()
+        try:
+            result = worker.run((content, content_type, final_url, self.cpu_seconds), self.timeout)
+        except TimeoutError:
+            print(f"[PARSE] Timeout after {self.timeout}s, replacing parser worker: {final_url}")
+            self._discard(worker)
+        except (EOFError, OSError, BrokenPipeError):
+            print(f"[PARSE] Parser worker crashed, replacing: {final_url}")
+            self._discard(worker)
+        except BaseException:
+            self._discard(worker)  # Trạng thái pipe không xác định -> không dùng lại worker
+            raise
+        else:
+            self._release(worker)
+            return result
+        return [], None
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._workers -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.kill()
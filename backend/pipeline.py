@@ -0,0 +1,315 @@
+import os
+import time
+import queue
+import threading
+
+from backend.metrics import metrics
+from backend.rate_limiter import gemini_scheduler
+from backend.ranker import LexicalScorer, LexicalGate, LEXICAL_TOP_K
+
+# Số worker mặc định cho từng stage (có thể chỉnh qua .env)
+FETCH_WORKERS = int(os.getenv("PIPELINE_FETCH_WORKERS", 8))
+PARSE_WORKERS = int(os.getenv("PIPELINE_PARSE_WORKERS", os.cpu_count() or 2))
+VERIFY_WORKERS = int(os.getenv("PIPELINE_VERIFY_WORKERS", 4))
+QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 16))
+# Stage verify gom tối đa VERIFY_BATCH_SIZE tài liệu, chờ thêm tối đa VERIFY_LINGER giây
+VERIFY_BATCH_SIZE = int(os.getenv("VERIFY_BATCH_SIZE", 4))
+VERIFY_LINGER = float(os.getenv("PIPELINE_VERIFY_LINGER", 0.5))
+GATE_WORKERS = int(os.getenv("PIPELINE_GATE_WORKERS", 2))
+
+_DONE = object()
+# Stage trả về _HELD: item được giữ lại, sẽ trả ra (hoặc bỏ) qua drain() khi stage kết thúc
+_HELD = object()
+
+
+class _Resolved:
+    """Kết quả cuối có sẵn ở giữa pipeline (VD: dùng lại verdict), không cần đi qua các stage sau."""
+
+    def __init__(self, result):
+        self.result = result
+
+
+class _StopSignal:
+    """
+    Cờ dừng của 1 lượt chạy pipeline: set() khi pipeline kết thúc / dừng sớm, hoặc cancel_event bên ngoài
+    (VD: Job.cancel_event) được set. Dùng được làm cancel_event của gemini_scheduler (chỉ cần is_set()).
+    """
+
+    def __init__(self, cancel_event=None):
+        self._event = threading.Event()
+        self._cancel_event = cancel_event
+
+    def set(self):
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set() or (self._cancel_event is not None and self._cancel_event.is_set())
+
+
+class _Stage:
+    def __init__(self, name, func, workers, in_q, batched=False, batch_size=1, linger=0.0, drain=None):
+        """
+        func nhận 1 item, hoặc (batched=True) nhận list tối đa batch_size item và trả về list kết quả.
+        drain (tùy chọn) được worker cuối cùng gọi, trả về (các item giữ lại cần đẩy tiếp, số item bị bỏ).
+        """
+        self.name = name
+        self.func = func
+        self.drain = drain
+        self.workers = workers
+        self.in_q = in_q
+        self.batched = batched
+        self.batch_size = batch_size if batched else 1
+        self.linger = linger
+        self.out_q = None
+        self.next = None
+        self.alive = workers
+        self.lock = threading.Lock()
+
+
+class SearchPipeline:
+    """
+    Pipeline search -> fetch -> parse -> gate -> verify chạy chồng lấp:
+    mỗi link được đẩy sang bước fetch ngay khi query của nó trả về.
+    Các stage nối với nhau bằng queue có giới hạn (backpressure), mỗi stage
+    có số worker riêng: fetch (network), parse (CPU), verify (Gemini).
+    Sau parse, tài liệu gần trùng (SimHash) với tài liệu đã thẩm định dùng lại verdict đó.
+    Stage gate chấm điểm lexical cục bộ và chỉ cho tối đa `max_verify` tài liệu tới Gemini.
+    Logic từng bước vẫn nằm trong SearchEngine / ContentProcessor.
+    """
+
+    def __init__(self, searchor, processor, fetch_workers=FETCH_WORKERS, parse_workers=PARSE_WORKERS,
+                 verify_workers=VERIFY_WORKERS, queue_size=QUEUE_SIZE, verify_batch_size=VERIFY_BATCH_SIZE):
+        self.searchor = searchor
+        self.processor = processor
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.verify_workers = verify_workers
+        self.queue_size = queue_size
+        self.verify_batch_size = verify_batch_size
+
+    # --- Các bước xử lý 1 tài liệu (dùng chung với AsyncSearchPipeline) ---
+
+    def _fetch(self, url):
+        raw = self.processor.download(url)
+        return (url, raw) if raw else None
+
+    def _parse(self, item, topic, difficulty):
+        url, raw = item
+        pages_data, doc_type = self.processor.parse_download(raw)
+        if not pages_data:
+            return None
+        # Gần trùng với tài liệu đã thẩm định -> dùng lại verdict, bỏ qua gate + Gemini
+        fingerprint = self.processor.fingerprint(pages_data)
+        found, result = self.processor.find_duplicate_result(url, pages_data, doc_type, fingerprint, topic, difficulty)
+        if found:
+            return _Resolved(result)
+        return (url, pages_data, doc_type, fingerprint)
+
+    def _make_gate(self, search_plan, max_verify):
+        return LexicalGate(
+            LexicalScorer.from_search_plan(search_plan, self.processor.signal_keywords),
+            top_k=max_verify,
+        )
+
+    def _verify(self, items, topic, difficulty):
+        # Nhiều tài liệu -> 1 prompt (ContentProcessor tự fallback về gọi đơn lẻ khi cần)
+        return self.processor.evaluate_documents(
+            [item[:3] for item in items], topic, difficulty,
+            fingerprints=[item[3] for item in items],
+        )
+
+    def run(self, search_plan, topic, difficulty, max_queries=3, results_per_query=3, search_stats=None,
+            client_id=None, stop_after=None, min_score=8, deadline=None, max_verify=LEXICAL_TOP_K, timings=None,
+            cancel_event=None):
+        """
+        client_id (VD: chat_id) dùng để chia lượt gọi Gemini công bằng giữa các chat.
+        cancel_event (threading.Event, tùy chọn): khi được set (VD: job bị hủy), các worker bỏ phần việc
+        còn lại và lời gọi Gemini đang xếp hàng bị hủy.
+        Mục tiêu dừng sớm (tùy chọn): đủ `stop_after` tài liệu có score >= `min_score`,
+        hoặc hết `deadline` giây. Khi đạt, các lượt fetch / gọi Gemini còn chờ bị hủy.
+        max_verify: số tài liệu tối đa được gửi Gemini thẩm định (None = không giới hạn,
+        chỉ bỏ các tài liệu hoàn toàn không nhắc tới chủ đề).
+        timings (StageTimings, tùy chọn): thu thời gian từng stage của request này.
+
+        Generator, yield các sự kiện:
+        - {"type": "search_done", "total": n}: đã chạy xong mọi query, tìm được n link duy nhất
+        - {"type": "match", "data": {...}}: ngay khi 1 tài liệu được thẩm định đạt
+        - {"type": "progress_update", "current", "total", "found"}: mỗi khi 1 link xử lý xong
+        - {"type": "early_stop", "reason": "target" | "deadline"}: dừng trước khi xử lý hết
+        - {"type": "gate_summary", "sent", "skipped"}: số tài liệu đã gửi / bỏ qua không gọi Gemini
+        - {"type": "final_result", "data": [...]}: kết quả cuối, sắp xếp theo score
+        """
+        events = queue.Queue()
+        stop = _StopSignal(cancel_event)
+        deadline_at = time.monotonic() + deadline if deadline else None
+
+        fetch = self._fetch
+        parse = lambda item: self._parse(item, topic, difficulty)
+        gate = self._make_gate(search_plan, max_verify)
+
+        def rank(item):
+            decision = gate.offer(item, item[1])
+            if decision == LexicalGate.ADMIT:
+                return item
+            if decision == LexicalGate.HOLD:
+                return _HELD
+            return None
+
+        verify = lambda items: self._verify(items, topic, difficulty)
+
+        stages = [
+            _Stage("fetch", fetch, self.fetch_workers, queue.Queue(self.queue_size)),
+            _Stage("parse", parse, self.parse_workers, queue.Queue(self.queue_size)),
+            _Stage("gate", rank, GATE_WORKERS, queue.Queue(self.queue_size), drain=gate.drain),
+            _Stage("verify", verify, self.verify_workers, queue.Queue(self.queue_size),
+                   batched=True, batch_size=self.verify_batch_size, linger=VERIFY_LINGER),
+        ]
+        for current, nxt in zip(stages, stages[1:]):
+            current.next = nxt
+            current.out_q = nxt.in_q
+
+        def search_worker():
+            with metrics.collect(timings):
+                search_loop()
+
+        def search_loop():
+            count = 0
+            try:
+                for url in self.searchor.iter_search_plan(
+                    search_plan, max_queries=max_queries, results_per_query=results_per_query,
+                    stats=search_stats
+                ):
+                    if stop.is_set():
+                        break
+                    count += 1
+                    events.put(("found", url))
+                    stages[0].in_q.put(url)
+            except Exception as e:
+                print(f"[PIPELINE ERROR] search stage: {e}")
+            finally:
+                events.put(("search_done", count))
+                for _ in range(stages[0].workers):
+                    stages[0].in_q.put(_DONE)
+
+        def stage_worker(stage):
+            with gemini_scheduler.client(client_id, cancel_event=stop), metrics.collect(timings):
+                stage_loop(stage)
+
+        def stage_loop(stage):
+            finished = False
+            while not finished:
+                item = stage.in_q.get()
+                if item is _DONE:
+                    break
+                items = [item]
+
+                # Stage batch: gom thêm item đang chờ (tối đa `linger` giây)
+                deadline = time.monotonic() + stage.linger
+                while len(items) < stage.batch_size:
+                    try:
+                        nxt = stage.in_q.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if nxt is _DONE:
+                        finished = True
+                        break
+                    items.append(nxt)
+
+                outs = [None] * len(items)
+                if not stop.is_set():
+                    try:
+                        if stage.batched:
+                            outs = stage.func(items)
+                        else:
+                            outs = [stage.func(items[0])]
+                    except Exception as e:
+                        print(f"[PIPELINE ERROR] {stage.name} stage: {e}")
+
+                for out in outs:
+                    if out is _HELD:
+                        continue
+                    if isinstance(out, _Resolved):
+                        events.put(("done", out.result))
+                        continue
+                    if out is None or stage.next is None:
+                        events.put(("done", out))
+                    else:
+                        stage.out_q.put(out)
+
+            # Worker cuối cùng của stage báo kết thúc cho stage sau
+            with stage.lock:
+                stage.alive -= 1
+                last = stage.alive == 0
+            if last:
+                if stage.drain is not None:
+                    released, dropped = stage.drain()
+                    for out in released:
+                        stage.out_q.put(out)
+                    for _ in range(dropped):
+                        events.put(("done", None))
+                if stage.next is None:
+                    events.put(("finished", None))
+                else:
+                    for _ in range(stage.next.workers):
+                        stage.out_q.put(_DONE)
+
+        threads = [threading.Thread(target=search_worker, daemon=True)]
+        for stage in stages:
+            threads += [threading.Thread(target=stage_worker, args=(stage,), daemon=True) for _ in range(stage.workers)]
+        for t in threads:
+            t.start()
+
+        print(f"[INFO] Pipeline started (fetch={self.fetch_workers}, parse={self.parse_workers}, verify={self.verify_workers})")
+
+        results = []
+        total_links = 0
+        completed_count = 0
+        strong_matches = 0
+        try:
+            while True:
+                if deadline_at is None:
+                    kind, payload = events.get()
+                else:
+                    try:
+                        kind, payload = events.get(timeout=max(0.0, deadline_at - time.monotonic()))
+                    except queue.Empty:
+                        print(f"[INFO] Pipeline deadline ({deadline}s) reached, cancelling pending work.")
+                        yield {"type": "early_stop", "reason": "deadline"}
+                        break
+
+                if kind == "found":
+                    total_links += 1
+                elif kind == "search_done":
+                    yield {"type": "search_done", "total": payload}
+                elif kind == "done":
+                    completed_count += 1
+                    if payload:
+                        print(f"[MATCH] Score: {payload['score']} | {payload['type']} | {payload['url']}")
+                        results.append(payload)
+                        yield {"type": "match", "data": payload}
+                        if payload['score'] >= min_score:
+                            strong_matches += 1
+                    yield {
+                        "type": "progress_update",
+                        "current": completed_count,
+                        "total": total_links,
+                        "found": len(results)
+                    }
+                    if stop_after and strong_matches >= stop_after:
+                        print(f"[INFO] Found {strong_matches} documents with score >= {min_score}, cancelling pending work.")
+                        yield {"type": "early_stop", "reason": "target"}
+                        break
+                elif kind == "finished":
+                    break
+        finally:
+            # Dừng sớm hoặc client ngắt kết nối -> các worker bỏ qua phần việc còn lại
+            stop.set()
+
+        print(f"[INFO] Lexical gate: {gate.admitted} sent to Gemini, {gate.rejected} skipped")
+        yield {"type": "gate_summary", "sent": gate.admitted, "skipped": gate.rejected}
+
+        results.sort(key=lambda x: x['score'], reverse=True)
+        yield {
+            "type": "final_result",
+            "data": results
+        }
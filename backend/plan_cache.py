@@ -0,0 +1,126 @@
+import os
+import re
+import unicodedata
+
+from backend.disk_cache import DiskCache
+
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", 2000))
+# Độ giống (Dice trên n-gram ký tự, 0-1) tối thiểu để dùng lại plan của 1 yêu cầu gần giống
+# (ngoài ra tập từ của 2 yêu cầu chỉ được khác nhau ở stopword, xem _WORD_STOPWORDS)
+PLAN_CACHE_SIMILARITY = float(os.getenv("PLAN_CACHE_SIMILARITY", 0.9))
+
+_NGRAM = 3
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_NUMBER_RE = re.compile(r"\d+")
+# Các cách gọi mức độ khó tương đương -> "level N" (mức 2 == mức trung bình == level 2)
+_LEVEL_RE = re.compile(
+    r"\b(?:mức độ khó|mức độ|mức|cấp độ|độ khó|level)\s+"
+    r"(1|2|3|cơ bản|nhận biết|dễ|trung bình|vận dụng cao|vận dụng|nâng cao|cực khó|khó)\b"
+)
+_LEVELS = {
+    "1": "1", "cơ bản": "1", "nhận biết": "1", "dễ": "1",
+    "2": "2", "trung bình": "2", "vận dụng": "2",
+    "3": "3", "vận dụng cao": "3", "nâng cao": "3", "cực khó": "3", "khó": "3",
+}
+# Mức độ khó viết trần (không có "mức"/"level" đứng trước) -> 1 token "levelN" khi so tập từ
+_BARE_LEVEL_RE = re.compile(r"\b(?:level (1|2|3)|(vận dụng cao|cơ bản|nhận biết|dễ|trung bình|vận dụng|nâng cao|cực khó|khó))\b")
+# Từ không đổi nghĩa yêu cầu: 2 yêu cầu chỉ khác nhau ở các từ này vẫn được coi là gần giống.
+# Cố ý không có từ phủ định/đối lập ("không", "phi", "non", "skew", ...).
+_WORD_STOPWORDS = frozenset("""
+    tìm kiếm cho tôi mình em giúp hãy xin các những một vài về bài tập dạng phần câu hỏi đề và với của trong
+    level mức độ
+    find search give me please some a an the of on in for about and with to
+    exercise exercises problem problems question questions practice
+""".split())
+
+
+def normalize_request(text):
+    """Chuẩn hóa yêu cầu của người dùng: NFC, chữ thường, bỏ dấu câu, gộp khoảng trắng, thống nhất mức độ khó."""
+    text = unicodedata.normalize("NFC", str(text)).lower()
+    text = " ".join(_PUNCT_RE.sub(" ", text).split())
+    return _LEVEL_RE.sub(lambda m: f"level {_LEVELS[m.group(1)]}", text)
+
+
+def _ngrams(text):
+    padded = f" {text} "
+    return {padded[i:i + _NGRAM] for i in range(max(1, len(padded) - _NGRAM + 1))}
+
+
+def _words(text):
+    """Tập từ của yêu cầu đã chuẩn hóa, mức độ khó (kể cả viết trần) gộp thành 1 token "levelN"."""
+    text = _BARE_LEVEL_RE.sub(lambda m: f"level{m.group(1) or _LEVELS[m.group(2)]}", text)
+    return frozenset(text.split())
+
+
+def _same_words(wa, wb):
+    """2 tập từ chỉ khác nhau ở stopword (VD: "convergent" vs "divergent" -> khác)."""
+    return (wa ^ wb) <= _WORD_STOPWORDS
+
+
+def _dice(ga, gb):
+    return 2 * len(ga & gb) / (len(ga) + len(gb))
+
+
+def similarity(a, b):
+    """Hệ số Dice trên tập n-gram ký tự của 2 chuỗi đã chuẩn hóa."""
+    return _dice(_ngrams(a), _ngrams(b))
+
+
+class PlanCache:
+    """
+    Cache search plan của QueryGenerator (lưu đĩa).
+    - Khớp chính xác theo yêu cầu đã chuẩn hóa.
+    - Khớp gần đúng: yêu cầu có độ giống >= threshold, cùng các con số (mức độ, chương, ...) và
+      tập từ chỉ khác nhau ở stopword / cách gọi mức độ khó tương đương.
+    version (VD: hash của SYSTEM_PROMPT + model) nằm trong khóa: đổi prompt -> plan cũ không còn được dùng.
+    """
+
+    def __init__(self, threshold=PLAN_CACHE_SIMILARITY, ttl=PLAN_CACHE_TTL, max_entries=PLAN_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.cache = DiskCache("plans", ttl=ttl, max_entries=max_entries)
+        self._features = {}  # khóa -> (tập n-gram, tập từ) (tránh tính lại ở mỗi lần tra gần đúng)
+
+    def _key(self, version, normalized):
+        return f"{version}|{normalized}"
+
+    def get(self, user_input, version):
+        normalized = normalize_request(user_input)
+        entry = self.cache.peek(self._key(version, normalized))
+        if self.cache.is_fresh(entry):
+            self.cache.record("hits")
+            return entry[0]
+
+        prefix = self._key(version, "")
+        numbers = _NUMBER_RE.findall(normalized)
+        grams, words = _ngrams(normalized), _words(normalized)
+        best = None
+        keys = self.cache.keys(prefix)
+        if len(self._features) > 2 * len(keys) + 100:
+            # Bỏ n-gram/tập từ của các mục đã bị evict
+            live = set(keys)
+            self._features = {k: v for k, v in self._features.items() if k in live}
+        for key in keys:
+            candidate = key[len(prefix):]
+            if _NUMBER_RE.findall(candidate) != numbers:
+                continue
+            features = self._features.get(key)
+            if features is None:
+                features = self._features[key] = (_ngrams(candidate), _words(candidate))
+            score = _dice(grams, features[0])
+            if score >= self.threshold and _same_words(words, features[1]) and (best is None or score > best[0]):
+                best = (score, key)
+
+        if best is not None:
+            entry = self.cache.peek(best[1])
+            if self.cache.is_fresh(entry):
+                self.cache.record("near_hits")
+                return entry[0]
+        self.cache.record("misses")
+        return None
+
+    def set(self, user_input, version, plan):
+        self.cache.set(self._key(version, normalize_request(user_input)), plan)
+
+    def stats(self):
+        return self.cache.stats()
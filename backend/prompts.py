@@ -0,0 +1,42 @@
+import os
+import hashlib
+import threading
+
+PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PROMPT')
+
+_lock = threading.Lock()
+_cache = {}  # name -> (mtime, text, version)
+
+
+def _load(name):
+    path = os.path.join(PROMPT_DIR, name)
+    mtime = os.stat(path).st_mtime
+    with _lock:
+        entry = _cache.get(name)
+        if entry and entry[0] == mtime:
+            return entry
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+    entry = (mtime, text, version)
+    with _lock:
+        _cache[name] = entry
+    return entry
+
+
+def load_prompt(name):
+    """Đọc prompt template trong backend/PROMPT (giữ trong bộ nhớ, tự đọc lại khi file thay đổi)."""
+    return _load(name)[1]
+
+
+def prompt_version(name):
+    """Hash ngắn của nội dung prompt, dùng làm version trong khóa cache."""
+    return _load(name)[2]
+
+
+def preload_prompts():
+    """Đọc sẵn mọi prompt trong backend/PROMPT lúc khởi động (request đầu tiên không phải chờ đọc file)."""
+    names = sorted(name for name in os.listdir(PROMPT_DIR) if name.endswith(".txt"))
+    for name in names:
+        _load(name)
+    return names
@@ -1,7 +1,11 @@
 import os
 import json
-import google.generativeai as genai
-from google.api_core import retry
+import hashlib
+import threading
+
+from backend.metrics import metrics
+from backend.plan_cache import PlanCache
+from backend.rate_limiter import gemini_scheduler, estimate_tokens
 
 class QueryGenerator:
     def __init__(self, prompt_path= os.path.join('PROMPT', 'SYSTEM_PROMPT.txt')):
@@ -12,30 +16,96 @@ class QueryGenerator:
         if not self.api_key:
             raise ValueError("Environment variable 'GEMINI_API_KEY' is not set.")
 
-        # 2. Configure Gemini
-        genai.configure(api_key=self.api_key)
-
-        # 3. Load System Prompt from file
+        # 2. Check System Prompt file (SDK Gemini chỉ được nạp ở lần gọi model đầu tiên, xem _get_model)
         if not os.path.exists(prompt_path):
             raise FileNotFoundError(f"Prompt file not found at: {prompt_path}")
-            
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            self.system_instruction = f.read()
-
-        # 4. Initialize Model
-        self.model = genai.GenerativeModel(
-            model_name=self.model_id,
-            system_instruction=self.system_instruction,
-            generation_config={"response_mime_type": "application/json"}
-        )
-
-    @retry.Retry(predicate=retry.if_transient_error)
+
+        # Đường dẫn tuyệt đối: không phụ thuộc cwd của process khi đọc lại prompt
+        self.prompt_path = os.path.abspath(prompt_path)
+        self._prompt_mtime = None
+        self._prompt_lock = threading.Lock()
+
+        # 3. Đọc prompt 1 lần lúc khởi tạo (đọc lại + tạo lại model khi file prompt thay đổi)
+        self.model = None
+        self._refresh_prompt()
+
+        # 4. Cache search plan (khớp chính xác + gần đúng), version theo prompt và model
+        self.plan_cache = PlanCache()
+
+    def _refresh_prompt(self):
+        """Đọc lại prompt khi file thay đổi. File tạm thời không đọc được -> giữ prompt đã nạp gần nhất."""
+        try:
+            mtime = os.stat(self.prompt_path).st_mtime
+        except OSError as e:
+            if self._prompt_mtime is None:
+                raise
+            print(f"[WARN] Cannot stat prompt file, keeping last loaded prompt: {e}")
+            return
+        if mtime == self._prompt_mtime:
+            return
+        with self._prompt_lock:
+            if mtime == self._prompt_mtime:
+                return
+            try:
+                with open(self.prompt_path, "r", encoding="utf-8") as f:
+                    self.system_instruction = f.read()
+            except OSError as e:
+                if self._prompt_mtime is None:
+                    raise
+                print(f"[WARN] Cannot read prompt file, keeping last loaded prompt: {e}")
+                return
+            self.prompt_version = hashlib.sha256(
+                f"{self.model_id}\x1f{self.system_instruction}".encode("utf-8")
+            ).hexdigest()[:12]
+            self.model = None
+            self._prompt_mtime = mtime
+
+    def _get_model(self):
+        """Model planner theo prompt hiện tại, tạo lần đầu khi cần."""
+        model = self.model
+        if model is None:
+            with self._prompt_lock:
+                if self.model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self.model = genai.GenerativeModel(
+                        model_name=self.model_id,
+                        system_instruction=self.system_instruction,
+                        generation_config={"response_mime_type": "application/json"}
+                    )
+                model = self.model
+        return model
+
+    @metrics.timed("plan")
     def generate(self, user_input):
         """
         Nhận input string, trả về Dict (JSON parsed).
+        Yêu cầu giống (hoặc gần giống) yêu cầu trước đó -> dùng lại plan đã lưu, không gọi model.
         """
+        self._refresh_prompt()
+        plan = self.plan_cache.get(user_input, self.prompt_version)
+        if plan is not None:
+            print("[INFO] Search plan served from cache.")
+            return plan
+
+        plan = self._generate_plan(user_input)
+        if plan:
+            self.plan_cache.set(user_input, self.prompt_version, plan)
+        return plan
+
+    def _generate_plan(self, user_input):
+        from google.api_core import retry
+        return retry.Retry(predicate=retry.if_transient_error)(self._request_plan)(user_input)
+
+    def _request_plan(self, user_input):
         try:
-            response = self.model.generate_content(user_input)
+            # Đi qua scheduler chung, ngân sách riêng cho model planner
+            response = gemini_scheduler.call(
+                "planner",
+                lambda: self._get_model().generate_content(user_input),
+                estimated_tokens=estimate_tokens(self.system_instruction) + estimate_tokens(user_input),
+                max_retries=3,
+            )
             return json.loads(response.text)
         except json.JSONDecodeError:
             print("Error: Model did not return valid JSON.")
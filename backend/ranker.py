@@ -0,0 +1,107 @@
+import os
+import threading
+
+# Ngưỡng điểm (chuẩn hóa 0-1) để tài liệu được gửi thẩm định ngay, không chờ xếp hạng
+LEXICAL_MIN_SCORE = float(os.getenv("LEXICAL_MIN_SCORE", 0.2))
+# Số tài liệu tối đa gửi Gemini mỗi lượt tìm kiếm (mặc định, có thể đổi theo request)
+LEXICAL_TOP_K = int(os.getenv("LEXICAL_TOP_K", 10))
+
+_STOPWORDS = {
+    "and", "the", "for", "with", "from", "into", "onto", "over", "under", "between",
+    "of", "in", "on", "to", "by", "its", "their", "using", "via", "associated", "general",
+}
+
+
+class LexicalScorer:
+    """
+    Chấm điểm cục bộ kiểu BM25 (TF bão hòa + chuẩn hóa theo độ dài) cho 1 tài liệu
+    so với các từ khóa của kế hoạch tìm kiếm. Không gọi mạng, dùng để lọc trước khi gửi Gemini.
+    Mỗi nhóm từ khóa có trọng số cố định thay cho IDF (không có sẵn corpus cho từng request).
+    """
+
+    def __init__(self, weighted_terms, k1=1.2, b=0.75, avg_len=12000):
+        self.terms = {}
+        for term, weight in weighted_terms:
+            term = " ".join(str(term).lower().split())
+            if len(term) >= 3 and term not in _STOPWORDS:
+                self.terms[term] = max(weight, self.terms.get(term, 0.0))
+        self.k1 = k1
+        self.b = b
+        self.avg_len = avg_len
+        self.max_score = sum(w * (k1 + 1) for w in self.terms.values()) or 1.0
+
+    @classmethod
+    def from_search_plan(cls, search_plan, signal_keywords):
+        analysis = (search_plan or {}).get("analysis", {})
+        weighted = []
+        topic_en = analysis.get("topic_en", "")
+        weighted += [(w.strip("()&,.-"), 1.0) for w in topic_en.split()]
+        for phrase in [analysis.get("topic_vi", "")] + list(analysis.get("concepts", [])):
+            weighted.append((phrase, 1.5))
+            weighted += [(w.strip("()&,.-"), 0.5) for w in str(phrase).split() if len(w) >= 4]
+        weighted += [(kw, 0.5) for kw in signal_keywords]
+        return cls(weighted)
+
+    def score(self, pages_data):
+        """Điểm chuẩn hóa trong [0, 1]."""
+        text = " ".join(str(p.get("text", "")) for p in pages_data).lower()
+        if not text or not self.terms:
+            return 0.0
+        norm = self.k1 * (1 - self.b + self.b * len(text) / self.avg_len)
+        total = 0.0
+        for term, weight in self.terms.items():
+            tf = text.count(term)
+            if tf:
+                total += weight * tf * (self.k1 + 1) / (tf + norm)
+        return total / self.max_score
+
+
+class LexicalGate:
+    """
+    Cổng lọc giữa bước parse và verify:
+    - score >= threshold và còn suất (top_k): gửi thẩm định ngay.
+    - 0 < score < threshold: giữ lại, khi đã parse xong hết thì lấy các tài liệu điểm cao nhất
+      cho tới khi đủ top_k.
+    - score = 0 (không nhắc tới chủ đề) hoặc hết suất: bỏ qua, không gọi Gemini.
+    """
+
+    ADMIT, HOLD, REJECT = "admit", "hold", "reject"
+
+    def __init__(self, scorer, top_k=LEXICAL_TOP_K, threshold=LEXICAL_MIN_SCORE):
+        self.scorer = scorer
+        self.top_k = top_k
+        self.threshold = threshold
+        self.admitted = 0
+        self.rejected = 0
+        self._held = []
+        self._lock = threading.Lock()
+
+    def _has_slot(self):
+        return self.top_k is None or self.admitted < self.top_k
+
+    def offer(self, item, pages_data):
+        score = self.scorer.score(pages_data)
+        with self._lock:
+            if score <= 0:
+                self.rejected += 1
+                return self.REJECT
+            if score >= self.threshold and self._has_slot():
+                self.admitted += 1
+                return self.ADMIT
+            self._held.append((score, len(self._held), item))
+            return self.HOLD
+
+    def drain(self):
+        """Gọi khi không còn tài liệu mới. Trả về (các item được gửi thẩm định, số item bị bỏ)."""
+        with self._lock:
+            held = sorted(self._held, key=lambda x: (-x[0], x[1]))
+            self._held = []
+            released = []
+            for _, _, item in held:
+                if not self._has_slot():
+                    break
+                self.admitted += 1
+                released.append(item)
+            dropped = len(held) - len(released)
+            self.rejected += dropped
+        return released, dropped
@@ -0,0 +1,269 @@
+import os
+import re
+import time
+import random
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from backend.metrics import metrics
+
+
+class QuotaExhaustedError(Exception):
+    """Vẫn bị 429 sau khi đã retry hết số lần cho phép."""
+
+
+class CallCancelledError(Exception):
+    """Lời gọi bị hủy khi đang chờ lượt (request đã dừng sớm hoặc client ngắt kết nối)."""
+
+
+def is_rate_limit_error(exc):
+    return "429" in str(exc) or "Resource has been exhausted" in str(exc)
+
+
+def estimate_tokens(text):
+    """Ước lượng nhanh số token (~4 ký tự / token), không cần gọi API count_tokens."""
+    return max(1, len(str(text)) // 4)
+
+
+class TokenBucket:
+    """Token bucket: nạp lại `rate_per_min` đơn vị mỗi phút, chứa tối đa `capacity`."""
+
+    def __init__(self, rate_per_min, capacity=None):
+        self.rate_per_min = float(rate_per_min)
+        self.capacity = float(capacity if capacity is not None else rate_per_min)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_min / 60.0)
+
+    def time_until(self, amount, now):
+        """Số giây cần chờ để có đủ `amount` (0 nếu đủ ngay)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.rate_per_min
+
+    def consume(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+    def drain(self):
+        self.tokens = 0.0
+
+
+class _Ticket:
+    __slots__ = ("client", "tokens", "enqueued_at", "granted")
+
+    def __init__(self, client, tokens):
+        self.client = client
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class ModelBudget:
+    """
+    Ngân sách cho 1 model: giới hạn request/phút (RPM) và token/phút (TPM).
+    RPM tự điều chỉnh theo 429 quan sát được (giảm một nửa khi bị 429, tăng dần khi thành công).
+    """
+
+    def __init__(self, name, rpm, tpm, min_rpm=1.0):
+        self.name = name
+        self.max_rpm = float(rpm)
+        self.min_rpm = float(min_rpm)
+        self.current_rpm = float(rpm)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.cooldown_until = 0.0
+        # Hàng đợi theo từng client (chat) để chia lượt công bằng (round-robin)
+        self.queues = OrderedDict()
+        self.waiting = 0
+        self.stats = {"calls": 0, "rate_limited": 0, "retries": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def time_until_ready(self, ticket, now):
+        if now < self.cooldown_until:
+            return self.cooldown_until - now
+        return max(self.requests.time_until(1, now), self.tokens.time_until(ticket.tokens, now))
+
+    def on_rate_limited(self, retry_after):
+        self.stats["rate_limited"] += 1
+        self.current_rpm = max(self.min_rpm, self.current_rpm / 2.0)
+        self.requests.rate_per_min = self.current_rpm
+        self.requests.drain()
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + retry_after)
+
+    def on_success(self):
+        if self.current_rpm < self.max_rpm:
+            self.current_rpm = min(self.max_rpm, self.current_rpm + 0.1)
+            self.requests.rate_per_min = self.current_rpm
+
+
+class GeminiScheduler:
+    """
+    Bộ điều phối dùng chung (toàn process) cho mọi lời gọi Gemini.
+    - Mỗi model có ngân sách riêng (verifier = flash, planner = pro).
+    - Lời gọi xếp hàng theo client (chat_id) và được cấp lượt round-robin giữa các client.
+    - Khi gặp 429: cả model vào trạng thái cooldown và giảm RPM, thay vì từng thread tự sleep.
+    """
+
+    DEFAULT_RETRY_AFTER = 10.0
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        self.budgets = {}
+
+    def configure(self, name, rpm, tpm):
+        with self._cond:
+            self.budgets[name] = ModelBudget(name, rpm, tpm)
+
+    @contextmanager
+    def client(self, client_id, cancel_event=None):
+        """
+        Gắn client (VD: chat_id) cho các lời gọi Gemini trong thread hiện tại.
+        cancel_event (threading.Event, tùy chọn): khi được set, các lời gọi đang xếp hàng bị hủy.
+        """
+        previous = (getattr(self._local, "client", None), getattr(self._local, "cancel_event", None))
+        self._local.client = client_id
+        self._local.cancel_event = cancel_event
+        try:
+            yield
+        finally:
+            self._local.client, self._local.cancel_event = previous
+
+    def _current_client(self):
+        return getattr(self._local, "client", None) or "default"
+
+    def _dispatch(self, budget, now):
+        # Gọi khi đang giữ lock: cấp lượt cho client kế tiếp theo vòng tròn
+        granted = False
+        while budget.queues:
+            client, tickets = next(iter(budget.queues.items()))
+            ticket = tickets[0]
+            if budget.time_until_ready(ticket, now) > 0:
+                break
+            budget.requests.consume(1)
+            budget.tokens.consume(ticket.tokens)
+            ticket.granted = True
+            granted = True
+            tickets.popleft()
+            del budget.queues[client]
+            if tickets:
+                budget.queues[client] = tickets  # Xuống cuối vòng
+        if granted:
+            self._cond.notify_all()
+
+    def _acquire(self, budget, tokens):
+        client = self._current_client()
+        cancel_event = getattr(self._local, "cancel_event", None)
+        ticket = _Ticket(client, tokens)
+        with self._cond:
+            budget.queues.setdefault(client, deque()).append(ticket)
+            budget.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._dispatch(budget, now)
+                    if ticket.granted:
+                        break
+                    if cancel_event is not None and cancel_event.is_set():
+                        self._remove(budget, ticket)
+                        raise CallCancelledError()
+                    wait = budget.time_until_ready(budget.queues[next(iter(budget.queues))][0], now)
+                    self._cond.wait(timeout=min(max(wait, 0.05), 5.0))
+            finally:
+                budget.waiting -= 1
+            waited = time.monotonic() - ticket.enqueued_at
+            budget.stats["wait_total"] += waited
+            budget.stats["wait_max"] = max(budget.stats["wait_max"], waited)
+            budget.stats["calls"] += 1
+
+    def _remove(self, budget, ticket):
+        # Gọi khi đang giữ lock: bỏ ticket chưa được cấp lượt khỏi hàng đợi
+        tickets = budget.queues.get(ticket.client)
+        if tickets is not None:
+            tickets.remove(ticket)
+            if not tickets:
+                del budget.queues[ticket.client]
+
+    def _retry_after(self, exc, attempt):
+        match = re.search(r"retry in ([\d.]+)s", str(exc)) or re.search(r"seconds:\s*(\d+)", str(exc))
+        base = float(match.group(1)) if match else self.DEFAULT_RETRY_AFTER * (2 ** (attempt - 1))
+        return base + random.uniform(0.5, 2.0)
+
+    def call(self, budget_name, fn, estimated_tokens=1, max_retries=5):
+        """
+        Chờ tới lượt trong ngân sách của model rồi gọi fn().
+        Lỗi 429 được retry sau khi cooldown; lỗi khác được raise ngay.
+        """
+        budget = self.budgets[budget_name]
+        attempt = 0
+        while True:
+            self._acquire(budget, estimated_tokens)
+            metrics.inc("gemini_calls_total", budget=budget_name)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                metrics.inc("gemini_rate_limited_total", budget=budget_name)
+                attempt += 1
+                retry_after = self._retry_after(e, attempt)
+                with self._cond:
+                    budget.on_rate_limited(retry_after)
+                    if attempt > max_retries:
+                        raise QuotaExhaustedError(str(e)) from e
+                    budget.stats["retries"] += 1
+                metrics.inc("gemini_retries_total", budget=budget_name)
+                print(f"[WARN] Quota hit (429) on '{budget_name}'. Cooling down {retry_after:.1f}s "
+                      f"(Attempt {attempt}/{max_retries}, RPM now {budget.current_rpm:.1f})...")
+                continue
+            with self._cond:
+                budget.on_success()
+            self._record_tokens(budget_name, result, estimated_tokens)
+            return result
+
+    def _record_tokens(self, budget_name, result, estimated_tokens):
+        # Token thật từ usage_metadata của response (nếu có), ngược lại dùng số ước lượng
+        usage = getattr(result, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+        if prompt_tokens is None:
+            metrics.inc("llm_tokens_total", estimated_tokens, budget=budget_name, kind="prompt_estimated")
+            return
+        metrics.inc("llm_tokens_total", prompt_tokens, budget=budget_name, kind="prompt")
+        metrics.inc("llm_tokens_total", getattr(usage, "candidates_token_count", 0) or 0,
+                    budget=budget_name, kind="output")
+
+    def stats(self):
+        """Độ sâu hàng đợi, thời gian chờ và số lần bị 429 cho từng model."""
+        with self._cond:
+            data = {}
+            for name, budget in self.budgets.items():
+                calls = budget.stats["calls"]
+                data[name] = {
+                    "queue_depth": budget.waiting,
+                    "current_rpm": round(budget.current_rpm, 2),
+                    "calls": calls,
+                    "rate_limited": budget.stats["rate_limited"],
+                    "retries": budget.stats["retries"],
+                    "avg_wait_seconds": round(budget.stats["wait_total"] / calls, 3) if calls else 0.0,
+                    "max_wait_seconds": round(budget.stats["wait_max"], 3),
+                }
+            return data
+
+
+gemini_scheduler = GeminiScheduler()
+gemini_scheduler.configure(
+    "verifier",
+    rpm=float(os.getenv("GEMINI_VERIFIER_RPM", 60)),
+    tpm=float(os.getenv("GEMINI_VERIFIER_TPM", 1000000)),
+)
+gemini_scheduler.configure(
+    "planner",
+    rpm=float(os.getenv("GEMINI_PLANNER_RPM", 10)),
+    tpm=float(os.getenv("GEMINI_PLANNER_TPM", 250000)),
+)
@@ -1,58 +1,210 @@
 import os
+import re
+import time
+import random
+import threading
 import concurrent.futures
 import math
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from dotenv import load_dotenv
 
+from backend.disk_cache import DiskCache
+from backend.doc_index import DocumentIndex, QUERY_OPERATORS
+from backend.metrics import metrics
+from backend.url_utils import normalize_url, canonicalize_url, is_blocked_url
+
 load_dotenv()
 
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL_SECONDS", 24 * 3600))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 50000))
+# Số lời gọi Custom Search đồng thời tối đa (toàn process), timeout và số lần retry mỗi query
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 5))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT_SECONDS", 10))
+SEARCH_MAX_RETRIES = int(os.getenv("SEARCH_MAX_RETRIES", 2))
+# Hit của index cục bộ luôn được gộp (bỏ trùng) với kết quả Google. Tùy chọn bỏ qua lời gọi Google cho query
+# có ít nhất LOCAL_INDEX_MIN_HITS hit với điểm BM25 >= LOCAL_INDEX_MIN_SCORE (0 = luôn gọi Google)
+LOCAL_INDEX_MIN_HITS = int(os.getenv("LOCAL_INDEX_MIN_HITS", 0))
+LOCAL_INDEX_MIN_SCORE = float(os.getenv("LOCAL_INDEX_MIN_SCORE", 8.0))
+
+# Token của query: toán tử có giá trị trong ngoặc kép, toán tử thường, cụm "..." hoặc từ đơn
+_OPERATORS = "|".join(QUERY_OPERATORS)
+_QUERY_TOKEN_RE = re.compile(r'-?(?:' + _OPERATORS + r'):"[^"]*"|-?(?:' + _OPERATORS + r'):\S+|-?"[^"]*"|\S+')
+# Toán tử Custom Search đã biết, hoặc loại trừ "-từ" / "-\"cụm\"" (không phải "-1", "x:")
+_OPERATOR_RE = re.compile(r'^-?(?:' + _OPERATORS + r'):|^-(?:"|[^\W\d_]+$)')
+
+
+_discovery_lock = threading.Lock()
+_discovery_doc = None
+
+
+def _discovery_document():
+    """Discovery document của Custom Search v1 đóng gói sẵn trong googleapiclient (đọc 1 lần), None nếu không có."""
+    global _discovery_doc
+    with _discovery_lock:
+        if _discovery_doc is None:
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                _discovery_doc = get_static_doc("customsearch", "v1") or ""
+            except ImportError:  # google-api-python-client 1.x
+                _discovery_doc = ""
+        return _discovery_doc or None
+
+
+def build_service(api_key, timeout=SEARCH_TIMEOUT):
+    """
+    Service Custom Search từ discovery document đóng gói sẵn: không tải tài liệu qua mạng
+    (chạy được offline, không tốn 1 round-trip mỗi thread). Chỉ tải khi thư viện không có bản đóng gói.
+    """
+    import httplib2
+    from googleapiclient.discovery import build, build_from_document
+
+    http = httplib2.Http(timeout=timeout)
+    document = _discovery_document()
+    if document is not None:
+        return build_from_document(document, developerKey=api_key, http=http)
+    return build("customsearch", "v1", developerKey=api_key, http=http, cache_discovery=False)
+
+
+def normalize_query(query):
+    """
+    Chuẩn hóa query để dùng làm khóa cache:
+    chữ thường, gộp khoảng trắng, thống nhất dấu nháy, sắp xếp các toán tử (site:, filetype:, intitle:,
+    inurl:, -từ).
+    Thứ tự phần văn bản tự do được giữ nguyên.
+    """
+    q = str(query).lower()
+    q = q.translate(str.maketrans({"\u201c": '"', "\u201d": '"', "\u201e": '"', "\u2018": "'", "\u2019": "'"}))
+    q = " ".join(q.split())
+
+    terms, operators = [], []
+    for token in _QUERY_TOKEN_RE.findall(q):
+        if token in ('""', '-""'):
+            continue
+        if _OPERATOR_RE.match(token):
+            operators.append(token)
+        else:
+            terms.append(token)
+    return " ".join(terms + sorted(set(operators)))
+
 class SearchEngine:
-    def __init__(self):
+    def __init__(self, doc_index=None):
         self.api_key = os.getenv("GOOGLE_API_KEY")
         self.cse_id = os.getenv("GOOGLE_CSE_ID")
         
         if not self.api_key or not self.cse_id:
             raise ValueError("Missing GOOGLE_API_KEY or GOOGLE_CSE_ID in .env file")
 
-        try:
-            self.service = build("customsearch", "v1", developerKey=self.api_key)
-        except Exception as e:
-            print(f"[SEARCH INIT ERROR] Could not build service: {e}")
-            self.service = None
+        # Service của googleapiclient (và httplib2.Http bên dưới) không thread-safe:
+        # mỗi thread dùng 1 instance riêng, tạo lần đầu khi cần (không tạo lúc khởi động)
+        self._local = threading.local()
+        self._slots = threading.BoundedSemaphore(SEARCH_CONCURRENCY)
+
+        # Cache kết quả search (lưu đĩa, giữ qua các lần khởi động lại)
+        self.cache = DiskCache("search", ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES)
+        # Index cục bộ các tài liệu đã từng tải (tìm ở đây trước, trộn với kết quả Google)
+        self.local_index = doc_index if doc_index is not None else DocumentIndex()
+
+    def _get_service(self):
+        """Service Custom Search của thread hiện tại (timeout riêng cho mỗi request), None nếu lỗi."""
+        service = getattr(self._local, "service", None)
+        if service is None:
+            try:
+                service = build_service(self.api_key)
+            except Exception as e:
+                print(f"[SEARCH INIT ERROR] Could not build service: {e}")
+                return None
+            self._local.service = service
+        return service
+
+    def _is_transient(self, error):
+        # 5xx và timeout / lỗi kết nối: thử lại. 4xx (gồm 429 hết quota ngày) thì không.
+        if isinstance(error, HttpError):
+            return error.resp.status >= 500
+        return isinstance(error, (TimeoutError, ConnectionError, OSError))
 
+    @metrics.timed("search_query")
     def _search_single_query(self, query, num_results=3):
         """Gọi API cho 1 query duy nhất với số lượng kết quả tùy chỉnh."""
-        if not self.service:
-            return []
-            
-        try:
-            # Google API giới hạn tối đa 10 kết quả mỗi lần gọi
-            safe_num = min(num_results, 10)
-            
-            res = self.service.cse().list(
-                q=query, 
-                cx=self.cse_id, 
-                num=safe_num
-            ).execute()
-            
-            items = res.get('items', [])
-            links = [item['link'] for item in items]
-            return links
-            
-        except HttpError as e:
-            print(f"[GOOGLE API ERROR] Query: '{query}' failed. Reason: {e}")
-            return []
-        except Exception as e:
-            print(f"[SEARCH ERROR] Unknown error for '{query}': {e}")
-            return []
-
-    def execute_search_plan(self, search_plan_json, max_queries=3, results_per_query=3, max_workers=5):
+        service = self._get_service()
+        if not service:
+            return None
+
+        # Google API giới hạn tối đa 10 kết quả mỗi lần gọi
+        safe_num = min(num_results, 10)
+        attempt = 0
+        while True:
+            try:
+                metrics.inc("search_api_calls_total")
+                with self._slots:
+                    res = service.cse().list(
+                        q=query,
+                        cx=self.cse_id,
+                        num=safe_num
+                    ).execute()
+
+                items = res.get('items', [])
+                links = [item['link'] for item in items]
+                return links
+
+            except Exception as e:
+                if attempt < SEARCH_MAX_RETRIES and self._is_transient(e):
+                    attempt += 1
+                    metrics.inc("search_retries_total")
+                    # Exponential backoff + full jitter
+                    delay = random.uniform(0, 0.5 * 2 ** attempt)
+                    print(f"[WARN] Search query '{query}' failed ({e}). Retrying in {delay:.1f}s "
+                          f"(Attempt {attempt}/{SEARCH_MAX_RETRIES})...")
+                    time.sleep(delay)
+                    continue
+                if isinstance(e, HttpError):
+                    print(f"[GOOGLE API ERROR] Query: '{query}' failed. Reason: {e}")
+                else:
+                    print(f"[SEARCH ERROR] Unknown error for '{query}': {e}")
+                return None
+
+    def _search_cache_key(self, query, num_results):
+        return f"{min(num_results, 10)}|{normalize_query(query)}"
+
+    def _cached_search(self, query, num_results=3):
+        """
+        Đứng trước _search_single_query: trả về (links, from_cache).
+        Chỉ lưu cache khi gọi API thành công (kể cả khi 0 kết quả).
+        """
+        key = self._search_cache_key(query, num_results)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached, True
+
+        links = self._search_single_query(query, num_results)
+        if links is None:
+            return [], False
+        self.cache.set(key, links)
+        return links, False
+
+    def execute_search_plan(self, search_plan_json, max_queries=3, results_per_query=3, max_workers=None, stats=None):
         """
         Input: JSON từ QueryGenerator, cấu hình số lượng query và link.
+        stats (dict, tùy chọn): được điền số lượt gọi API thật (api_calls),
+        số lượt tiết kiệm nhờ cache / trùng query / index cục bộ (api_calls_saved)
+        và số link lấy từ index cục bộ (local_hits).
+        """
+        return list(self.iter_search_plan(search_plan_json, max_queries, results_per_query, max_workers, stats))
+
+    def iter_search_plan(self, search_plan_json, max_queries=3, results_per_query=3, max_workers=None, stats=None,
+                         executor=None):
+        """
+        Phiên bản generator của execute_search_plan: yield từng link mới (chưa trùng)
+        ngay khi query chứa nó trả về, để bước fetch có thể bắt đầu sớm.
+        Mỗi query cũng được tìm trong index cục bộ (vài ms) trong lúc các query Google đã được gửi đi;
+        các hit này được yield đầu tiên. Nếu bật LOCAL_INDEX_MIN_HITS, query nào đã đủ hit cục bộ
+        thì không gọi Google (query đó phải tra index trước khi gửi, nhưng các query khác không phải chờ).
+        Link được chuẩn hóa (normalize_url) trước khi yield, bỏ domain bị chặn và gộp các URL
+        tương đương (http/https, tham số theo dõi, "/" cuối, arxiv abs/pdf, Google Docs viewer).
+        executor (tùy chọn): thread pool dùng chung để chạy các query (VD: AsyncSearchPipeline),
+        giữ lại service đã tạo của từng thread giữa các request. Mặc định tạo pool riêng cho lượt này.
         """
         if not search_plan_json:
-            return []
+            return
 
         # Lấy danh sách query từ các Tier
         t1 = search_plan_json.get('tier_1_topic_focused', [])
@@ -71,32 +223,101 @@ class SearchEngine:
             
         # Cắt lấy đúng số lượng user yêu cầu
         selected_queries = all_potential_queries[:max_queries]
+
+        # Bỏ các query trùng nhau sau khi chuẩn hóa (mỗi query trùng = 1 lượt gọi tiết kiệm được)
+        seen_keys = set()
+        deduped_queries = []
+        for q in selected_queries:
+            key = self._search_cache_key(q, results_per_query)
+            if key not in seen_keys:
+                seen_keys.add(key)
+                deduped_queries.append(q)
+        api_calls = 0
+        api_calls_saved = len(selected_queries) - len(deduped_queries)
         
         unique_urls = set()
-        
+        filtered = 0
+
+        def accept(link):
+            # Trả về URL đã chuẩn hóa nếu là link mới, None nếu bị chặn / trùng
+            nonlocal filtered
+            url = normalize_url(link)
+            key = canonicalize_url(url)
+            if not url or is_blocked_url(url) or key in unique_urls:
+                filtered += 1
+                return None
+            unique_urls.add(key)
+            return url
+
         print(f"[INFO] Executing {len(selected_queries)} queries (Limit: {max_queries})...")
         print(f"[INFO] Fetching {results_per_query} links per query...")
 
-        safe_workers = 1 
-        print(f"[INFO] Force switching to {safe_workers} worker(s) to prevent SSL/Malloc crash on macOS.")
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=safe_workers)
+        # Mỗi thread có service riêng nên chạy song song an toàn; tổng số lời gọi đồng thời
+        # của cả process vẫn bị giới hạn bởi SEARCH_CONCURRENCY
+        own_executor = executor is None
+        if own_executor:
+            workers = max(1, min(max_workers or SEARCH_CONCURRENCY, SEARCH_CONCURRENCY, len(deduped_queries)))
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # Thread của executor ghi thời gian vào cùng request với thread gọi
+        timings = metrics.current_timings()
+
+        def run_query(q):
+            with metrics.collect(timings):
+                return self._cached_search(q, results_per_query)
 
         try:
-            # Submit tasks với tham số num_results động
-            future_to_query = {
-                executor.submit(self._search_single_query, q, results_per_query): q 
-                for q in selected_queries
-            }
-            
+            future_to_query = {}
+            skip_local = LOCAL_INDEX_MIN_HITS > 0
+            if not skip_local:
+                # Không query nào được bỏ qua -> gửi hết lên Google trước, tra index trong lúc chờ
+                future_to_query = {executor.submit(run_query, q): q for q in deduped_queries}
+
+            # --- INDEX CỤC BỘ: tài liệu đã từng tải ở các lượt chat trước ---
+            local_urls = []
+            for q in deduped_queries:
+                try:
+                    hits = self.local_index.search(q, limit=results_per_query)
+                except Exception as e:
+                    print(f"[INDEX ERROR] Query: '{q}' failed. Reason: {e}")
+                    hits = []
+                for hit in hits:
+                    url = accept(hit["url"])
+                    if url:
+                        local_urls.append(url)
+                if not skip_local:
+                    continue
+                strong = sum(1 for hit in hits if hit["score"] >= LOCAL_INDEX_MIN_SCORE)
+                if strong >= LOCAL_INDEX_MIN_HITS:
+                    api_calls_saved += 1
+                else:
+                    future_to_query[executor.submit(run_query, q)] = q
+            local_hits = len(local_urls)
+            if local_hits:
+                print(f"[INFO] Local index: {local_hits} links, "
+                      f"{len(deduped_queries) - len(future_to_query)} queries answered locally")
+            yield from local_urls
+
             for future in concurrent.futures.as_completed(future_to_query):
                 try:
-                    urls = future.result()
-                    unique_urls.update(urls)
+                    urls, from_cache = future.result()
+                    if from_cache:
+                        api_calls_saved += 1
+                    else:
+                        api_calls += 1
                 except Exception as exc:
                     print(f"[THREAD ERROR] Generated an exception: {exc}")
+                    continue
+
+                for link in urls:
+                    url = accept(link)
+                    if url:
+                        yield url
         finally:
-            executor.shutdown(wait=True)
+            if own_executor:
+                executor.shutdown(wait=True)
         
-        results = list(unique_urls)
-        print(f"[INFO] Total unique links found: {len(results)}")
-        return results
\ No newline at end of file
+        print(f"[INFO] Total unique links found: {len(unique_urls)} (API calls: {api_calls}, saved by cache: {api_calls_saved}, "
+              f"duplicate/blocked links dropped: {filtered})")
+        if stats is not None:
+            stats.update({"api_calls": api_calls, "api_calls_saved": api_calls_saved, "local_hits": local_hits,
+                          "links_filtered": filtered})
\ No newline at end of file
@@ -0,0 +1,112 @@
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# Domain không bao giờ chứa tài liệu bài tập đọc được (video, mạng xã hội, ảnh động)
+BLOCKED_DOMAINS = (
+    "youtube.com", "youtu.be", "reddit.com", "tiktok.com", "giphy.com", "tenor.com", "knowyourmeme.com",
+)
+
+# Tham số theo dõi (click ID, analytics), không ảnh hưởng nội dung trang -> bỏ khỏi cả URL dùng để tải
+_TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_ga", "_gl",
+}
+_TRACKING_PREFIXES = ("utm_", "pk_", "hsa_")
+# Tham số chia sẻ/giới thiệu thường không đổi nội dung nhưng không chắc chắn với mọi site
+# -> chỉ bỏ trong khóa dedup (canonicalize_url), URL tải giữ nguyên. "ref"/"source" không nằm ở đây
+# vì thường chọn nội dung (VD: GitHub ?ref=<branch>).
+_SHARE_PARAMS = {"ref_src", "ref_url", "spm", "si"}
+
+# Các trang bọc URL thật trong query (Google Docs viewer, redirect của Google)
+_WRAPPERS = {
+    ("docs.google.com", "/viewer"): "url",
+    ("docs.google.com", "/viewerng/viewer"): "url",
+    ("drive.google.com", "/viewerng/viewer"): "url",
+    ("www.google.com", "/url"): "q",
+    ("google.com", "/url"): "q",
+}
+
+_ARXIV_HOSTS = {"arxiv.org", "www.arxiv.org", "export.arxiv.org"}
+_ARXIV_RE = re.compile(r"^/(?:abs|pdf)/(.+?)(?:\.pdf)?/?$")
+
+
+def _is_tracking(param):
+    param = param.lower()
+    return param in _TRACKING_PARAMS or param.startswith(_TRACKING_PREFIXES)
+
+
+def normalize_url(url):
+    """
+    Dạng URL dùng để tải: gỡ lớp bọc (Google Docs viewer, google.com/url), bỏ tham số theo dõi
+    và fragment, arxiv /abs/ -> /pdf/. Giữ nguyên scheme và path để request vẫn hợp lệ.
+    """
+    if not url:
+        return url
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except ValueError:
+        return url
+
+    # Gỡ lớp bọc (có thể lồng nhau, VD: google.com/url -> docs viewer -> PDF)
+    for _ in range(3):
+        param = _WRAPPERS.get((host, parts.path.rstrip("/")))
+        if not param:
+            break
+        inner = dict(parse_qsl(parts.query)).get(param, "")
+        if not inner.startswith(("http://", "https://")):
+            break
+        try:
+            parts = urlsplit(inner.strip())
+            host = (parts.hostname or "").lower()
+        except ValueError:
+            return url
+
+    path = parts.path
+    if host in _ARXIV_HOSTS:
+        match = _ARXIV_RE.match(path)
+        if match:
+            host, path = "arxiv.org", f"/pdf/{match.group(1)}"
+
+    netloc = parts.netloc if host == (parts.hostname or "").lower() else host
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not _is_tracking(k)])
+    return urlunsplit((parts.scheme.lower(), netloc, path, query, ""))
+
+
+def canonicalize_url(url):
+    """
+    Khóa định danh của URL (dùng để dedup và làm khóa cache), áp dụng sau normalize_url:
+    coi http và https là một, host viết thường, bỏ "www." và port mặc định,
+    bỏ dấu "/" cuối path, bỏ tham số chia sẻ (_SHARE_PARAMS), sắp xếp query.
+    """
+    if not url:
+        return url
+    url = normalize_url(url)
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        port = parts.port
+    except ValueError:
+        return url
+
+    scheme = parts.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    if host.startswith("www."):
+        host = host[4:]
+    if port and port not in (80, 443):
+        host = f"{host}:{port}"
+
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                             if k.lower() not in _SHARE_PARAMS))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def is_blocked_url(url):
+    """URL thuộc domain trong BLOCKED_DOMAINS (kể cả subdomain) -> không tải."""
+    try:
+        host = (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return True
+    return any(host == d or host.endswith("." + d) for d in BLOCKED_DOMAINS)
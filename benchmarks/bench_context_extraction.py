@@ -0,0 +1,170 @@
+"""
+Micro-benchmark cho ContentProcessor._extract_relevant_context_with_pages.
+
+So sánh bản cũ (re.finditer riêng cho từng từ khóa + nối chuỗi, cắt ở 25.000 ký tự theo thứ tự trang)
+với bản hiện tại (TermMatcher + chọn đoạn theo ngân sách token) trên dữ liệu tổng hợp: PDF 10 trang và
+trang HTML 30.000 ký tự.
+- Không giới hạn ngân sách, output phải giống hệt bản cũ (fuzz; cách tìm và gộp cửa sổ không đổi).
+- Với ngân sách mặc định: số token gửi đi và số tín hiệu bài tập còn giữ được trong context.
+
+Chạy: python benchmarks/bench_context_extraction.py
+"""
+import os
+import re
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.content_processor import ContentProcessor
+from backend.rate_limiter import estimate_tokens
+
+TOPIC = "Orthogonal projection and Gram-Schmidt process in inner product spaces"
+# Topic dài (nhiều term): chi phí bản cũ tăng theo số term
+LONG_TOPIC = TOPIC + " vector subspace basis matrix theorem lemma corollary span columns compute consider definition"
+
+FILLER = (
+    "let v be a vector in the subspace w with basis u1 u2 and consider the inner product "
+    "định nghĩa không gian con trực giao của ma trận theorem proof lemma corollary "
+    "we compute the projection onto the span of the orthonormal basis obtained by "
+    "the gram-schmidt process applied to the columns of a matrix a "
+).split()
+SIGNALS = ["Exercise", "Problem", "Bài tập", "Ví dụ", "Solution", "midterm", "quiz", "testest", "practice"]
+# Tín hiệu bài tập đếm trong context (đo context còn giữ được phần bài tập hay không)
+EXERCISE_MARKERS = ("exercise", "problem", "bài tập", "solution")
+UNLIMITED = 10 ** 9
+
+
+def make_text(rng, n_chars, signal_rate):
+    words = []
+    size = 0
+    while size < n_chars:
+        w = rng.choice(SIGNALS) if rng.random() < signal_rate else rng.choice(FILLER)
+        if rng.random() < 0.05:
+            w += "\n"
+        words.append(w)
+        size += len(w) + 1
+    return " ".join(words)[:n_chars]
+
+
+def legacy_extract(signal_keywords, pages_data, topic_keywords, window_size=800):
+    """Bản gốc trước khi tối ưu (giữ nguyên để đối chiếu)."""
+    if not pages_data: return ""
+
+    search_terms = signal_keywords + topic_keywords.lower().split()
+    final_context = ""
+    total_len = 0
+    MAX_LEN = 25000
+
+    for page_item in pages_data:
+        page_num = page_item['page']
+        text = str(page_item['text'])
+        if not text: continue
+
+        lowered_text = text.lower()
+        indices = []
+
+        for term in search_terms:
+            if len(term) < 3: continue
+            if term in lowered_text:
+                indices.extend([m.start() for m in re.finditer(re.escape(term), lowered_text)])
+
+        if not indices: continue
+
+        indices.sort()
+        ranges = []
+        text_len = len(text)
+        for idx in indices:
+            start = max(0, idx - 200)
+            end = min(text_len, idx + window_size)
+            ranges.append((start, end))
+
+        merged_ranges = []
+        if ranges:
+            curr_start, curr_end = ranges[0]
+            for next_start, next_end in ranges[1:]:
+                if next_start < curr_end:
+                    curr_end = max(curr_end, next_end)
+                else:
+                    merged_ranges.append((curr_start, curr_end))
+                    curr_start, curr_end = next_start, next_end
+            merged_ranges.append((curr_start, curr_end))
+
+        for start, end in merged_ranges:
+            if total_len > MAX_LEN: break
+            chunk = text[start:end].replace('\n', ' ')
+            final_context += f"\n=== PAGE {page_num} ===\n...{chunk}...\n"
+            total_len += len(chunk)
+
+    if not final_context and pages_data:
+        p1 = pages_data[0]
+        final_context += f"\n=== PAGE {p1['page']} (Intro) ===\n{str(p1['text'])[:3000]}"
+        if len(pages_data) > 1:
+            p_last = pages_data[-1]
+            final_context += f"\n=== PAGE {p_last['page']} (End) ===\n{str(p_last['text'])[:2000]}"
+
+    return final_context
+
+
+def fuzz_identical(processor, rounds=2000):
+    """So khớp output trên văn bản ngẫu nhiên với các term chồng lấn nhau (VD: 'aba', 'abab', 'bab')."""
+    rng = random.Random(7)
+    alphabet = "ab \n"
+    for _ in range(rounds):
+        topic = " ".join("".join(rng.choice("ab") for _ in range(rng.randint(3, 5))) for _ in range(rng.randint(1, 40)))
+        pages = [{"page": i + 1, "text": "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 3000)))} for i in range(3)]
+        old = legacy_extract(processor.signal_keywords, pages, topic, window_size=20)
+        new = processor._extract_relevant_context_with_pages(pages, topic, window_size=20, token_budget=UNLIMITED)
+        if old != new:
+            sys.exit(f"Fuzz mismatch for topic {topic!r}")
+    print(f"fuzz: {rounds} random cases identical")
+
+
+def main():
+    rng = random.Random(42)
+    processor = ContentProcessor()
+    fuzz_identical(processor)
+
+    cases = {
+        "pdf_10_pages_dense": [{"page": i + 1, "text": make_text(rng, 3000, 0.02)} for i in range(10)],
+        "pdf_10_pages_sparse": [{"page": i + 1, "text": make_text(rng, 3000, 0.001)} for i in range(10)],
+        "html_30k": [{"page": "Web", "text": make_text(rng, 30000, 0.005)}],
+        "html_30k_no_signal": [{"page": "Web", "text": make_text(rng, 30000, 0.0)}],
+    }
+    topics = {name: TOPIC for name in cases}
+    cases["pdf_10_pages_long_topic"] = cases["pdf_10_pages_dense"]
+    cases["html_30k_long_topic"] = cases["html_30k"]
+    topics["pdf_10_pages_long_topic"] = topics["html_30k_long_topic"] = LONG_TOPIC
+
+    # Tài liệu có phần lý thuyết dài (ít tín hiệu) ở đầu, bài tập dồn ở các trang cuối
+    cases["pdf_exercises_late"] = (
+        [{"page": i + 1, "text": make_text(rng, 6000, 0.004)} for i in range(7)]
+        + [{"page": i + 8, "text": make_text(rng, 4000, 0.03)} for i in range(3)]
+    )
+    topics["pdf_exercises_late"] = TOPIC
+
+    print(f"{'case':<28}{'legacy (ms)':>14}{'new (ms)':>12}{'speedup':>10}")
+    for name, pages in cases.items():
+        topic = topics[name]
+        n = 50
+        t_old = timeit.timeit(lambda: legacy_extract(processor.signal_keywords, pages, topic), number=n) / n
+        t_new = timeit.timeit(lambda: processor._extract_relevant_context_with_pages(pages, topic), number=n) / n
+        print(f"{name:<28}{t_old * 1000:>14.3f}{t_new * 1000:>12.3f}{t_old / t_new:>9.2f}x")
+
+    print(f"\n{'case':<28}{'legacy tokens':>14}{'packed tokens':>15}{'legacy signals':>16}{'packed signals':>16}")
+    for name, pages in cases.items():
+        topic = topics[name]
+        old = legacy_extract(processor.signal_keywords, pages, topic)
+        new = processor._extract_relevant_context_with_pages(pages, topic)
+        print(f"{name:<28}{estimate_tokens(old):>14}{estimate_tokens(new):>15}"
+              f"{count_markers(old):>16}{count_markers(new):>16}")
+
+
+def count_markers(context):
+    lowered = context.lower()
+    return sum(lowered.count(marker) for marker in EXERCISE_MARKERS)
+
+
+if __name__ == "__main__":
+    main()
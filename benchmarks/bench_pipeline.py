@@ -0,0 +1,382 @@
+"""
+Benchmark end-to-end offline cho pipeline tìm kiếm (không cần Gemini, Google CSE hay Internet).
+
+Thay 3 phụ thuộc bên ngoài bằng thành phần giả lập trong offline_stubs.py:
+- Gemini: FakePlannerModel / FakeVerifierModel (độ trễ và tỉ lệ 429 cấu hình được),
+- Google Custom Search: FakeCustomSearch,
+- Web: CorpusServer phục vụ bộ PDF/HTML tổng hợp trên 127.0.0.1.
+
+Các kịch bản, mỗi kịch bản chạy ở từng mức concurrency:
+- chat:    POST /api/chat-stream của app.py (Flask test client), đọc stream NDJSON tới hết
+- achat:   cùng request nhưng qua ASGI app (asgi.py, AsyncSearchPipeline)
+- search:  SearchEngine.execute_search_plan
+- fetch:   ContentProcessor.fetch_content (download + parse)
+- verify:  ContentProcessor.verify_relevance trên tài liệu đã tải
+Báo cáo p50/p95 latency, time-to-first-result (sự kiện "match" đầu tiên, chỉ với chat / achat) và throughput.
+Mặc định mỗi mức concurrency chạy trên cache rỗng (--warm: chạy mồi 1 lượt rồi mới đo).
+
+Chạy: python benchmarks/bench_pipeline.py [--concurrency 1,4,8] [--gemini-latency 0.3] [--rate-429 0.02] [--json out.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from offline_stubs import (
+    TOPICS, build_corpus, search_plan_for, CorpusServer, FakeCustomSearch, FakeVerifierModel, FakePlannerModel,
+)
+
+SCENARIOS = ("chat", "achat", "search", "fetch", "verify")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Các mức concurrency, phân cách bằng dấu phẩy")
+    parser.add_argument("--requests", type=int, default=8, help="Số request chat / search plan mỗi mức concurrency")
+    parser.add_argument("--docs", type=int, default=60, help="Số tài liệu trong corpus")
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--rate-429", type=float, default=0.02)
+    parser.add_argument("--cse-latency", type=float, default=0.15)
+    parser.add_argument("--http-latency", type=float, default=0.02)
+    parser.add_argument("--max-queries", type=int, default=3)
+    parser.add_argument("--results-per-query", type=int, default=5)
+    parser.add_argument("--warm", action="store_true", help="Chạy mồi 1 lượt (cache nóng) trước khi đo")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON (để so sánh giữa các lần chạy)")
+    parser.add_argument("--verbose", action="store_true", help="Giữ log của backend")
+    return parser.parse_args()
+
+
+def configure_env(args, workdir):
+    """Biến môi trường phải có trước khi import backend / app.py."""
+    os.environ["GEMINI_API_KEY"] = "offline"
+    os.environ["GOOGLE_API_KEY"] = "offline"
+    os.environ["GOOGLE_CSE_ID"] = "offline"
+    os.environ["CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["HISTORY_DB"] = os.path.join(workdir, "chat_history.db")
+    # Mọi tài liệu nằm trên cùng 1 host: nới giới hạn theo host để đo pipeline, không phải politeness
+    os.environ.setdefault("FETCH_PER_HOST_LIMIT", "16")
+    os.environ.setdefault("FETCH_HOST_MIN_INTERVAL", "0")
+    # Quota thật không áp dụng; tỉ lệ 429 do model giả quyết định
+    os.environ.setdefault("GEMINI_VERIFIER_RPM", "6000")
+    os.environ.setdefault("GEMINI_PLANNER_RPM", "6000")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile, None nếu không có mẫu."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_concurrent(func, jobs, concurrency):
+    """Chạy func(job) với `concurrency` thread. Trả về (list kết quả, wall time)."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(func, jobs))
+    return results, time.perf_counter() - start
+
+
+def run_async(func, jobs, concurrency):
+    """Như run_concurrent nhưng func là coroutine: tối đa `concurrency` job cùng lúc trong 1 event loop."""
+    async def main():
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one(job):
+            async with slots:
+                return await func(job)
+        return await asyncio.gather(*(one(job) for job in jobs))
+
+    start = time.perf_counter()
+    results = asyncio.run(main())
+    return results, time.perf_counter() - start
+
+
+def summarize(scenario, concurrency, samples, wall):
+    """samples: list dict {"latency", "ttfr" (tùy chọn), "error"}."""
+    ok = [s for s in samples if not s.get("error")]
+    latencies = [s["latency"] for s in ok]
+    ttfr = [s["ttfr"] for s in ok if s.get("ttfr") is not None]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "n": len(samples),
+        "errors": len(samples) - len(ok),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "ttfr_p50": percentile(ttfr, 50),
+        "ttfr_p95": percentile(ttfr, 95),
+        "throughput": len(ok) / wall if wall else None,
+        "wall": wall,
+    }
+
+
+class Harness:
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = workdir
+        self.corpus = build_corpus(args.docs)
+        self.server = CorpusServer(self.corpus, latency=args.http_latency)
+        self.cse = FakeCustomSearch(self.server.urls(), latency=args.cse_latency)
+        self.verifier = FakeVerifierModel(latency=args.gemini_latency, rate_429=args.rate_429, seed=1)
+        self.planner = FakePlannerModel(latency=args.gemini_latency, rate_429=args.rate_429, seed=2)
+
+        # Import sau configure_env; vá trước khi import app.py (init_system chạy ngay lúc import)
+        import backend.search_engine as search_engine
+        import backend.content_processor as content_processor
+        search_engine.build_service = lambda *a, **kw: self.cse
+        content_processor.verifier_model = self.verifier
+
+        cwd = os.getcwd()
+        os.chdir(ROOT)  # app.py đọc prompt / template theo đường dẫn tương đối
+        try:
+            with self.quiet():
+                import app
+                import asgi
+        finally:
+            os.chdir(cwd)
+        self.app = app
+        self.asgi = asgi
+        self.round = 0
+
+    @contextlib.contextmanager
+    def quiet(self):
+        if self.args.verbose:
+            yield
+            return
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+
+    def reset(self):
+        """Cache rỗng + module khởi tạo lại (mỗi mức concurrency bắt đầu từ cùng trạng thái)."""
+        import backend.disk_cache as disk_cache
+        import backend.doc_index as doc_index
+        from backend.rate_limiter import gemini_scheduler
+
+        self.round += 1
+        cache_dir = os.path.join(self.workdir, f"cache{self.round}")
+        disk_cache.CACHE_DIR = doc_index.CACHE_DIR = cache_dir
+
+        old = self.app.processor
+        cwd = os.getcwd()
+        os.chdir(ROOT)
+        try:
+            with self.quiet():
+                self.app.init_system()
+        finally:
+            os.chdir(cwd)
+        if old is not None and old.parser_pool is not None:
+            old.parser_pool.shutdown()
+        if self.app.pipeline is None:
+            sys.exit("init_system() failed, rerun with --verbose")
+        self.app.q_gen.model = self.planner
+        self.asgi.async_pipeline = self.asgi.AsyncSearchPipeline(self.app.searchor, self.app.processor)
+
+        # 429 ở lượt trước làm scheduler giảm RPM: cấu hình lại ngân sách
+        for name, env in (("verifier", "GEMINI_VERIFIER_RPM"), ("planner", "GEMINI_PLANNER_RPM")):
+            gemini_scheduler.configure(name, rpm=float(os.environ[env]), tpm=float(os.getenv(f"GEMINI_{name.upper()}_TPM", 10 ** 9)))
+
+    # --- Kịch bản ---
+
+    def _message(self, tag, i):
+        topic_en, topic_vi, _ = TOPICS[i % len(TOPICS)]
+        return f"Tìm bài tập {topic_vi} ({topic_en}) mức {i // len(TOPICS) + 1} #{tag}"
+
+    def _chat_payload(self, tag, i):
+        return {
+            "message": self._message(tag, i),
+            "chat_id": f"bench-{tag}-{i}",
+            "config": {
+                "max_queries": self.args.max_queries,
+                "results_per_query": self.args.results_per_query,
+                "include_timings": True,
+            },
+        }
+
+    @staticmethod
+    def _consume(sample, buffer, chunk, start):
+        """Đọc các dòng NDJSON hoàn chỉnh trong buffer + chunk, trả về phần còn dư."""
+        buffer += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if event["type"] == "match":
+                sample["matches"] += 1
+                if sample["ttfr"] is None:
+                    sample["ttfr"] = time.perf_counter() - start
+            elif event["type"] == "error":
+                sample["error"] = event["content"]
+            elif event["type"] == "timings":
+                sample["timings"] = event["data"]
+        return buffer
+
+    def chat_once(self, job):
+        tag, i = job
+        client = self.app.app.test_client()
+        start = time.perf_counter()
+        sample = {"ttfr": None, "error": None, "matches": 0}
+        response = client.post("/api/chat-stream", json=self._chat_payload(tag, i), buffered=False)
+        try:
+            buffer = b""
+            for chunk in response.response:
+                buffer = self._consume(sample, buffer, chunk, start)
+        finally:
+            response.close()
+        sample["latency"] = time.perf_counter() - start
+        return sample
+
+    async def achat_once(self, job):
+        """Cùng request như chat_once nhưng gọi thẳng ASGI app (asgi.py) trong event loop."""
+        tag, i = job
+        body = json.dumps(self._chat_payload(tag, i)).encode("utf-8")
+        scope = {"type": "http", "method": "POST", "path": "/api/chat-stream", "headers": []}
+        requested = False
+        sample = {"ttfr": None, "error": None, "matches": 0}
+        buffer = b""
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await asyncio.Event().wait()  # Client không ngắt kết nối
+
+        async def send(message):
+            nonlocal buffer
+            if message["type"] == "http.response.start" and message["status"] != 200:
+                sample["error"] = f"HTTP {message['status']}"
+            elif message["type"] == "http.response.body":
+                buffer = self._consume(sample, buffer, message.get("body", b""), start)
+
+        start = time.perf_counter()
+        await self.asgi.application(scope, receive, send)
+        sample["latency"] = time.perf_counter() - start
+        return sample
+
+    def search_once(self, job):
+        tag, i = job
+        plan = search_plan_for(self._message(tag, i))
+        start = time.perf_counter()
+        links = self.app.searchor.execute_search_plan(
+            plan, max_queries=self.args.max_queries, results_per_query=self.args.results_per_query
+        )
+        return {"latency": time.perf_counter() - start, "error": None if links else "no links"}
+
+    def fetch_once(self, url):
+        start = time.perf_counter()
+        pages_data, _ = self.app.processor.fetch_content(url)
+        return {"latency": time.perf_counter() - start, "error": None if pages_data else "empty"}
+
+    def verify_once(self, job):
+        pages_data, doc_type, topic = job
+        start = time.perf_counter()
+        self.app.processor.verify_relevance(pages_data, doc_type, topic, "Level 2")
+        return {"latency": time.perf_counter() - start, "error": None}
+
+    def jobs(self, scenario, tag):
+        if scenario in ("chat", "achat", "search"):
+            return [(tag, i) for i in range(self.args.requests)]
+        urls = self.server.urls(namespace=tag)
+        if scenario == "fetch":
+            return urls
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            docs = list(executor.map(self.app.processor.fetch_content, urls))
+        return [(pages, doc_type, TOPICS[i % len(TOPICS)][0]) for i, (pages, doc_type) in enumerate(docs) if pages]
+
+    def run(self, scenario, concurrency):
+        func = getattr(self, f"{scenario}_once")
+        self.reset()
+        tag = f"{scenario}{concurrency}"
+        with self.quiet():
+            jobs = self.jobs(scenario, tag)
+            runner = run_async if asyncio.iscoroutinefunction(func) else run_concurrent
+            if self.args.warm:
+                runner(func, jobs, concurrency)
+            samples, wall = runner(func, jobs, concurrency)
+        result = summarize(scenario, concurrency, samples, wall)
+        if scenario in ("chat", "achat"):
+            result["matches_avg"] = sum(s["matches"] for s in samples) / len(samples)
+            result["stages_ms"] = merge_timings(s.get("timings") for s in samples)
+        return result
+
+    def close(self):
+        self.server.close()
+        if self.app.processor is not None and self.app.processor.parser_pool is not None:
+            self.app.processor.parser_pool.shutdown()
+
+
+def merge_timings(snapshots):
+    """Tổng thời gian từng stage (ms) trung bình trên mỗi request chat."""
+    totals, n = {}, 0
+    for snap in snapshots:
+        if not snap:
+            continue
+        n += 1
+        for stage, entry in snap.items():
+            totals[stage] = totals.get(stage, 0.0) + entry["total_ms"]
+    return {stage: round(total / n, 1) for stage, total in sorted(totals.items())} if n else {}
+
+
+def fmt(value, scale=1000.0):
+    return "-" if value is None else f"{value * scale:.0f}"
+
+
+def print_report(results, harness):
+    print(f"\n{'scenario':<10}{'conc':>6}{'n':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'ttfr p50':>10}{'ttfr p95':>10}{'ops/s':>9}")
+    for r in results:
+        print(f"{r['scenario']:<10}{r['concurrency']:>6}{r['n']:>6}{r['errors']:>5}{fmt(r['p50']):>10}"
+              f"{fmt(r['p95']):>10}{fmt(r['ttfr_p50']):>10}{fmt(r['ttfr_p95']):>10}{r['throughput']:>9.2f}")
+    for r in results:
+        if r.get("stages_ms"):
+            stages = ", ".join(f"{k}={v:.0f}" for k, v in r["stages_ms"].items())
+            print(f"{r['scenario']} c={r['concurrency']}: {r['matches_avg']:.1f} matches/request, stage ms/request: {stages}")
+    print(f"\nfake gemini: verifier {harness.verifier.calls} calls ({harness.verifier.rate_limited} x 429), "
+          f"planner {harness.planner.calls} calls ({harness.planner.rate_limited} x 429); "
+          f"fake CSE: {harness.cse.calls} calls")
+
+
+def main():
+    args = parse_args()
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    workdir = tempfile.mkdtemp(prefix="math-search-bench-")
+    configure_env(args, workdir)
+    harness = Harness(args, workdir)
+    results = []
+    try:
+        for scenario in scenarios:
+            for concurrency in levels:
+                result = harness.run(scenario, concurrency)
+                print(f"{scenario} c={concurrency}: p50 {fmt(result['p50'])} ms, "
+                      f"{result['throughput']:.2f} ops/s", flush=True)
+                results.append(result)
+    finally:
+        harness.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results, harness)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Kiểm tra + đo PlanCache (khớp gần đúng).
+
+- Các cặp yêu cầu mang nghĩa ngược nhau (chỉ khác 1 từ) không được dùng lại plan của nhau dù độ giống
+  n-gram rất cao; các cặp chỉ khác stopword / cách gọi mức độ khó thì vẫn dùng lại.
+- Thời gian 1 lần tra gần đúng (miss) theo số mục trong cache.
+
+Chạy: python benchmarks/bench_plan_cache.py
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cache riêng trong thư mục tạm, không đụng .cache thật
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="bench_plan_cache_"))
+
+from backend.plan_cache import PlanCache, normalize_request, similarity
+
+# (yêu cầu đã cache, yêu cầu mới): nghĩa ngược nhau -> không được dùng lại
+OPPOSITE = [
+    ("bài tập tiêu chuẩn so sánh cho chuỗi số dương convergent series",
+     "bài tập tiêu chuẩn so sánh cho chuỗi số dương divergent series"),
+    ("bài tập chéo hóa và trị riêng của symmetric matrices",
+     "bài tập chéo hóa và trị riêng của skew-symmetric matrices"),
+    ("bài tập phương trình vi phân cấp hai tuyến tính hệ số hằng",
+     "bài tập phương trình vi phân cấp hai phi tuyến hệ số hằng"),
+]
+# Cùng nghĩa -> phải dùng lại
+EQUIVALENT = [
+    ("Tìm bài tập tích phân đường mức vận dụng cao", "tìm các bài tập tích phân đường, mức nâng cao"),
+    ("bài tập tích phân đường loại hai mức 2", "tìm bài tập tích phân đường loại hai mức trung bình"),
+    ("tích phân bội ba", "Tích phân bội ba."),
+]
+
+
+def check():
+    failures = []
+    for i, (cached, query) in enumerate(OPPOSITE + EQUIVALENT):
+        cache = PlanCache()
+        version = f"check-{i}"
+        cache.set(cached, version, {"topic": cached})
+        reused = cache.get(query, version) is not None
+        expected = i >= len(OPPOSITE)
+        score = similarity(normalize_request(cached), normalize_request(query))
+        print(f"{'reuse' if reused else 'miss ':<6} dice={score:.3f}  {cached!r} -> {query!r}")
+        # Cặp ngược nghĩa phải vượt ngưỡng n-gram, nếu không thì không kiểm tra được phần so tập từ
+        if reused != expected or score < cache.threshold:
+            failures.append((cached, query))
+    if failures:
+        sys.exit(f"PlanCache check failed: {failures}")
+    print(f"check: {len(OPPOSITE)} opposite pairs rejected, {len(EQUIVALENT)} equivalent pairs reused\n")
+
+
+def bench():
+    print(f"{'entries':>8}{'near miss (ms)':>16}")
+    for n in (100, 1000, 2000):
+        cache = PlanCache()
+        version = f"bench-{n}"
+        for i in range(n):
+            cache.set(f"bài tập chủ đề số {i} về giải tích và đại số tuyến tính", version, {"i": i})
+        cache.get("bài tập hình học không gian", version)  # tính sẵn n-gram/tập từ
+        t = timeit.timeit(lambda: cache.get("bài tập hình học không gian", version), number=20) / 20
+        print(f"{n:>8}{t * 1000:>16.3f}")
+
+
+if __name__ == "__main__":
+    check()
+    bench()
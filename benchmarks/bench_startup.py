@@ -0,0 +1,147 @@
+"""
+Benchmark thời gian khởi động 1 worker (quyết định tốc độ scale-out / restart).
+
+Mỗi lượt chạy trong 1 process Python mới, mạng bị chặn (mọi kết nối socket đều lỗi và được đếm):
+- interpreter: `python -c pass` (mốc nền),
+- import:      import app (gồm init_system: cache SQLite, lịch sử chat, prompt),
+- first_page:  GET / đầu tiên qua Flask test client (tính từ lúc bắt đầu import),
+- first_search_client / first_gemini_model: chi phí khởi tạo lười ở request đầu tiên
+  (service Custom Search từ discovery document đóng gói sẵn, SDK Gemini + model verifier).
+Báo cáo median / min / max (ms), các SDK nặng đã được nạp lúc khởi động và số lần thử kết nối mạng.
+
+Chạy: python benchmarks/bench_startup.py [--runs 5] [--json out.json]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+import shutil
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module chỉ nên được nạp khi cần (request đầu tiên), không phải lúc khởi động
+HEAVY_MODULES = ("google.generativeai", "google.api_core", "googleapiclient.discovery", "bs4", "pypdf")
+
+PROBE = r"""
+import os, sys, json, time, socket
+start = time.perf_counter()
+attempts = []
+
+def _blocked(*args, **kwargs):
+    attempts.append(repr(args[1:2] or args[:1]))
+    raise OSError("network disabled by bench_startup")
+
+socket.socket.connect = _blocked
+socket.socket.connect_ex = _blocked
+socket.create_connection = _blocked
+sys.path.insert(0, os.getcwd())
+
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+status = client.get("/").status_code
+first_page = time.perf_counter()
+loaded = [name for name in json.loads(os.environ["BENCH_HEAVY_MODULES"]) if name in sys.modules]
+
+t = time.perf_counter()
+service = app.searchor._get_service() if app.searchor else None
+first_search_client = time.perf_counter() - t
+
+import backend.content_processor as content_processor
+t = time.perf_counter()
+content_processor.get_verifier_model()
+first_gemini_model = time.perf_counter() - t
+
+print(json.dumps({
+    "import": imported - start,
+    "first_page": first_page - start,
+    "first_search_client": first_search_client if service is not None else None,
+    "first_gemini_model": first_gemini_model,
+    "status": status,
+    "heavy_modules": loaded,
+    "network_attempts": len(attempts),
+}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Worker startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Số process khởi động để lấy median")
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    return parser.parse_args()
+
+
+def child_env(workdir):
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": "offline",
+        "GOOGLE_API_KEY": "offline",
+        "GOOGLE_CSE_ID": "offline",
+        # Cache / lịch sử rỗng: đo lần khởi động của 1 worker mới
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "HISTORY_DB": os.path.join(workdir, "chat_history.db"),
+        "BENCH_HEAVY_MODULES": json.dumps(HEAVY_MODULES),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def run_probe(workdir):
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=child_env(workdir),
+        capture_output=True, text=True, timeout=120,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def interpreter_startup():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return time.perf_counter() - start
+
+
+def summary(values):
+    values = [v * 1000 for v in values if v is not None]
+    if not values:
+        return None
+    return {"median": statistics.median(values), "min": min(values), "max": max(values)}
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="math-search-startup-")
+    try:
+        baseline = [interpreter_startup() for _ in range(args.runs)]
+        probes = [run_probe(os.path.join(workdir, f"run{i}")) for i in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    metrics = {"interpreter": summary(baseline)}
+    for key in ("import", "first_page", "first_search_client", "first_gemini_model"):
+        metrics[key] = summary([p[key] for p in probes])
+
+    print(f"{'metric':<22}{'median ms':>11}{'min ms':>10}{'max ms':>10}")
+    for key, value in metrics.items():
+        if value is None:
+            print(f"{key:<22}{'-':>11}")
+            continue
+        print(f"{key:<22}{value['median']:>11.0f}{value['min']:>10.0f}{value['max']:>10.0f}")
+    heavy = sorted({name for p in probes for name in p["heavy_modules"]})
+    print(f"\nheavy modules loaded at startup: {', '.join(heavy) or 'none'}")
+    print(f"network connection attempts: {max(p['network_attempts'] for p in probes)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "metrics": metrics, "probes": probes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
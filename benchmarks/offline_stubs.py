@@ -0,0 +1,250 @@
+"""
+Các thành phần giả lập dùng cho benchmark offline (không cần Gemini, Google CSE hay Internet):
+
+- CorpusServer: HTTP server cục bộ phục vụ bộ tài liệu tổng hợp (PDF nhiều trang + trang HTML,
+  gồm cả tài liệu có bài tập, tài liệu không liên quan và bản mirror gần trùng).
+- FakeCustomSearch: thay cho service của googleapiclient (cse().list(...).execute()).
+- FakeVerifierModel / FakePlannerModel: thay cho genai.GenerativeModel, có độ trễ và tỉ lệ 429 cấu hình được.
+"""
+import re
+import json
+import time
+import zlib
+import random
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOPICS = [
+    ("Integration by parts", "Tích phân từng phần", ["integration", "parts", "antiderivative"]),
+    ("Residue theorem", "Định lý thặng dư", ["residue", "contour", "singularity"]),
+    ("Eigenvalues and diagonalization", "Trị riêng và chéo hóa", ["eigenvalue", "diagonalization", "matrix"]),
+    ("Power series convergence", "Hội tụ chuỗi lũy thừa", ["series", "convergence", "radius"]),
+    ("Partial derivatives", "Đạo hàm riêng", ["partial", "derivative", "gradient"]),
+]
+
+_FILLER = (
+    "we consider the function defined on the interval and study its behaviour near the boundary "
+    "the following lemma is used throughout the chapter and the proof is left to the reader "
+    "recall the definition from the previous section together with the standard notation "
+).split()
+
+
+def _make_text(rng, words, n_words, exercise_rate):
+    out = []
+    for i in range(n_words):
+        if rng.random() < exercise_rate:
+            out.append(f"Exercise {i % 40 + 1}. Compute the {rng.choice(words)} of f(x) = x^{rng.randint(2, 9)}.")
+        elif rng.random() < 0.08:
+            out.append(rng.choice(words))
+        else:
+            out.append(rng.choice(_FILLER))
+    return " ".join(out)
+
+
+def make_pdf(pages):
+    """PDF tối giản (font Helvetica, text ASCII) mà pypdf bóc được text. pages: list chuỗi."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    kids = []
+    for text in pages:
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)][:60]
+        escaped = [ln.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for ln in lines]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({ln}) Tj T*" for ln in escaped) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % off for off in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def build_corpus(n_docs=60, seed=1):
+    """
+    Trả về dict path -> (content_type, bytes). Khoảng 1/3 là PDF 6 trang, còn lại là HTML;
+    mỗi topic có tài liệu có bài tập, tài liệu chỉ có lý thuyết, và vài bản mirror gần trùng.
+    """
+    rng = random.Random(seed)
+    corpus = {}
+    for i in range(n_docs):
+        topic_en, topic_vi, words = TOPICS[i % len(TOPICS)]
+        exercise_rate = 0.05 if i % 3 else 0.0
+        if i % 7 == 6 and i >= 7:
+            # Mirror: cùng nội dung với tài liệu cách đó 7 vị trí, khác 1 dòng
+            src_type, src_body = corpus[f"/doc{i - 7}.html"] if f"/doc{i - 7}.html" in corpus else (None, None)
+            if src_body:
+                corpus[f"/mirror{i}.html"] = (src_type, src_body.replace(b"</body>", b"<p>mirror</p></body>"))
+                continue
+        if i % 3 == 0:
+            pages = [f"{topic_en} - page {p + 1}. " + _make_text(rng, words, 400, 0.04) for p in range(6)]
+            corpus[f"/doc{i}.pdf"] = ("application/pdf", make_pdf(pages))
+        else:
+            text = f"{topic_en} ({topic_vi}) " + _make_text(rng, words, 2500, exercise_rate)
+            if exercise_rate:
+                text += " Bài tập tự luyện có lời giải."
+            html = f"<html><head><title>{topic_en}</title></head><body><p>{text}</p></body></html>"
+            corpus[f"/doc{i}.html"] = ("text/html; charset=utf-8", html.encode("utf-8"))
+    return corpus
+
+
+class CorpusServer:
+    """HTTP server cục bộ (thread riêng). Bỏ qua query string nên cùng 1 tài liệu có thể có nhiều URL."""
+
+    def __init__(self, corpus, latency=0.0):
+        self.corpus = corpus
+        self.latency = latency
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                entry = server.corpus.get(self.path.split("?", 1)[0])
+                if entry is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                content_type, body = entry
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def urls(self, namespace=""):
+        suffix = f"?ns={namespace}" if namespace else ""
+        return [f"{self.base_url}{path}{suffix}" for path in sorted(self.corpus)]
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+class FakeCustomSearch:
+    """Giả lập service Custom Search: mỗi query trả về cố định `num` link trong corpus (theo crc32 của query)."""
+
+    def __init__(self, urls, latency=0.15):
+        self.urls = urls
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def cse(self):
+        return self
+
+    def list(self, q, cx, num, **kwargs):
+        with self._lock:
+            self.calls += 1
+        start = zlib.crc32(q.encode("utf-8")) % len(self.urls)
+        links = [self.urls[(start + 3 * j) % len(self.urls)] for j in range(num)]
+        latency = self.latency
+        return SimpleNamespace(execute=lambda **kw: (time.sleep(latency), {"items": [{"link": u} for u in links]})[1])
+
+
+class _FakeModelBase:
+    def __init__(self, latency=0.5, rate_429=0.0, seed=0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.calls = 0
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            limited = self._rng.random() < self.rate_429
+            if limited:
+                self.rate_limited += 1
+        time.sleep(self.latency)
+        if limited:
+            raise Exception("429 Resource has been exhausted (e.g. check quota). Please retry in 0.2s.")
+
+    @staticmethod
+    def _response(prompt, text):
+        usage = SimpleNamespace(prompt_token_count=len(prompt) // 4, candidates_token_count=len(text) // 4)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+_EXERCISE_RE = re.compile(r"Exercise \d+\.")
+
+
+class FakeVerifierModel(_FakeModelBase):
+    """
+    Thay cho model thẩm định. Verdict suy ra từ nội dung: có "Exercise N." -> đạt (score 6-9), không -> score 3.
+    Nhận diện 3 loại prompt: thẩm định 1 tài liệu, batch (<<<DOC i>>>) và sửa LaTeX.
+    """
+
+    LATEX_MARKER = "Mathematical Typesetting Expert"
+
+    def generate_content(self, prompt, **kwargs):
+        self._enter()
+        if self.LATEX_MARKER in prompt:
+            return self._response(prompt, "Compute $\\int x^{2}\\,dx$.")
+        if "<<<DOC " in prompt:
+            verdicts = []
+            for pos, chunk in enumerate(prompt.split("<<<DOC ")[1:]):
+                verdict = self._verdict(chunk.split("<<<END DOC", 1)[0])
+                verdict["doc_index"] = int(chunk.split(" ", 1)[0]) if chunk.split(" ", 1)[0].isdigit() else pos
+                verdicts.append(verdict)
+            return self._response(prompt, json.dumps(verdicts))
+        return self._response(prompt, json.dumps(self._verdict(prompt)))
+
+    @staticmethod
+    def _verdict(context):
+        exercises = len(_EXERCISE_RE.findall(context))
+        score = min(9, 5 + exercises // 3) if exercises else 3
+        return {
+            "is_relevant": bool(exercises), "contains_exercises": bool(exercises), "score": score,
+            "reason": "synthetic", "page_location": "Trang 1",
+            "sample_question": "Compute the integral of x^2" if exercises else "",
+        }
+
+
+def search_plan_for(user_input):
+    """Search plan tất định cho 1 yêu cầu: topic chọn theo nội dung, query có gắn tag để không trùng cache."""
+    topic_en, topic_vi, words = TOPICS[zlib.crc32(user_input.encode("utf-8")) % len(TOPICS)]
+    tag = zlib.crc32(user_input.encode("utf-8")) % 100000
+    return {
+        "analysis": {"topic_en": topic_en, "topic_vi": topic_vi, "concepts": words, "difficulty": "Level 2"},
+        "tier_1_topic_focused": [f"{topic_en} exercises pdf r{tag}", f"{topic_vi} bài tập r{tag}"],
+        "tier_2_context_specific": [f"{topic_en} problems with solutions r{tag}", f"{words[0]} worksheet r{tag}"],
+        "tier_3_descriptive_chaining": [f"{words[1]} {words[2]} practice r{tag}", f"{topic_en} exam r{tag}"],
+    }
+
+
+class FakePlannerModel(_FakeModelBase):
+    """Thay cho model sinh search plan (xem search_plan_for)."""
+
+    def generate_content(self, user_input, **kwargs):
+        self._enter()
+        plan = search_plan_for(user_input)
+        return self._response(user_input, json.dumps(plan, ensure_ascii=False))